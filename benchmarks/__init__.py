@@ -0,0 +1 @@
+"""Benchmarks for vyoma_download, run against the mock Edmingle server."""
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+API Request Path Benchmark
+
+Measures the client-side overhead of an API call (headers, query string,
+request preparation and JSON parsing), for the previous request path (a
+session request with headers built on every call) and the current one (a
+copy of a request prepared once per AuthContext), without the network.
+The complete round trip is then measured against the mock Edmingle server.
+
+Usage
+-----
+    python -m benchmarks.bench_api --calls 2000
+
+@author: Hrishikesh Terdalkar
+"""
+
+import argparse
+import json
+import sys
+import time
+from urllib.parse import urlencode
+
+import requests
+
+from vyoma_download import fastjson
+from vyoma_download.edmingle import EdmingleAPI
+
+from tests.mock_server import MockEdmingleServer
+from .common import add_mock_arguments, config_from_args, summarize
+
+###############################################################################
+
+
+def legacy_call(
+    api: EdmingleAPI,
+    session: requests.Session,
+    path: str,
+    data: dict,
+    body: bytes,
+):
+    """Request path before headers were prebuilt and bytes parsed"""
+    headers = {
+        "User-Agent": api.user_agent,
+        "Accept": "application/json, text/javascript, */*; q=0.01",
+        "Accept-Language": "en-US,en;q=0.5",
+        "Accept-Encoding": "gzip, deflate, br",
+        "Connection": "keep-alive",
+        "Origin": api.host,
+        "DNT": "1",
+        "Referer": api.host,
+        "Sec-Fetch-Dest": "empty",
+        "Sec-Fetch-Mode": "cors",
+        "Sec-Fetch-Site": "cross-site",
+        "Sec-GPC": "1",
+        "TE": "trailers",
+    }
+    request_headers = dict(headers, **api.auth.headers)
+    option_string = "&".join(f"{k}={v}" for k, v in data.items())
+    url = f"{api.api_endpoint}/{path}?{option_string}"
+    # as in requests.Session.request
+    prepared = session.prepare_request(
+        requests.Request("GET", url, headers=request_headers)
+    )
+    session.merge_environment_settings(prepared.url, {}, None, None, None)
+    return json.loads(body.decode().strip())
+
+
+def current_call(
+    api: EdmingleAPI,
+    session: requests.Session,
+    path: str,
+    data: dict,
+    body: bytes,
+):
+    """Current request path"""
+    prepared = api.prepared_request(api.auth).copy()
+    prepared.prepare_url(f"{api.api_endpoint}/{path}?{urlencode(data)}", None)
+    return fastjson.loads(body)
+
+
+METHODS = {"legacy": legacy_call, "current": current_call}
+
+###############################################################################
+
+
+def overhead(method, api: EdmingleAPI, calls: int, path, data, body) -> float:
+    """Mean client-side overhead of a call, in seconds"""
+    session = requests.Session()
+    try:
+        start = time.perf_counter()
+        for _ in range(calls):
+            method(api, session, path, data, body)
+        return (time.perf_counter() - start) / calls
+    finally:
+        session.close()
+
+
+def round_trips(api: EdmingleAPI, calls: int, class_id, section_id) -> list:
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        api.get_section_resources(class_id, section_id)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark the API request path")
+    add_mock_arguments(p)
+    p.add_argument("--calls", type=int, default=2000,
+                   help="Number of calls per measurement")
+    args = p.parse_args()
+
+    config = config_from_args(args)
+    with MockEdmingleServer(config) as server:
+        api = EdmingleAPI(
+            username=config.username,
+            password=config.password,
+            hostname=server.api_host,
+            api_host=server.api_host,
+            protocol=server.protocol,
+        )
+        if not api.login():
+            print("Login failed")
+            return 1
+
+        course = server.data.courses[1000]
+        class_id, section_id = course["class_id"], course["sections"][0]
+        path = f"student/sections/{section_id}/resources"
+        data = {"class_id": class_id}
+        body = api._request("GET", path, data)[1]
+
+        print(f"JSON backend: {fastjson.JSON_BACKEND}, "
+              f"response of {len(body)} bytes")
+        print("Client-side overhead per call:")
+        for name, method in METHODS.items():
+            best = min(
+                overhead(method, api, args.calls, path, data, body)
+                for _ in range(args.repeat)
+            )
+            print(f"  {name:<10} {best * 1e6:8.1f} us")
+
+        stats = summarize(round_trips(api, args.calls, class_id, section_id))
+        print(f"Round trips ({stats['n']} calls): "
+              f"mean {stats['mean'] * 1e3:.2f} ms  "
+              f"p50 {stats['p50'] * 1e3:.2f} ms  "
+              f"p99 {stats['p99'] * 1e3:.2f} ms")
+        api.close()
+    return 0
+
+###############################################################################
+
+
+if __name__ == "__main__":
+    sys.exit(main())
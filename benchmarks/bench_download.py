@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+End-to-end `download_course` Benchmark
+
+Runs `Vyoma.download_course` against the mock Edmingle server and reports
+throughput along with wall-clock and per-API-call latency.
+
+Usage
+-----
+    python -m benchmarks.bench_download --profile small-pdf --latency 0.02
+
+@author: Hrishikesh Terdalkar
+"""
+
+import argparse
+import contextlib
+import functools
+import io
+import json
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from vyoma_download.vyoma import Vyoma
+
+from tests.mock_server import MockEdmingleServer
+from .common import (
+    add_mock_arguments, config_from_args, human_bytes, summarize
+)
+
+###############################################################################
+
+
+def timed_api(vyoma: Vyoma, timings: dict):
+    """Record the latency of every API call made by a session"""
+    api = vyoma.api
+
+    @functools.wraps(api)
+    def wrapper(path, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return api(path, *args, **kwargs)
+        finally:
+            key = "/".join(path.split("/")[:2])
+            timings[key].append(time.perf_counter() - start)
+
+    vyoma.api = wrapper
+
+
+def run_once(server: MockEdmingleServer, course_id: int) -> dict:
+    config = server.data.config
+    download_dir = tempfile.mkdtemp(prefix="vyoma-bench-")
+    timings = defaultdict(list)
+    try:
+        start = time.perf_counter()
+        vyoma = Vyoma(
+            username=config.username,
+            password=config.password,
+            download_dir=download_dir,
+            api_host=server.api_host,
+            protocol=server.protocol,
+        )
+        login_time = time.perf_counter() - start
+        timed_api(vyoma, timings)
+        with contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()):
+            download_log = vyoma.download_course(course_id)
+        total_time = time.perf_counter() - start
+    finally:
+        shutil.rmtree(download_dir, ignore_errors=True)
+
+    return {
+        "login": login_time,
+        "total": total_time,
+        "api": timings,
+        "failed": len(download_log["material"]["failed"]),
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark download_course")
+    add_mock_arguments(p)
+    p.add_argument("--json", action="store_true",
+                   help="Print results as JSON")
+    args = p.parse_args()
+
+    config = config_from_args(args)
+    with MockEdmingleServer(config) as server:
+        course_id = min(server.data.courses)
+        num_bytes = server.data.course_bytes(course_id)
+        num_materials = sum(
+            len(server.data.sections[section_id]["resources"])
+            for section_id in server.data.courses[course_id]["sections"]
+        )
+        runs = [run_once(server, course_id) for _ in range(args.repeat)]
+
+    totals = [run["total"] for run in runs]
+    api_timings = defaultdict(list)
+    for run in runs:
+        for key, values in run["api"].items():
+            api_timings[key].extend(values)
+
+    best = min(totals)
+    result = {
+        "profile": args.profile,
+        "materials": num_materials,
+        "bytes": num_bytes,
+        "failed": [run["failed"] for run in runs],
+        "total": summarize(totals),
+        "login": summarize([run["login"] for run in runs]),
+        "throughput_bytes": num_bytes / best,
+        "throughput_materials": num_materials / best,
+        "api": {key: summarize(values) for key, values in api_timings.items()},
+    }
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return 0
+
+    print(f"Profile: {args.profile} ({num_materials} materials, "
+          f"{human_bytes(num_bytes)})")
+    print(f"Total: best {best:.3f}s, median {result['total']['p50']:.3f}s "
+          f"over {args.repeat} runs")
+    print(f"Throughput: {human_bytes(result['throughput_bytes'])}/s, "
+          f"{result['throughput_materials']:.1f} materials/s")
+    print(f"Failed materials: {result['failed']}")
+    print("API latency (ms):")
+    for key, stats in sorted(result["api"].items()):
+        print(f"  {key:<28} n={stats['n']:<5} "
+              f"p50={stats['p50'] * 1000:8.2f} "
+              f"p95={stats['p95'] * 1000:8.2f} "
+              f"max={stats['max'] * 1000:8.2f}")
+    return 0
+
+###############################################################################
+
+
+if __name__ == "__main__":
+    sys.exit(main())
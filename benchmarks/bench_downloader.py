@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File Downloader Benchmark
+
+Compares the in-package streaming downloader with `requests_downloader`
+(the previous download path, if installed) on the file materials served by
+the mock Edmingle server.
+
+Usage
+-----
+    python -m benchmarks.bench_downloader --profile small-pdf
+    python -m benchmarks.bench_downloader --profile large-audio
+
+@author: Hrishikesh Terdalkar
+"""
+
+import argparse
+import contextlib
+import io
+import shutil
+import sys
+import tempfile
+import time
+
+import requests
+
+from vyoma_download.downloader import Downloader
+
+from tests.mock_server import MockEdmingleServer
+from .common import add_mock_arguments, config_from_args, human_bytes
+
+###############################################################################
+
+
+def native(session: requests.Session, url: str, path: str):
+    return Downloader(session).download(url, path)
+
+
+def legacy(session: requests.Session, url: str, path: str):
+    from requests_downloader import download
+    return download(url, download_path=path, session=session)
+
+
+METHODS = {"native": native, "requests_downloader": legacy}
+
+###############################################################################
+
+
+def run_once(server: MockEdmingleServer, method) -> float:
+    base_url = f"{server.protocol}//{server.api_host}/files"
+    files = [
+        (f"{base_url}/{material_id}/{material['file_name']}",
+         material["file_name"])
+        for material_id, material in server.data.materials.items()
+        if material["source"] == "file"
+    ]
+    download_dir = tempfile.mkdtemp(prefix="vyoma-bench-")
+    session = requests.Session()
+    try:
+        start = time.perf_counter()
+        with contextlib.redirect_stderr(io.StringIO()):
+            for url, filename in files:
+                if not method(session, url, f"{download_dir}/{filename}"):
+                    raise RuntimeError(f"Download of {url} failed")
+        return time.perf_counter() - start
+    finally:
+        session.close()
+        shutil.rmtree(download_dir, ignore_errors=True)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark file downloaders")
+    add_mock_arguments(p)
+    args = p.parse_args()
+
+    methods = dict(METHODS)
+    try:
+        import requests_downloader  # noqa
+    except ImportError:
+        print("requests_downloader is not installed, skipping it.")
+        methods.pop("requests_downloader")
+
+    config = config_from_args(args)
+    with MockEdmingleServer(config) as server:
+        num_files = sum(
+            material["source"] == "file"
+            for material in server.data.materials.values()
+        )
+        num_bytes = sum(
+            material.get("size", 0)
+            for material in server.data.materials.values()
+        )
+        print(f"Profile: {args.profile} ({num_files} files, "
+              f"{human_bytes(num_bytes)})")
+        for name, method in methods.items():
+            timings = [run_once(server, method) for _ in range(args.repeat)]
+            best = min(timings)
+            print(f"  {name:<20} best {best:.3f}s  "
+                  f"{human_bytes(num_bytes / best)}/s  "
+                  f"{num_files / best:.1f} files/s")
+    return 0
+
+###############################################################################
+
+
+if __name__ == "__main__":
+    sys.exit(main())
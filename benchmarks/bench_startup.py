@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Startup Time Benchmark
+
+Measures the wall-clock time of short commands and imports, each in a fresh
+interpreter, and lists the heavy dependencies that they load.
+
+Usage
+-----
+    python -m benchmarks.bench_startup --repeat 10
+
+@author: Hrishikesh Terdalkar
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+
+from .common import summarize
+
+###############################################################################
+
+COMMANDS = {
+    "python": ["-c", "pass"],
+    "import package": ["-c", "import vyoma_download"],
+    "vyoma-dl --version": ["-m", "vyoma_download.cli", "--version"],
+    "vyoma-dl --help": ["-m", "vyoma_download.cli", "--help"],
+    "import Vyoma": ["-c", "from vyoma_download import Vyoma"],
+}
+
+HEAVY_MODULES = ["requests", "tqdm", "tabulate", "vyoma_download.vyoma"]
+
+###############################################################################
+
+
+def run_once(arguments: list) -> float:
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable] + arguments,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True
+    )
+    return time.perf_counter() - start
+
+
+def loaded_modules(arguments: list) -> list:
+    """Heavy modules loaded by a command"""
+    if arguments[0] != "-c":
+        arguments = [
+            "-c",
+            "import runpy, sys; sys.argv = [''] + {!r}\n"
+            "try:\n"
+            "    runpy.run_module({!r}, run_name='__main__')\n"
+            "except SystemExit:\n"
+            "    pass".format(arguments[2:], arguments[1])
+        ]
+    code = (
+        "import contextlib, io\n"
+        "with contextlib.redirect_stdout(io.StringIO()):\n"
+        + "".join(f"    {line}\n" for line in arguments[1].splitlines()) +
+        "import sys\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+    )
+    modules = result.stdout.strip()
+    return modules.split(",") if modules else []
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark the startup time")
+    p.add_argument("--repeat", type=int, default=10,
+                   help="Number of runs of every command")
+    args = p.parse_args()
+
+    print(f"{'Command':<20} {'min':>8} {'p50':>8}  Heavy modules")
+    for name, arguments in COMMANDS.items():
+        stats = summarize([run_once(arguments) for _ in range(args.repeat)])
+        heavy = ", ".join(loaded_modules(arguments)) or "-"
+        print(f"{name:<20} {stats['min'] * 1e3:6.1f}ms "
+              f"{stats['p50'] * 1e3:6.1f}ms  {heavy}")
+    return 0
+
+###############################################################################
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Time to First Byte Benchmark
+
+Measures the time from the creation of a session to the first byte of the
+first material of a course (sign-in, course lookup, course details and the
+first transfer), with the startup steps run one after the other and
+concurrently. Every run starts from the state of a previous run (known file
+hosts) with a stale course catalog, against the mock Edmingle server with
+API and connection latencies, and files served from a separate host.
+
+Usage
+-----
+    python -m benchmarks.bench_ttfb --latency 0.02 --connect-latency 0.1
+
+@author: Hrishikesh Terdalkar
+"""
+
+import argparse
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import replace
+from pathlib import Path
+
+from vyoma_download.progress import ProgressReporter
+from vyoma_download.state import STATE_FILE
+from vyoma_download.vyoma import Vyoma
+
+from tests.mock_server import MockEdmingleServer
+from .common import add_mock_arguments, config_from_args, summarize
+
+###############################################################################
+
+
+class FirstByte(ProgressReporter):
+    """Progress reporter that records the time of the first byte"""
+
+    def __init__(self):
+        self.received = threading.Event()
+        self.time = None
+
+    def advance(self, num_bytes: int):
+        if num_bytes and not self.received.is_set():
+            self.time = time.perf_counter()
+            self.received.set()
+
+###############################################################################
+
+
+def session(server: MockEdmingleServer, download_dir: str, workers: int):
+    config = server.data.config
+    return Vyoma(
+        username=config.username,
+        password=config.password,
+        api_host=server.api_host,
+        protocol=server.protocol,
+        download_dir=download_dir,
+        max_workers=4,
+        startup_workers=workers,
+    )
+
+
+def time_to_first_byte(
+    server: MockEdmingleServer, primed_dir: str, workers: int
+) -> tuple:
+    """Durations (startup, first byte) of a run, in seconds"""
+    download_dir = tempfile.mkdtemp(prefix="vyoma-bench-")
+    shutil.copy(Path(primed_dir) / STATE_FILE, download_dir)
+    progress = FirstByte()
+    try:
+        start = time.perf_counter()
+        vyoma = session(server, download_dir, workers)
+        started = time.perf_counter() - start
+
+        course_id = vyoma.find_course("Gita")[0]["course_id"]
+        course_log = vyoma.get_course_details(course_id)
+        results = vyoma.iter_pipeline(
+            course_id, course_log=course_log, progress=progress
+        )
+        for _ in results:
+            if progress.received.is_set():
+                break
+        results.close()
+        vyoma.close()
+        return started, progress.time - start
+    finally:
+        shutil.rmtree(download_dir, ignore_errors=True)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark the time to first byte")
+    add_mock_arguments(p)
+    p.add_argument("--connect-latency", type=float, default=0.1,
+                   help="Delay of every new connection in seconds")
+    p.set_defaults(latency=0.02, repeat=5)
+    args = p.parse_args()
+
+    # files are served from a separate origin, as from a CDN
+    config = replace(
+        config_from_args(args),
+        connect_latency=args.connect_latency,
+        file_hostname="localhost",
+    )
+    primed_dir = tempfile.mkdtemp(prefix="vyoma-bench-")
+    try:
+        with MockEdmingleServer(config) as server:
+            # a previous run, which records the file hosts
+            vyoma = session(server, primed_dir, 1)
+            vyoma.download_course(1000)
+            vyoma.close()
+
+            print(f"{'Startup':<12} {'startup':>10} {'first byte':>12}")
+            for name, workers in [("sequential", 1), ("parallel", 8)]:
+                runs = [
+                    time_to_first_byte(server, primed_dir, workers)
+                    for _ in range(args.repeat)
+                ]
+                started = summarize([run[0] for run in runs])
+                first_byte = summarize([run[1] for run in runs])
+                print(f"{name:<12} {started['p50'] * 1e3:8.1f}ms "
+                      f"{first_byte['p50'] * 1e3:10.1f}ms")
+    finally:
+        shutil.rmtree(primed_dir, ignore_errors=True)
+    return 0
+
+###############################################################################
+
+
+if __name__ == "__main__":
+    sys.exit(main())
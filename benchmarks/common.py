@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Common Benchmark Utilities
+
+@author: Hrishikesh Terdalkar
+"""
+
+import argparse
+import math
+import statistics
+from dataclasses import replace
+from typing import Dict, List
+
+from tests.mock_server import MockConfig
+
+###############################################################################
+
+PROFILES = {
+    "mixed": MockConfig(),
+    "small-pdf": MockConfig(
+        num_courses=1,
+        num_sections=10,
+        audio_per_section=0,
+        document_per_section=20,
+        external_per_section=0,
+        html_per_section=0,
+        document_size=48 * 1024,
+    ),
+    "large-audio": MockConfig(
+        num_courses=1,
+        num_sections=2,
+        audio_per_section=2,
+        document_per_section=0,
+        external_per_section=0,
+        html_per_section=0,
+        audio_size=32 * 1024 * 1024,
+    ),
+}
+
+###############################################################################
+
+
+def add_mock_arguments(p: argparse.ArgumentParser):
+    """Add arguments to configure the mock server"""
+    p.add_argument("--profile", choices=PROFILES, default="mixed",
+                   help="Course profile served by the mock server")
+    p.add_argument("--sections", type=int, help="Sections per course")
+    p.add_argument("--audio", type=int, help="Audio files per section")
+    p.add_argument("--documents", type=int, help="Documents per section")
+    p.add_argument("--audio-size", type=int, help="Size of audio files")
+    p.add_argument("--document-size", type=int, help="Size of documents")
+    p.add_argument("--latency", type=float, default=0.0,
+                   help="API latency in seconds")
+    p.add_argument("--bandwidth", type=int, default=0,
+                   help="File bandwidth in bytes/second (0 for unlimited)")
+    p.add_argument("--error-rate", type=float, default=0.0,
+                   help="Probability of a material or file request failing")
+    p.add_argument("--repeat", type=int, default=3,
+                   help="Number of repetitions")
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    """Build a mock server configuration from parsed arguments"""
+    overrides = {
+        "num_sections": args.sections,
+        "audio_per_section": args.audio,
+        "document_per_section": args.documents,
+        "audio_size": args.audio_size,
+        "document_size": args.document_size,
+        "latency": args.latency,
+        "bandwidth": args.bandwidth,
+        "error_rate": args.error_rate,
+    }
+    return replace(
+        PROFILES[args.profile],
+        **{k: v for k, v in overrides.items() if v is not None}
+    )
+
+# --------------------------------------------------------------------------- #
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Percentile (0-100) using the nearest-rank method"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(p / 100 * len(ordered)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """Summary statistics of a list of timings"""
+    return {
+        "n": len(values),
+        "min": min(values) if values else 0.0,
+        "mean": statistics.mean(values) if values else 0.0,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else 0.0,
+    }
+
+
+def human_bytes(size: float) -> str:
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+###############################################################################
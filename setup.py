@@ -12,9 +12,9 @@ with open('HISTORY.rst') as history_file:
 
 requirements = [
     "requests",
-    "requests-downloader",
     "beautifulsoup4",
-    "tabulate"
+    "tabulate",
+    "tqdm"
 ]
 
 setup_requirements = ['pytest-runner', ]
@@ -24,7 +24,7 @@ test_requirements = ['pytest>=3', ]
 setup(
     author="Hrishikesh Terdalkar",
     author_email='hrishikeshrt@linuxmail.org',
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     classifiers=[
         'Development Status :: 4 - Beta',
         'License :: OSI Approved :: MIT License',
@@ -32,10 +32,11 @@ setup(
         'Topic :: Internet',
         'Topic :: Utilities',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
         'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ],
     description="Download course contents from sanskritfromhome.org",
     entry_points={
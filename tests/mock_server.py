@@ -0,0 +1,606 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Mock Edmingle Server
+
+A local stand-in for the Edmingle API and its file server, used by the tests
+and the benchmarks to exercise the complete download path offline.
+
+@author: Hrishikesh Terdalkar
+"""
+
+import functools
+import json
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs, urlsplit
+
+###############################################################################
+
+ENDPOINT = "/nuSource/api/v1"
+BLOCK_SIZE = 4096
+
+COURSE_TITLES = [
+    "Laghu Siddhanta Kaumudi",
+    "Bhagavad Gita",
+    "Amarakosha",
+    "Raghuvamsha",
+    "Tarka Sangraha",
+    "Kiratarjuniyam",
+    "Meghadutam",
+    "Vakyapadiyam",
+]
+TUTORS = [
+    "Dr. Shankara",
+    "Smt. Lakshmi",
+    "Sri Narayana",
+]
+
+###############################################################################
+
+
+@dataclass
+class MockConfig:
+    """Configuration of the mock server
+
+    Sizes are in bytes, latency is in seconds, bandwidth is in bytes per
+    second (0 for unlimited) and error_rate is the probability with which a
+    material or file request fails.
+    """
+    username: str = "student"
+    password: str = "secret"
+    num_courses: int = 2
+    num_sections: int = 3
+    audio_per_section: int = 2
+    document_per_section: int = 2
+    external_per_section: int = 1
+    html_per_section: int = 1
+    audio_size: int = 256 * 1024
+    document_size: int = 32 * 1024
+    html_size: int = 2 * 1024
+    latency: float = 0.0
+    # delay of every new connection (e.g., TCP and TLS handshakes)
+    connect_latency: float = 0.0
+    # file URLs name this host (e.g., "localhost") instead of the API host,
+    # so that files are served from a separate origin, as from a CDN
+    file_hostname: str = ""
+    bandwidth: int = 0
+    error_rate: float = 0.0
+    accept_ranges: bool = True
+    seed: int = 0
+    # the first material of a course is also listed in every other section
+    shared_materials: bool = False
+    # file URLs are signed to expire after url_ttl seconds (0 for never),
+    # with the expiry (UNIX timestamp) in the url_expiry_param parameter
+    url_ttl: float = 0
+    url_expiry_param: str = "Expires"
+    # additional accounts (username: password)
+    accounts: Dict[str, str] = field(default_factory=dict)
+
+
+###############################################################################
+
+
+class MockEdmingle:
+    """Course data served by the mock server"""
+
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.courses = {}
+        self.sections = {}
+        self.materials = {}
+        self.apikey = "mock-apikey-0"
+        self.accounts = {config.username: (config.password, self.apikey)}
+        for idx, (username, password) in enumerate(config.accounts.items()):
+            self.accounts[username] = (password, f"mock-apikey-{idx + 1}")
+        self.apikeys = {apikey for _, apikey in self.accounts.values()}
+        self._build()
+
+    def rotate_apikey(self, username: str) -> str:
+        """Revoke the APIKEY of an account, issuing a new one on login"""
+        password, apikey = self.accounts[username]
+        self.apikeys.discard(apikey)
+        apikey = f"{apikey}-r"
+        self.accounts[username] = (password, apikey)
+        self.apikeys.add(apikey)
+        return apikey
+
+    def _build(self):
+        config = self.config
+        material_id = 5000
+        for c in range(config.num_courses):
+            course_id = 1000 + c
+            title = COURSE_TITLES[c % len(COURSE_TITLES)]
+            if c >= len(COURSE_TITLES):
+                title = f"{title} {c // len(COURSE_TITLES) + 1}"
+            course = {
+                "course_id": course_id,
+                "class_id": 2000 + c,
+                "class_name": title,
+                "tutor_name": TUTORS[c % len(TUTORS)],
+                "sections": [],
+            }
+            for s in range(config.num_sections):
+                section_id = 10000 + c * 100 + s
+                section = {
+                    "id": section_id,
+                    "name": f"Part {s + 1}",
+                    "resources": [],
+                }
+                kinds = (
+                    [("file", "audio")] * config.audio_per_section +
+                    [("file", "document")] * config.document_per_section +
+                    [("external_url", "video")] * config.external_per_section +
+                    [("html_text", "text")] * config.html_per_section
+                )
+                for position, (source, material_type) in enumerate(kinds):
+                    material_id += 1
+                    name = f"{title} {s + 1}.{position + 1}"
+                    material = {
+                        "material_id": material_id,
+                        "material_name": name,
+                        "material_type": material_type,
+                        "source": source,
+                    }
+                    if source == "file":
+                        extension = (
+                            "mp3" if material_type == "audio" else "pdf"
+                        )
+                        material["file_name"] = f"{material_id}.{extension}"
+                        material["size"] = (
+                            config.audio_size
+                            if material_type == "audio" else
+                            config.document_size
+                        )
+                    if source == "html_text":
+                        paragraph = f"<p>{name}</p>"
+                        repeat = max(config.html_size // len(paragraph), 1)
+                        material["html_text"] = paragraph * repeat
+                    self.materials[material_id] = material
+                    section["resources"].append([
+                        section_id, material_id, position, name,
+                        material_type, source, 0, None
+                    ])
+                if config.shared_materials and s > 0:
+                    first = self.sections[course["sections"][0]]
+                    resource = list(first["resources"][0])
+                    resource[0] = section_id
+                    resource[2] = len(section["resources"])
+                    section["resources"].append(resource)
+                self.sections[section_id] = section
+                course["sections"].append(section_id)
+            self.courses[course_id] = course
+
+    # ----------------------------------------------------------------------- #
+
+    @property
+    def num_materials(self) -> int:
+        return len(self.materials)
+
+    def course_bytes(self, course_id: int) -> int:
+        """Size of the distinct materials of a course"""
+        return sum(
+            self.materials[material_id].get("size", 0)
+            for material_id in {
+                resource[1]
+                for section_id in self.courses[course_id]["sections"]
+                for resource in self.sections[section_id]["resources"]
+            }
+        )
+
+    def class_course(self, class_id: int) -> Dict:
+        for course in self.courses.values():
+            if course["class_id"] == class_id:
+                return course
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def block(material_id: int) -> bytes:
+        return bytes((material_id + i) % 256 for i in range(BLOCK_SIZE))
+
+    @classmethod
+    def content(cls, material_id: int, start: int, end: int) -> bytes:
+        """Deterministic content of a file in the byte range [start, end)"""
+        block = cls.block(material_id)
+        offset = start % BLOCK_SIZE
+        repeat = (end - start + offset) // BLOCK_SIZE + 1
+        return (block * repeat)[offset:offset + end - start]
+
+
+###############################################################################
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockEdmingle/1.0"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self._count("connections")
+        if self.config.connect_latency:
+            time.sleep(self.config.connect_latency)
+
+    # ----------------------------------------------------------------------- #
+
+    @property
+    def data(self) -> MockEdmingle:
+        return self.server.data
+
+    @property
+    def config(self) -> MockConfig:
+        return self.server.data.config
+
+    def _fail(self) -> bool:
+        if not self.config.error_rate:
+            return False
+        with self.server.lock:
+            return self.server.random.random() < self.config.error_rate
+
+    def _count(self, key: str):
+        with self.server.lock:
+            self.server.stats[key] = self.server.stats.get(key, 0) + 1
+
+    def _send_json(self, payload: Dict, status: int = 200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    # ----------------------------------------------------------------------- #
+
+    def do_HEAD(self):
+        self._route(method="HEAD")
+
+    def do_GET(self):
+        self._route(method="GET")
+
+    def do_POST(self):
+        self._route(method="POST")
+
+    def do_PUT(self):
+        self._route(method="PUT")
+
+    def _route(self, method: str):
+        url = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if method == "POST":
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length).decode()
+            query.update({k: v[-1] for k, v in parse_qs(body).items()})
+
+        parts = [part for part in url.path.split("/") if part]
+        if parts[:1] == ["bucket"]:
+            self._count("bucket")
+            return self._serve_object(url.path, method)
+        if parts[:1] == ["files"]:
+            self._count("files")
+            if self._expired(query):
+                self._count("files/expired")
+                return self._send_json({"message": "Forbidden"}, status=403)
+            return self._serve_file(parts, head=(method == "HEAD"))
+        if parts[:1] == ["watch"]:
+            self._count("watch")
+            return self._serve_watch(parts, head=(method == "HEAD"))
+        if parts[:1] == ["oembed"]:
+            self._count("oembed")
+            return self._serve_oembed(query.get("url", ""))
+
+        if not url.path.startswith(ENDPOINT):
+            return self._send_json({"message": "Not Found"}, status=404)
+
+        path = url.path[len(ENDPOINT):].strip("/")
+        self._count("/".join(path.split("/")[:2]))
+        if self.config.latency:
+            time.sleep(self.config.latency)
+
+        if path == "tutor/login":
+            return self._login(query)
+        apikey = self.headers.get("APIKEY")
+        if apikey not in self.data.apikeys:
+            return self._send_json({"message": "Unauthorized"}, status=401)
+        self._count(f"apikey/{apikey}")
+        return self._api(path.split("/"), query)
+
+    # ----------------------------------------------------------------------- #
+
+    def _login(self, query: Dict):
+        credentials = json.loads(query.get("JSONString", "{}"))
+        username = credentials.get("username")
+        password, apikey = self.data.accounts.get(username, (None, None))
+        if password is None or credentials.get("password") != password:
+            return self._send_json({"message": "Invalid credentials"})
+        return self._send_json({
+            "message": "Login successful",
+            "user": {
+                "username": username,
+                "apikey": apikey,
+            }
+        })
+
+    def _api(self, parts: List[str], query: Dict):
+        data = self.data
+        if parts == ["user", "usermeta"]:
+            return self._send_json({
+                "message": "Success",
+                "user": {
+                    "org_data": [{
+                        "organization_id": 1,
+                        "institution_id": 1
+                    }]
+                },
+                "user_classes": [
+                    course["class_id"] for course in data.courses.values()
+                ]
+            })
+
+        if parts == ["student", "masterbatches"]:
+            search = query.get("search", "").lower()
+            return self._send_json({"batches": [
+                {
+                    "master_batch_id": course_id,
+                    "master_batch_name": course["class_name"],
+                    "tutor_name": course["tutor_name"],
+                }
+                for course_id, course in data.courses.items()
+                if search in course["class_name"].lower()
+            ]})
+
+        if parts[:3] == ["student", "masterbatches", "classes"]:
+            course = data.courses.get(int(parts[3]))
+            if course is None:
+                return self._send_json({"courses": []})
+            return self._send_json({"courses": [{
+                "class_id": course["class_id"],
+                "class_name": course["class_name"],
+                "tutor_name": course["tutor_name"],
+                "stats": {
+                    "course_num_exercises": 0,
+                    "course_num_materials": sum(
+                        len(data.sections[section_id]["resources"])
+                        for section_id in course["sections"]
+                    )
+                }
+            }]})
+
+        if parts[:2] == ["student", "classcurriculum"]:
+            course = data.class_course(int(parts[2]))
+            return self._send_json({"sections": [
+                [section_id, data.sections[section_id]["name"]]
+                for section_id in course["sections"]
+            ]})
+
+        if parts[:2] == ["student", "sections"]:
+            section = data.sections[int(parts[2])]
+            return self._send_json({
+                "section": {
+                    "name": section["name"],
+                    "num_materials": len(section["resources"]),
+                },
+                "resources": section["resources"],
+            })
+
+        if parts[:2] == ["student", "materials"]:
+            if self._fail():
+                return self._send_json(
+                    {"message": "Internal Server Error"}, status=500
+                )
+            material = dict(data.materials[int(parts[2])])
+            material_id = material["material_id"]
+            if material["source"] == "file":
+                file_host = self.headers["Host"]
+                if self.config.file_hostname:
+                    port = self.server.server_address[1]
+                    file_host = f"{self.config.file_hostname}:{port}"
+                material["url"] = (
+                    f"http://{file_host}/files/"
+                    f"{material_id}/{material['file_name']}"
+                )
+                if self.config.url_ttl:
+                    expires_at = int(time.time() + self.config.url_ttl)
+                    material["url"] += (
+                        f"?{self.config.url_expiry_param}={expires_at}"
+                    )
+            if material["source"] == "external_url":
+                material["external_url"] = (
+                    f"http://{self.headers['Host']}/watch/{material_id}"
+                )
+            return self._send_json({
+                "message": "Teaching material retrieved successfully",
+                "material": material,
+            })
+
+        return self._send_json({"message": "Not Found"}, status=404)
+
+    # ----------------------------------------------------------------------- #
+
+    def _expired(self, query: Dict) -> bool:
+        expires_at = query.get(self.config.url_expiry_param)
+        return expires_at is not None and int(expires_at) < time.time()
+
+    def _serve_file(self, parts: List[str], head: bool = False):
+        try:
+            material = self.data.materials[int(parts[1])]
+            size = material["size"]
+        except (IndexError, KeyError, ValueError):
+            return self._send_json({"message": "Not Found"}, status=404)
+
+        if not head and self._fail():
+            return self._send_json(
+                {"message": "Service Unavailable"}, status=503
+            )
+
+        start, end = 0, size
+        status = 200
+        requested_range = self.headers.get("Range")
+        if requested_range and self.config.accept_ranges:
+            first, _, last = requested_range.split("=")[1].partition("-")
+            start = int(first or 0)
+            end = min(int(last) + 1, size) if last else size
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header("Content-Type", (
+            "audio/mpeg" if material["material_type"] == "audio" else
+            "application/pdf"
+        ))
+        self.send_header("Content-Length", str(end - start))
+        if self.config.accept_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header(
+                "Content-Range", f"bytes {start}-{end - 1}/{size}"
+            )
+        self.end_headers()
+        if head:
+            return
+
+        chunk_size = 64 * 1024
+        bandwidth = self.config.bandwidth
+        started = time.perf_counter()
+        sent = 0
+        for offset in range(start, end, chunk_size):
+            chunk = self.data.content(
+                material["material_id"], offset, min(offset + chunk_size, end)
+            )
+            try:
+                self.wfile.write(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            sent += len(chunk)
+            if bandwidth:
+                delay = sent / bandwidth - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+    def _serve_watch(self, parts: List[str], head: bool = False):
+        try:
+            material = self.data.materials[int(parts[1])]
+        except (IndexError, KeyError, ValueError):
+            return self._send_json({"message": "Not Found"}, status=404)
+
+        body = (
+            f"<html><head><title>{material['material_name']}</title>"
+            f"</head><body></body></html>"
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _serve_object(self, path: str, method: str):
+        """Minimal S3-compatible object store (PUT, GET and HEAD)"""
+        objects = self.server.objects
+        if method == "PUT":
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length)
+            if len(body) < length:
+                # an incomplete upload is not stored
+                self.close_connection = True
+                return
+            objects[path] = body
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if path not in objects:
+            return self._send_json({"message": "Not Found"}, status=404)
+        body = objects[path]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if method != "HEAD":
+            self.wfile.write(body)
+
+    def _serve_oembed(self, url: str):
+        parts = [part for part in urlsplit(url).path.split("/") if part]
+        try:
+            material = self.data.materials[int(parts[1])]
+        except (IndexError, KeyError, ValueError):
+            return self._send_json({"message": "Not Found"}, status=404)
+        self._send_json({
+            "title": material["material_name"],
+            "provider_name": "Mock",
+            "type": "video",
+        })
+
+
+###############################################################################
+
+
+class MockEdmingleServer(ThreadingHTTPServer):
+    """Mock Edmingle server running in a background thread
+
+    Usage
+    -----
+    with MockEdmingleServer(MockConfig()) as server:
+        vyoma = Vyoma(
+            "student", "secret",
+            api_host=server.api_host, protocol=server.protocol
+        )
+    """
+
+    daemon_threads = True
+
+    def __init__(self, config: MockConfig = None, port: int = 0):
+        super().__init__(("127.0.0.1", port), MockRequestHandler)
+        self.data = MockEdmingle(config or MockConfig())
+        self.lock = threading.Lock()
+        self.random = random.Random(self.data.config.seed)
+        self.stats = {}
+        self.objects = {}
+        self._thread = None
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    @property
+    def api_host(self) -> str:
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+    @property
+    def protocol(self) -> str:
+        return "http:"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+###############################################################################
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""Tests for syncing several accounts."""
+
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from vyoma_download.accounts import MultiAccountSync, read_accounts
+from vyoma_download.progress import JsonProgress
+
+from .mock_server import MockConfig, MockEdmingleServer
+
+
+class TestMultiAccountSync(unittest.TestCase):
+    config = MockConfig(accounts={"second": "password"})
+
+    def setUp(self):
+        self.server = MockEdmingleServer(self.config).start()
+        self.download_dir = tempfile.mkdtemp(prefix="vyoma-test-")
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.download_dir, ignore_errors=True)
+
+    def sync(self, accounts, **kwargs) -> MultiAccountSync:
+        return MultiAccountSync(
+            accounts,
+            download_dir=self.download_dir,
+            progress="none",
+            api_host=self.server.api_host,
+            protocol=self.server.protocol,
+            **kwargs,
+        )
+
+    def test_000_read_accounts(self):
+        path = os.path.join(self.download_dir, "accounts.txt")
+        with open(path, "w") as f:
+            f.write("# mirror accounts\nstudent:secret\n\nsecond: a:b \n")
+        self.assertEqual(
+            read_accounts(path), [("student", "secret"), ("second", "a:b")]
+        )
+
+    def test_001_shared_metadata(self):
+        """Curricula are fetched once, materials once per account."""
+        accounts = [
+            (self.config.username, self.config.password),
+            ("second", "password"),
+            ("intruder", "password"),
+        ]
+        with self.sync(accounts) as sync:
+            self.assertEqual(
+                sorted(sync.sessions), ["second", self.config.username]
+            )
+            with contextlib.redirect_stdout(io.StringIO()):
+                download_logs = sync.download_course(1000)
+            cache = sync.shared.cache
+            self.assertGreater(cache.hits, 0)
+
+        stats = self.server.stats
+        self.assertEqual(stats["student/classcurriculum"], 1)
+        self.assertEqual(stats["student/sections"], self.config.num_sections)
+        num_materials = sum(
+            section["num_materials"]
+            for section in download_logs["second"]["section"]
+        )
+        self.assertEqual(stats["student/materials"], 2 * num_materials)
+
+        # every account used its own APIKEY
+        apikeys = [key for key in stats if key.startswith("apikey/")]
+        self.assertEqual(len(apikeys), 2)
+
+        for username, download_log in download_logs.items():
+            self.assertIsNotNone(download_log)
+            course_dir = download_log["course"]["local_path"]
+            self.assertTrue(course_dir.startswith(
+                os.path.join(self.download_dir, username)
+            ))
+            for entry in download_log["material"]["file"]["audio"]:
+                self.assertTrue(os.path.isfile(entry["local_path"]))
+
+    def test_002_session_options(self):
+        """Sessions download in parallel, and report their own metrics."""
+        accounts = [
+            (self.config.username, self.config.password),
+            ("second", "password"),
+        ]
+        with self.assertRaises(ValueError):
+            self.sync(accounts, record="traffic.tar")
+
+        with self.sync(accounts, session_workers=3) as sync:
+            progress = JsonProgress(file=io.StringIO())
+            sync.shared.progress = progress
+            for session in sync.sessions.values():
+                self.assertEqual(session.max_workers, 3)
+                # the operations of all the accounts are limited together
+                self.assertIs(session.limiters, sync.shared.limiters)
+            self.assertEqual(
+                sync.shared.limiters["transfer"].maximum, 4 * 3
+            )
+            with contextlib.redirect_stdout(io.StringIO()):
+                sync.download_course(1000)
+            self.assertEqual(sorted(progress.metrics), sorted(
+                f"{name}:{username}"
+                for name in ["concurrency", "pipeline"]
+                for username, _ in accounts
+            ))
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""Tests for `vyoma_download.catalog` module."""
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from vyoma_download.catalog import CourseCatalog, normalize
+
+
+class TestCourseCatalog(unittest.TestCase):
+    """Tests for the local course catalog."""
+
+    courses = [
+        {
+            "course_id": 1,
+            "course_name": "Bhagavad Gita",
+            "course_instructor": "Dr. Shankara"
+        },
+        {
+            "course_id": 2,
+            "course_name": "Laghu Siddhanta Kaumudi",
+            "course_instructor": "Smt. Lakshmi"
+        },
+        {
+            "course_id": 3,
+            "course_name": "Gita Bhashya",
+            "course_instructor": "Sri Narayana"
+        },
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="vyoma-test-")
+        self.catalog = CourseCatalog(os.path.join(self.directory, "c.json"))
+        self.catalog.update(self.courses)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def search(self, pattern):
+        return [course["course_id"] for course in self.catalog.search(pattern)]
+
+    def test_000_normalize(self):
+        """Spelling variants and scripts normalize alike."""
+        self.assertEqual(normalize("Bhagavad Gītā"), normalize("bagavad gita"))
+        self.assertEqual(normalize("लघु"), normalize("Laghu"))
+        self.assertEqual(normalize("Amarakosha"), normalize("Amarakośa"))
+
+    def test_001_prefix(self):
+        """Words match by prefix, in any order."""
+        self.assertEqual(self.search("laghu sid"), [2])
+        self.assertEqual(self.search("kaum lag"), [2])
+        self.assertEqual(self.search("gita"), [1, 3])
+
+    def test_002_fuzzy(self):
+        """Misspelt and transliterated patterns match."""
+        self.assertEqual(self.search("Bhagvad"), [1])
+        self.assertEqual(self.search("भगवद्गीता"), [1])
+        self.assertEqual(self.search("xyz"), [])
+
+    def test_003_tutor(self):
+        """Courses are found by tutor."""
+        self.assertEqual(self.search("lakshmi"), [2])
+
+    def test_004_long_prefix(self):
+        """Words longer than the indexed prefixes match by their prefix."""
+        self.catalog.update(self.courses + [
+            {
+                "course_id": 4,
+                "course_name": "Kavyaprakasavivekatika",
+            },
+            {
+                "course_id": 5,
+                "course_name": "Kavyaprakasavivekadipika",
+            },
+        ])
+        for pattern, expected in [
+            ("kavyaprakasaviveka", [5, 4]),
+            ("kavyaprakasavivekad", [5]),
+            ("kavyaprakasavivekatika", [4]),
+        ]:
+            courses = self.catalog.search(pattern, cutoff=1.0)
+            self.assertEqual(
+                [course["course_id"] for course in courses], expected
+            )
+
+    def test_005_cache(self):
+        """The catalog is reloaded from the disk."""
+        catalog = CourseCatalog(self.catalog.path)
+        self.assertFalse(catalog.stale)
+        self.assertEqual(len(catalog.courses), len(self.courses))
+        self.assertTrue(CourseCatalog(self.catalog.path, ttl=-1).stale)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""Tests for the adaptive concurrency limiter."""
+
+
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from vyoma_download.concurrency import AdaptiveLimiter
+
+
+class TestAdaptiveLimiter(unittest.TestCase):
+    def run_operations(self, limiter, count, status=200, num_bytes=1024):
+        for _ in range(count):
+            with limiter.slot() as outcome:
+                limiter.report_status(status)
+                outcome.num_bytes = num_bytes
+
+    def test_000_additive_increase(self):
+        limiter = AdaptiveLimiter("test", maximum=4)
+        self.run_operations(limiter, 20)
+        self.assertEqual(limiter.limit, 4)
+        self.assertEqual(limiter.increases, 3)
+        self.assertEqual(limiter.metrics()["last_decision"]["limit"], 4)
+
+    def test_001_multiplicative_decrease(self):
+        limiter = AdaptiveLimiter("test", maximum=8, initial=8)
+        self.run_operations(limiter, 1, status=429)
+        self.assertEqual(limiter.limit, 4)
+        decision = limiter.metrics()["last_decision"]
+        self.assertEqual(decision["action"], "decrease")
+        self.assertEqual(decision["reason"], "status 429")
+
+        with self.assertRaises(requests.Timeout):
+            with limiter.slot():
+                raise requests.Timeout()
+        self.assertEqual(limiter.limit, 2)
+        self.assertEqual(limiter.decreases, 2)
+
+    def test_002_errors_hold(self):
+        limiter = AdaptiveLimiter("test", maximum=8, initial=2)
+        self.run_operations(limiter, 6, status=500)
+        self.assertEqual(limiter.limit, 2)
+        self.assertEqual(limiter.metrics()["last_decision"]["action"], "hold")
+
+    def test_003_latency_spike(self):
+        limiter = AdaptiveLimiter("test", maximum=8, initial=2)
+        limiter.baseline = 0.05
+        with limiter.slot():
+            time.sleep(0.15)
+        with limiter.slot():
+            time.sleep(0.15)
+        self.assertEqual(limiter.limit, 1)
+        self.assertTrue(
+            limiter.metrics()["last_decision"]["reason"].startswith("latency")
+        )
+
+    def test_004_bounded_concurrency(self):
+        limiter = AdaptiveLimiter("test", maximum=3, initial=3)
+        lock = threading.Lock()
+        active = [0, 0]
+
+        def operation(_):
+            with limiter.slot():
+                with lock:
+                    active[0] += 1
+                    active[1] = max(active)
+                time.sleep(0.01)
+                with lock:
+                    active[0] -= 1
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(operation, range(24)))
+        self.assertEqual(active[1], 3)
+        self.assertEqual(limiter.metrics()["in_flight"], 0)
+
+    def test_005_idle_time(self):
+        """Idle time between operations is not a drop in throughput."""
+        limiter = AdaptiveLimiter("test", maximum=1, latency_factor=None)
+        for idx in range(12):
+            if idx == 4:
+                time.sleep(0.5)
+            with limiter.slot() as outcome:
+                time.sleep(0.05)
+                outcome.num_bytes = 1000
+        self.assertEqual(limiter.decreases, 0)
+        self.assertGreater(limiter.throughput, 1000 / 0.1)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+"""Tests for `vyoma_download.downloader` module."""
+
+
+import dataclasses
+import os
+import shutil
+import tempfile
+import unittest
+
+import requests
+
+from vyoma_download.auth import SessionPool
+from vyoma_download.concurrency import AdaptiveLimiter
+from vyoma_download.downloader import (
+    Downloader, LinkExpired, PART_SUFFIX, STATE_SUFFIX, TransferStalled,
+    split
+)
+
+from .mock_server import MockConfig, MockEdmingleServer
+
+
+class TestDownloader(unittest.TestCase):
+    """Tests for the streaming downloader."""
+
+    config = MockConfig(num_courses=1, num_sections=1, audio_size=300_000)
+
+    def setUp(self):
+        self.server = MockEdmingleServer(self.config).start()
+        self.directory = tempfile.mkdtemp(prefix="vyoma-test-")
+        self.session = requests.Session()
+        self.downloader = Downloader(self.session, chunk_size=64 * 1024)
+        self.material_id = self.server.data.sections[10000]["resources"][0][1]
+        material = self.server.data.materials[self.material_id]
+        self.size = material["size"]
+        self.url = (
+            f"http://{self.server.api_host}/files/"
+            f"{self.material_id}/{material['file_name']}"
+        )
+        self.path = os.path.join(self.directory, material["file_name"])
+        self.expected = self.server.data.content(
+            self.material_id, 0, self.size
+        )
+
+    def tearDown(self):
+        self.session.close()
+        self.server.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def read(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def test_000_download(self):
+        """Files are downloaded completely, with progress callbacks."""
+        progress = []
+        result = self.downloader.download(
+            self.url, self.path, callback=progress.append
+        )
+        self.assertEqual(result, self.path)
+        self.assertEqual(self.read(), self.expected)
+        self.assertEqual(sum(progress), self.size)
+        self.assertFalse(os.path.exists(self.path + PART_SUFFIX))
+        self.assertFalse(os.path.exists(self.path + STATE_SUFFIX))
+
+    def test_001_resume(self):
+        """Partial files are completed using byte ranges."""
+        with open(self.path + PART_SUFFIX, "wb") as f:
+            f.write(self.expected[:1000])
+        progress = []
+        self.downloader.download(self.url, self.path, callback=progress.append)
+        self.assertEqual(self.read(), self.expected)
+        self.assertEqual(sum(progress), self.size - 1000)
+
+    def test_002_resume_preallocated(self):
+        """Preallocated files resume from the saved position."""
+        with open(self.path + PART_SUFFIX, "wb") as f:
+            f.write(self.expected[:100_000])
+            f.truncate(self.size)
+        self.downloader.save_state(
+            self.path, self.size, [[0, self.size, 100_000]]
+        )
+        self.downloader.download(self.url, self.path)
+        self.assertEqual(self.read(), self.expected)
+
+    def test_003_complete(self):
+        """Complete files are verified without being downloaded again."""
+        with open(self.path, "wb") as f:
+            f.write(self.expected)
+        progress = []
+        self.downloader.download(self.url, self.path, callback=progress.append)
+        self.assertEqual(self.read(), self.expected)
+        self.assertEqual(progress, [])
+
+    def test_004_not_found(self):
+        """Failed requests return None."""
+        url = f"http://{self.server.api_host}/files/1/missing.mp3"
+        self.assertIsNone(self.downloader.download(url, self.path))
+
+    def test_005_segments(self):
+        """Large files are fetched in parallel byte ranges."""
+        downloader = Downloader(
+            self.session, chunk_size=16 * 1024, segment_threshold=100_000
+        )
+        progress = []
+        result = downloader.download(
+            self.url, self.path, callback=progress.append
+        )
+        self.assertEqual(result, self.path)
+        self.assertEqual(self.read(), self.expected)
+        self.assertEqual(sum(progress), self.size)
+        self.assertFalse(os.path.exists(self.path + STATE_SUFFIX))
+
+    def test_006_resume_segments(self):
+        """Segments are resumed independently."""
+        segments = split(self.size, 3)
+        with open(self.path + PART_SUFFIX, "wb") as f:
+            f.truncate(self.size)
+            for segment in segments[:2]:
+                f.seek(segment[0])
+                f.write(self.expected[segment[0]:segment[0] + 5000])
+                segment[2] = 5000
+        self.downloader.save_state(self.path, self.size, segments)
+        progress = []
+        self.downloader.download(self.url, self.path, callback=progress.append)
+        self.assertEqual(self.read(), self.expected)
+        self.assertEqual(sum(progress), self.size - 10_000)
+
+    def test_007_stalled(self):
+        """Slow transfers are aborted, and completed afterwards."""
+        config = self.server.data.config
+        self.addCleanup(setattr, config, "bandwidth", config.bandwidth)
+        config.bandwidth = 50_000
+        downloader = Downloader(
+            self.session, chunk_size=64 * 1024,
+            stall_speed=200_000, stall_period=0.3
+        )
+        with self.assertRaises(TransferStalled):
+            downloader.download(self.url, self.path)
+        self.assertTrue(os.path.isfile(self.path + PART_SUFFIX))
+
+        config.bandwidth = 0
+        result = downloader.download(self.url, self.path)
+        self.assertEqual(result, self.path)
+        self.assertEqual(self.read(), self.expected)
+
+    def test_008_timeout(self):
+        """Requests to unresponsive servers time out."""
+        config = self.server.data.config
+        self.addCleanup(setattr, config, "latency", config.latency)
+        config.latency = 0.5
+        pool = SessionPool(timeout=(1, 0.1))
+        url = f"http://{self.server.api_host}/nuSource/api/v1/user/usermeta"
+        with self.assertRaises(requests.Timeout):
+            pool.get(url)
+        pool.close()
+
+    def test_009_expired_link(self):
+        """Rejected signed URLs are reported, and can be resumed."""
+        config = self.server.data.config
+        with self.assertRaises(LinkExpired):
+            self.downloader.download(
+                f"{self.url}?{config.url_expiry_param}=1", self.path
+            )
+        result = self.downloader.download(
+            f"{self.url}?{config.url_expiry_param}=4102444800", self.path
+        )
+        self.assertEqual(result, self.path)
+        self.assertEqual(self.read(), self.expected)
+
+    def test_010_complete_failed(self):
+        """Complete files are kept when they cannot be verified."""
+        with open(self.path, "wb") as f:
+            f.write(self.expected)
+        with self.assertRaises(LinkExpired):
+            self.downloader.download(self.url + "?Expires=1", self.path)
+        self.assertEqual(self.read(), self.expected)
+
+        self.server.data.config = dataclasses.replace(
+            self.config, error_rate=1.0
+        )
+        self.assertIsNone(self.downloader.download(self.url, self.path))
+        self.assertEqual(self.read(), self.expected)
+
+        self.server.stop()
+        with self.assertRaises(requests.ConnectionError):
+            self.downloader.download(self.url, self.path)
+        self.assertEqual(self.read(), self.expected)
+        self.assertFalse(os.path.exists(self.path + PART_SUFFIX))
+
+    def test_011_segment_status(self):
+        """Statuses of segments are reported to the slot of the transfer."""
+        limiter = AdaptiveLimiter("transfer", latency_factor=None)
+        downloader = Downloader(
+            self.session, chunk_size=16 * 1024, segment_threshold=100_000,
+            on_status=limiter.report_status
+        )
+        with limiter.slot() as outcome:
+            downloader.download(self.url, self.path)
+        self.assertEqual(
+            outcome.status, 206 if self.config.accept_ranges else 200
+        )
+
+
+class TestDownloaderWithoutRanges(TestDownloader):
+    """Tests for servers that do not support byte ranges."""
+
+    config = MockConfig(
+        num_courses=1, num_sections=1, audio_size=300_000,
+        accept_ranges=False
+    )
+
+    def test_001_resume(self):
+        """Partial files are downloaded again."""
+        with open(self.path + PART_SUFFIX, "wb") as f:
+            f.write(self.expected[:1000])
+        self.downloader.download(self.url, self.path)
+        self.assertEqual(self.read(), self.expected)
+
+    def test_003_complete(self):
+        """Complete files are downloaded again."""
+        with open(self.path, "wb") as f:
+            f.write(self.expected)
+        self.downloader.download(self.url, self.path)
+        self.assertEqual(self.read(), self.expected)
+
+    def test_006_resume_segments(self):
+        """Segmented downloads restart from the beginning."""
+        segments = split(self.size, 3)
+        with open(self.path + PART_SUFFIX, "wb") as f:
+            f.truncate(self.size)
+        segments[0][2] = 5000
+        self.downloader.save_state(self.path, self.size, segments)
+        self.downloader.download(self.url, self.path)
+        self.assertEqual(self.read(), self.expected)
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+"""Tests for expiring URLs."""
+
+
+import time
+import unittest
+
+from vyoma_download.expiry import URLCache, url_expiry
+
+
+class TestExpiry(unittest.TestCase):
+    def test_000_url_expiry(self):
+        base = "https://cdn.example.com/files/1/a.mp3"
+        self.assertIsNone(url_expiry(base))
+        self.assertEqual(url_expiry(f"{base}?Expires=1700000000"), 1700000000)
+        self.assertEqual(
+            url_expiry(
+                f"{base}?X-Amz-Date=20231114T221320Z&X-Amz-Expires=3600"
+                "&X-Amz-Signature=abc"
+            ),
+            1700000000 + 3600
+        )
+        self.assertEqual(
+            url_expiry(f"{base}?hdnts=st=1699990000~exp=1700000000~hmac=ab"),
+            1700000000
+        )
+        self.assertIsNone(url_expiry(f"{base}?X-Amz-Date=bad&X-Amz-Expires=1"))
+
+    def test_001_cache(self):
+        cache = URLCache(margin=10)
+        base = "https://cdn.example.com/a.mp3"
+        fresh = f"{base}?Expires={int(time.time()) + 60}"
+        expiring = f"{base}?Expires={int(time.time()) + 5}"
+
+        self.assertIsNone(cache.get("1"))
+        cache.put("1", fresh)
+        self.assertEqual(cache.get("1"), fresh)
+        cache.put("1", expiring)
+        self.assertIsNone(cache.get("1"))
+        self.assertIn("1", cache)
+
+        cache.put("2", base)
+        self.assertEqual(cache.get("2"), base)
+        self.assertIsNone(cache.expiry("2"))
+        cache.invalidate("2")
+        self.assertNotIn("2", cache)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+"""Tests for hedged requests."""
+
+
+import itertools
+import threading
+import time
+import unittest
+
+from vyoma_download.hedging import Hedger, LatencyTracker
+
+
+class TestHedger(unittest.TestCase):
+    def setUp(self):
+        self.hedger = Hedger(percentile=0.9, budget=0.5, min_samples=10)
+        for _ in range(10):
+            self.hedger.run(lambda: time.sleep(0.001))
+
+    def tearDown(self):
+        self.hedger.close()
+
+    def test_000_percentile(self):
+        tracker = LatencyTracker()
+        for latency in range(1, 101):
+            tracker.add(latency)
+        self.assertEqual(tracker.percentile(0.5), 50)
+        self.assertEqual(tracker.percentile(0.99), 99)
+        self.assertEqual(tracker.percentile(1.0), 100)
+
+    def test_001_slow_request(self):
+        """A duplicate is issued for a slow request, and wins."""
+        calls = itertools.count()
+        release = threading.Event()
+
+        def fetch():
+            if next(calls) == 0:
+                release.wait(5)
+                return "primary"
+            return "duplicate"
+
+        start = time.monotonic()
+        self.assertEqual(self.hedger.run(fetch), "duplicate")
+        self.assertLess(time.monotonic() - start, 1)
+        release.set()
+        metrics = self.hedger.metrics()
+        self.assertEqual(metrics["hedged"], 1)
+        self.assertEqual(metrics["hedge_wins"], 1)
+
+    def test_002_budget(self):
+        """Duplicates are limited to the budget."""
+        hedger = Hedger(percentile=0.5, budget=0.0, min_samples=1)
+        hedger.run(lambda: None)
+        self.assertEqual(hedger.run(lambda: time.sleep(0.05) or 1), 1)
+        self.assertEqual(hedger.metrics()["hedged"], 0)
+        hedger.close()
+
+    def test_003_failed_duplicate(self):
+        """The slower result is used if the faster call fails."""
+        calls = itertools.count()
+
+        def fetch():
+            if next(calls) == 0:
+                time.sleep(0.1)
+                return "primary"
+            raise IOError("duplicate failed")
+
+        self.assertEqual(self.hedger.run(fetch), "primary")
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+"""Tests for `vyoma_download.linkcheck` module."""
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import requests
+
+from vyoma_download.linkcheck import LinkChecker, find_provider
+from vyoma_download.state import StateStore
+
+from .mock_server import MockConfig, MockEdmingleServer
+
+
+class TestLinkChecker(unittest.TestCase):
+    """Tests for the external link resolver."""
+
+    config = MockConfig(num_courses=1, num_sections=2)
+
+    def setUp(self):
+        self.server = MockEdmingleServer(self.config).start()
+        self.directory = tempfile.mkdtemp(prefix="vyoma-test-")
+        self.session = requests.Session()
+        self.state = StateStore(os.path.join(self.directory, "state.sqlite3"))
+        self.base_url = f"http://{self.server.api_host}"
+        self.checker = LinkChecker(self.session, self.state, max_workers=4)
+        self.materials = {
+            material_id: material
+            for material_id, material in self.server.data.materials.items()
+            if material["source"] == "external_url"
+        }
+
+    def tearDown(self):
+        self.state.close()
+        self.session.close()
+        self.server.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_000_find_provider(self):
+        """oEmbed providers are matched by host and parent domains."""
+        providers = {"youtube.com": "oembed"}
+        self.assertEqual(
+            find_provider("https://www.youtube.com/watch?v=x", providers),
+            "oembed"
+        )
+        self.assertIsNone(find_provider("https://example.org/", providers))
+
+    def test_001_page_title(self):
+        """Titles of HTML pages are resolved and results are cached."""
+        urls = [
+            f"{self.base_url}/watch/{material_id}"
+            for material_id in self.materials
+        ]
+        results = self.checker.check_all(urls + urls[:1])
+        self.assertEqual(len(results), len(urls))
+        for url, material in zip(urls, self.materials.values()):
+            self.assertTrue(results[url]["ok"])
+            self.assertEqual(results[url]["final_url"], url)
+            self.assertEqual(results[url]["title"], material["material_name"])
+
+        requests_made = self.server.stats["watch"]
+        self.assertEqual(self.checker.check_all(urls), results)
+        self.assertEqual(self.server.stats["watch"], requests_made)
+
+    def test_002_oembed(self):
+        """Known providers are resolved using oEmbed."""
+        self.checker.oembed_providers = {
+            "127.0.0.1": f"{self.base_url}/oembed",
+            "localhost": f"{self.base_url}/oembed",
+        }
+        material_id, material = next(iter(self.materials.items()))
+        result = self.checker.check(f"{self.base_url}/watch/{material_id}")
+        self.assertTrue(result["ok"])
+        self.assertEqual(result["provider"], "Mock")
+        self.assertEqual(result["title"], material["material_name"])
+        self.assertNotIn("watch", self.server.stats)
+
+    def test_003_broken(self):
+        """Dead links are reported with their status."""
+        result = self.checker.check(f"{self.base_url}/watch/1")
+        self.assertFalse(result["ok"])
+        self.assertEqual(result["status"], 404)
+        self.assertFalse(self.state.get_link(result["url"])["ok"])
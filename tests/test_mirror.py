@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+"""Tests for the LAN mirror server."""
+
+
+import dataclasses
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import requests
+
+from vyoma_download import mirror
+from vyoma_download.mirror import (
+    MirrorServer, RangeNotSatisfiable, byte_range
+)
+from vyoma_download.vyoma import Vyoma
+
+from .mock_server import MockConfig, MockEdmingleServer
+
+
+class TestByteRange(unittest.TestCase):
+    def test_000_byte_range(self):
+        self.assertIsNone(byte_range(None, 100))
+        self.assertEqual(byte_range("bytes=0-9", 100), (0, 9))
+        self.assertEqual(byte_range("bytes=90-", 100), (90, 99))
+        self.assertEqual(byte_range("bytes=90-200", 100), (90, 99))
+        self.assertEqual(byte_range("bytes=-10", 100), (90, 99))
+        self.assertEqual(byte_range("bytes=-200", 100), (0, 99))
+        # unsupported and malformed ranges are ignored
+        self.assertIsNone(byte_range("bytes=0-1,5-6", 100))
+        self.assertIsNone(byte_range("items=0-1", 100))
+        self.assertIsNone(byte_range("bytes=5-1", 100))
+        self.assertIsNone(byte_range("bytes=a-b", 100))
+        for header in ["bytes=100-", "bytes=-0"]:
+            with self.assertRaises(RangeNotSatisfiable):
+                byte_range(header, 100)
+
+
+class TestMirror(unittest.TestCase):
+    config = MockConfig(
+        num_courses=1,
+        num_sections=1,
+        audio_per_section=2,
+        document_per_section=1,
+    )
+
+    def setUp(self):
+        self.upstream = MockEdmingleServer(self.config).start()
+        self.download_dir = tempfile.mkdtemp(prefix="vyoma-mirror-")
+        self.vyoma = Vyoma(
+            username=self.config.username,
+            password=self.config.password,
+            download_dir=self.download_dir,
+            api_host=self.upstream.api_host,
+            protocol=self.upstream.protocol,
+            progress="none",
+        )
+        self.mirror = MirrorServer(
+            vyoma=self.vyoma, host="127.0.0.1", port=0
+        ).start()
+
+    def tearDown(self):
+        self.mirror.stop()
+        self.vyoma.close()
+        self.upstream.stop()
+        shutil.rmtree(self.download_dir, ignore_errors=True)
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return requests.get(self.mirror.url + path, **kwargs)
+
+    def wait_for_transfers(self, timeout: float = 5.0):
+        """Wait until the fetches (which outlive their responses) finish"""
+        deadline = time.monotonic() + timeout
+        while self.mirror.transfers and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.mirror.transfers, {})
+
+    def test_000_read_through(self):
+        """A material crosses the upstream link once, on first request."""
+        data = self.upstream.data
+        course_id = next(iter(data.courses))
+        courses = self.get("/", params={"format": "json"}).json()
+        self.assertEqual(courses[0]["course_id"], str(course_id))
+        self.assertEqual(courses[0]["num_complete"], 0)
+
+        materials = self.get(
+            f"/courses/{course_id}/",
+            headers={"Accept": "application/json"}
+        ).json()
+        audio = next(m for m in materials if m["type"] == "audio")
+        self.assertEqual(audio["status"], "pending")
+        material_id = int(audio["id"])
+        size = data.materials[material_id]["size"]
+        content = data.content(material_id, 0, size)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            responses = list(executor.map(
+                lambda _: self.get(audio["url"]), range(4)
+            ))
+        for r in responses:
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(r.content, content)
+        self.assertEqual(self.upstream.stats["files"], 1)
+        self.assertEqual(self.mirror.stats, {"hits": 3, "misses": 1})
+        self.wait_for_transfers()
+        self.assertEqual(self.mirror.fetches, {})
+
+        r = self.get(audio["url"], headers={"Range": "bytes=100-199"})
+        self.assertEqual(r.status_code, 206)
+        self.assertEqual(r.headers["Content-Range"], f"bytes 100-199/{size}")
+        self.assertEqual(r.content, content[100:200])
+        r = self.get(audio["url"], headers={"Range": f"bytes={size}-"})
+        self.assertEqual(r.status_code, 416)
+        r = self.get(audio["url"], headers={
+            "Range": "bytes=0-9", "If-Range": '"stale"'
+        })
+        self.assertEqual((r.status_code, len(r.content)), (200, size))
+        self.assertEqual(self.upstream.stats["files"], 1)
+
+        courses = self.get("/", params={"format": "json"}).json()
+        self.assertEqual(courses[0]["num_complete"], 1)
+        self.assertIn("<table>", self.get(f"/courses/{course_id}/").text)
+        self.assertEqual(self.get("/courses/1/").status_code, 404)
+        self.assertEqual(self.get("/courses/x/1").status_code, 404)
+
+    def test_001_streamed_miss(self):
+        """A material is sent while it is fetched from upstream."""
+        data = self.upstream.data
+        course_id = next(iter(data.courses))
+        materials = self.get(
+            f"/courses/{course_id}/", params={"format": "json"}
+        ).json()
+        audio = next(m for m in materials if m["type"] == "audio")
+        url = audio["url"]
+        size = data.materials[int(audio["id"])]["size"]
+        content = data.content(int(audio["id"]), 0, size)
+        # the fetch takes about a second, and is written in several chunks
+        data.config = dataclasses.replace(self.config, bandwidth=size)
+        self.vyoma.downloader.chunk_size = 16 * 1024
+
+        started = time.perf_counter()
+        with self.get(url, stream=True) as r:
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(r.headers["Content-Length"], str(size))
+            first = next(r.iter_content(1024))
+            self.assertLess(time.perf_counter() - started, 0.5)
+            self.assertEqual(len(self.mirror.transfers), 1)
+            # a concurrent range request is served from the written prefix
+            partial = self.get(url, headers={"Range": "bytes=-100"})
+            self.assertEqual(partial.status_code, 206)
+            self.assertEqual(partial.content, content[-100:])
+            self.assertEqual(first + r.content, content)
+        self.assertEqual(self.upstream.stats["files"], 1)
+        self.assertEqual(self.mirror.stats, {"hits": 1, "misses": 1})
+        self.wait_for_transfers()
+        self.assertEqual(self.mirror.fetches, {})
+
+        r = self.get(url)
+        self.assertEqual(r.content, content)
+        self.assertIn("ETag", r.headers)
+        self.assertEqual(self.upstream.stats["files"], 1)
+
+    def test_002_offline_tree(self):
+        """The download tree is browsable, without its hidden files."""
+        course_dir = os.path.join(self.download_dir, "course")
+        os.makedirs(course_dir)
+        with open(os.path.join(course_dir, "a b.mp3"), "wb") as f:
+            f.write(b"0123456789")
+        self.mirror.stop()
+        self.mirror = MirrorServer(
+            self.download_dir, host="127.0.0.1", port=0
+        ).start()
+
+        entries = json.loads(self.get("/files/?format=json").content)
+        self.assertEqual([entry["name"] for entry in entries], ["course/"])
+        entries = self.get(
+            entries[0]["url"], params={"format": "json"}
+        ).json()
+        self.assertEqual(entries[0]["url"], "/files/course/a%20b.mp3")
+        r = self.get(entries[0]["url"], headers={"Range": "bytes=-3"})
+        self.assertEqual((r.status_code, r.content), (206, b"789"))
+        self.assertEqual(r.headers["Content-Type"], "audio/mpeg")
+        r = self.get(entries[0]["url"], headers={
+            "If-None-Match": r.headers["ETag"]
+        })
+        self.assertEqual(r.status_code, 304)
+
+        for path in ["/files/.vyoma.sqlite3", "/files/../etc/passwd",
+                     "/files/course/%2e%2e/%2e%2e/etc/passwd"]:
+            self.assertEqual(self.get(path).status_code, 404)
+        # without a session, missing materials are not fetched
+        self.assertEqual(self.get("/courses/1000/5000").status_code, 404)
+
+    def test_003_catalog_listing(self):
+        """Courses are listed from the catalog, whatever the upstream."""
+        course_id = str(next(iter(self.upstream.data.courses)))
+        catalog = self.vyoma.catalog
+        self.assertEqual(
+            [str(course["course_id"]) for course in catalog.courses],
+            [course_id]
+        )
+        catalog.updated_at = 0
+        refreshed = []
+
+        def fetch_courses(*args, **kwargs):
+            refreshed.append(time.monotonic())
+            raise requests.ConnectionError("upstream is down")
+
+        with mock.patch.object(
+            self.vyoma, "fetch_courses", fetch_courses
+        ), mock.patch.object(
+            self.vyoma, "find_course", side_effect=AssertionError
+        ):
+            for retry in [0, 0, 60, 60]:
+                with mock.patch.object(mirror, "CATALOG_RETRY", retry):
+                    r = self.get("/", params={"format": "json"})
+                self.assertEqual(r.status_code, 200)
+                self.assertEqual(
+                    [course["course_id"] for course in r.json()],
+                    [course_id]
+                )
+                time.sleep(0.1)
+            # the stale catalog is refreshed in the background, at most
+            # once every CATALOG_RETRY seconds
+            self.assertEqual(len(refreshed), 2)
+            self.assertTrue(catalog.stale)
+
+        self.assertTrue(self.mirror.refresh_catalog())
+        self.assertFalse(catalog.stale)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+"""Tests for `vyoma_download.pipeline` module."""
+
+
+import threading
+import time
+import unittest
+
+from vyoma_download.pipeline import Pipeline
+
+
+class TestPipeline(unittest.TestCase):
+    def test_000_stages(self):
+        """Every item flows through every stage."""
+        pipeline = Pipeline(range(100), queue_size=4)
+        pipeline.add_stage("double", lambda x: 2 * x, workers=3)
+        pipeline.add_stage("odd", lambda x: x + 1 if x % 4 else None, 2)
+        self.assertEqual(
+            sorted(pipeline), [x + 1 for x in range(0, 200, 2) if x % 4]
+        )
+        metrics = pipeline.metrics()
+        self.assertEqual(metrics["double"]["processed"], 100)
+        self.assertEqual(metrics["odd"]["processed"], 100)
+
+    def test_001_backpressure(self):
+        """A slow stage bounds the number of items produced ahead of it."""
+        produced = []
+        lock = threading.Lock()
+
+        def source():
+            for idx in range(50):
+                with lock:
+                    produced.append(idx)
+                yield idx
+
+        consumed = []
+        pipeline = Pipeline(source(), queue_size=2)
+        pipeline.add_stage("pass", lambda x: x, workers=1)
+        for item in pipeline:
+            time.sleep(0.005)
+            with lock:
+                # queues (2 x 2), the worker, the source and the consumer
+                self.assertLessEqual(len(produced) - len(consumed), 8)
+            consumed.append(item)
+        self.assertEqual(consumed, list(range(50)))
+
+    def test_002_error(self):
+        """Errors in a stage stop the pipeline and are raised."""
+        def fail(x):
+            if x == 10:
+                raise ValueError("bad item")
+            return x
+
+        pipeline = Pipeline(range(1000), queue_size=2)
+        pipeline.add_stage("fail", fail, workers=2)
+        with self.assertLogs("vyoma_download.pipeline", "ERROR"):
+            with self.assertRaises(ValueError):
+                list(pipeline)
+        self.assertTrue(all(not t.is_alive() for t in pipeline.threads))
+
+    def test_003_early_exit(self):
+        """Workers stop when the consumer stops early."""
+        pipeline = Pipeline(range(1000), queue_size=2)
+        pipeline.add_stage("pass", lambda x: x, workers=2)
+        items = iter(pipeline)
+        self.assertIn(next(items), range(1000))
+        items.close()
+        self.assertTrue(all(not t.is_alive() for t in pipeline.threads))
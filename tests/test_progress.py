@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+"""Tests for `vyoma_download.progress` module."""
+
+
+import io
+import json
+import threading
+import unittest
+
+from vyoma_download.progress import (
+    AggregateProgress, JsonProgress, ProgressReporter, create_progress
+)
+
+
+class TestProgress(unittest.TestCase):
+    """Tests for the aggregated progress reporters."""
+
+    def report(self, progress: ProgressReporter, sizes: list):
+        def work(name, size):
+            progress.start(name)
+            progress.set_size(size)
+            for _ in range(size // 100):
+                progress.advance(100)
+            progress.finish(size > 0)
+
+        progress.add_files(len(sizes))
+        threads = [
+            threading.Thread(target=work, args=(f"file-{idx}", size))
+            for idx, size in enumerate(sizes)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        progress.close()
+
+    def test_000_json(self):
+        """JSON lines aggregate bytes and files over workers."""
+        output = io.StringIO()
+        progress = JsonProgress(interval=0, file=output)
+        self.report(progress, [1000, 2000, 0, 3000])
+        lines = [json.loads(line) for line in output.getvalue().split("\n")
+                 if line]
+        self.assertGreater(len(lines), 1)
+        final = lines[-1]
+        self.assertEqual(final["done_bytes"], 6000)
+        self.assertEqual(final["transferred_bytes"], 6000)
+        self.assertEqual(final["total_bytes"], 6000)
+        self.assertEqual(final["done_files"], 4)
+        self.assertEqual(final["failed_files"], 1)
+        self.assertEqual(final["workers"], {})
+
+    def test_001_estimate(self):
+        """Files of unknown size are estimated from the known ones."""
+        progress = JsonProgress(file=io.StringIO())
+        progress.add_files(4)
+        progress.start("first")
+        progress.set_size(1000, present=400)
+        progress.advance(600)
+        progress.finish()
+        snapshot = progress.snapshot()
+        self.assertEqual(snapshot["total_bytes"], 4000)
+        self.assertEqual(snapshot["done_bytes"], 1000)
+        self.assertEqual(snapshot["transferred_bytes"], 600)
+
+    def test_002_disabled(self):
+        """The null reporter ignores the callbacks."""
+        progress = create_progress("none")
+        self.assertFalse(progress.enabled)
+        progress.add_files(1)
+        progress.start("first")
+        progress.advance(100)
+        progress.finish()
+        progress.close()
+
+    def test_003_worker_key(self):
+        """Other threads report the bytes of a file for its worker."""
+        progress = JsonProgress(file=io.StringIO())
+        progress.add_files(1)
+        worker = progress.start("first")
+        progress.set_size(1000)
+
+        def segment():
+            progress.advance(300, worker=worker)
+
+        threads = [threading.Thread(target=segment) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        snapshot = progress.snapshot()
+        self.assertEqual(snapshot["workers"][worker]["done"], 600)
+        self.assertEqual(snapshot["done_bytes"], 600)
+        progress.finish()
+        self.assertEqual(progress.snapshot()["workers"], {})
+
+    def test_004_abstract(self):
+        """Aggregated reporters have to render their progress."""
+        with self.assertRaises(TypeError):
+            AggregateProgress()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+"""Tests for `vyoma_download.replay` module."""
+
+
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from vyoma_download.replay import (
+    SCRUBBED, TrafficRecorder, TrafficReplayer, redact_url
+)
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="vyoma-test-")
+        self.path = os.path.join(self.directory, "traffic.jsonl.gz")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_000_redact_url(self):
+        """Signatures are redacted, other parameters are kept."""
+        url = (
+            "https://cdn.example.com/a.mp3?X-Amz-Date=20240101T000000Z"
+            "&X-Amz-Expires=3600&X-Amz-Signature=abc123"
+        )
+        self.assertEqual(
+            redact_url(url),
+            "https://cdn.example.com/a.mp3?X-Amz-Date=20240101T000000Z"
+            f"&X-Amz-Expires=3600&X-Amz-Signature={SCRUBBED}"
+        )
+        url = "https://cdn.example.com/a.mp3?hdnts=exp=1~hmac=abc"
+        self.assertNotIn("hmac", redact_url(url))
+        url = "https://www.youtube.com/watch?v=abc"
+        self.assertEqual(redact_url(url), url)
+
+    def test_001_recorded_material(self):
+        """Signed material URLs are not recorded verbatim."""
+        url = "https://cdn.example.com/a.mp3?Expires=1&Signature=secret"
+        content = json.dumps({
+            "material": {"url": url, "name": "a.mp3"},
+            "apikey": "mock-apikey",
+        })
+        recorder = TrafficRecorder(self.path)
+        recorder.api("GET", "student/materials/1", {}, 200, content, 0.1)
+        recorder.download(url, 10, 0.1)
+        recorder.close()
+        with gzip.open(self.path, "rt") as f:
+            recorded = f.read()
+        self.assertNotIn("secret", recorded)
+        self.assertNotIn("mock-apikey", recorded)
+
+        # the redacted URL is downloaded from the recording
+        replayer = TrafficReplayer(self.path, scale=0)
+        material = json.loads(
+            replayer.api("GET", "student/materials/1", {})
+        )["material"]
+        self.assertIn("Expires=1", material["url"])
+        self.assertEqual(replayer.head(material["url"])["size"], 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+
+"""Tests for `vyoma_download.storage` module."""
+
+
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import unittest
+import zipfile
+from unittest import mock
+
+from vyoma_download.compression import zstd_available
+from vyoma_download.storage import (
+    INDEX_NAME, LOG_NAME, IncompleteWrite, TarStorage, ZipStorage,
+    read_index, read_member
+)
+
+
+class TestStorage(unittest.TestCase):
+    """Tests for the archive storage backends."""
+
+    members = {
+        "a.mp3": bytes(range(256)) * 40,
+        "html/1.html": "<p>नमः</p>".encode("utf-8"),
+        "empty.pdf": b"",
+    }
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="vyoma-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def fill(self, storage, log: bytes = None):
+        for idx, (name, data) in enumerate(self.members.items()):
+            # sizes are not always known in advance
+            size = len(data) if idx % 2 == 0 else None
+            with storage.open(name, size) as f:
+                for start in range(0, len(data), 1000):
+                    f.write(data[start:start + 1000])
+        if log is not None:
+            storage.write(LOG_NAME, log)
+        storage.close()
+
+    def test_000_tar(self):
+        """Tar members are streamed and indexed by offset."""
+        path = os.path.join(self.directory, "course.tar")
+        self.fill(TarStorage(path))
+        with tarfile.open(path) as archive:
+            for name, data in self.members.items():
+                self.assertEqual(archive.extractfile(name).read(), data)
+
+        index = read_index(path)["members"]
+        with open(path, "rb") as f:
+            for name, data in self.members.items():
+                f.seek(index[name]["offset"])
+                self.assertEqual(f.read(index[name]["size"]), data)
+
+    def test_001_zip(self):
+        """Zip members are streamed and indexed."""
+        path = os.path.join(self.directory, "course.zip")
+        self.fill(ZipStorage(path))
+        with zipfile.ZipFile(path) as archive:
+            self.assertIsNone(archive.testzip())
+            for name, data in self.members.items():
+                self.assertEqual(archive.read(name), data)
+            index = json.loads(archive.read(INDEX_NAME))["members"]
+        self.assertEqual(set(index), set(self.members))
+
+    def test_002_incomplete(self):
+        """Failed members leave nothing in the archive."""
+        for storage_class in [TarStorage, ZipStorage]:
+            path = os.path.join(self.directory, storage_class.__name__)
+            storage = storage_class(path)
+            with self.assertRaises(IncompleteWrite):
+                with storage.open("short.mp3", 1000) as f:
+                    f.write(b"x" * 10)
+            with self.assertRaises(IOError):
+                with storage.open("failed.mp3") as f:
+                    f.write(b"x" * 10)
+                    raise IOError("connection reset")
+            storage.write("after.pdf", b"pdf")
+            storage.close()
+            self.assertEqual(list(read_index(path)["members"]), ["after.pdf"])
+            with open(path, "rb") as f:
+                self.assertNotIn(b"x" * 10, f.read())
+
+    def test_003_concurrent_members(self):
+        """Members are written one at a time, and not interleaved."""
+        path = os.path.join(self.directory, "course.tar")
+        storage = TarStorage(path)
+        started = threading.Event()
+        written = threading.Event()
+
+        def slow_transfer():
+            with storage.open("slow.mp3", 4) as f:
+                f.write(b"sl")
+                started.set()
+                written.wait(timeout=5)
+                f.write(b"ow")
+
+        def fast_transfer():
+            with storage.open("fast.pdf", 4) as f:
+                f.write(b"fast")
+
+        threads = [threading.Thread(target=slow_transfer)]
+        threads[0].start()
+        started.wait(timeout=5)
+        threads.append(threading.Thread(target=fast_transfer))
+        threads[1].start()
+        threads[1].join(timeout=0.2)
+        # the second member waits for the first one
+        self.assertTrue(threads[1].is_alive())
+        self.assertFalse(storage.exists("fast.pdf"))
+        written.set()
+        for thread in threads:
+            thread.join()
+        storage.close()
+        with tarfile.open(path) as archive:
+            self.assertEqual(archive.getnames()[:2], ["slow.mp3", "fast.pdf"])
+            self.assertEqual(archive.extractfile("slow.mp3").read(), b"slow")
+
+    def test_004_unspooled(self):
+        """Members of known size are not staged before the archive."""
+        path = os.path.join(self.directory, "course.tar")
+        storage = TarStorage(path)
+        with mock.patch("tempfile.SpooledTemporaryFile") as spool:
+            with storage.open("a.mp3", 4) as f:
+                f.write(b"a")
+                # the archive holds the written bytes
+                storage.file.flush()
+                self.assertEqual(os.path.getsize(path), 513)
+                f.write(b"bcd")
+        self.assertFalse(spool.called)
+        storage.close()
+        self.assertEqual(read_member(path, "a.mp3"), b"abcd")
+
+    def check_resume(self, storage_class, path: str):
+        self.fill(storage_class(path), log=b"{}")
+        with open(path, "rb") as f:
+            self.written = f.read()
+        self.written_index = read_index(path)["members"]
+        storage = storage_class(path)
+        for name, data in self.members.items():
+            self.assertTrue(storage.exists(name, len(data)))
+        # unchanged members are not added again, changed members are
+        storage.write("a.mp3", self.members["a.mp3"])
+        storage.write("html/1.html", b"<p>new</p>")
+        storage.write("b.mp3", b"b")
+        storage.write(LOG_NAME, b'{"run": 2}')
+        storage.close()
+        # the log is kept by a run that does not write it
+        storage_class(path).close()
+
+        index = read_index(path)["members"]
+        self.assertEqual(
+            set(index), set(self.members) | {"b.mp3", LOG_NAME}
+        )
+        for name in index:
+            data = read_member(path, name, {"members": index})
+            self.assertEqual(len(data), index[name]["size"])
+        self.assertEqual(read_member(path, "b.mp3"), b"b")
+        self.assertEqual(read_member(path, LOG_NAME), b'{"run": 2}')
+        return index
+
+    def test_005_resume(self):
+        """Reopened archives keep their members."""
+        path = os.path.join(self.directory, "course.tar")
+        index = self.check_resume(TarStorage, path)
+        with tarfile.open(path) as archive:
+            names = archive.getnames()
+            for name in ["a.mp3", LOG_NAME, INDEX_NAME]:
+                self.assertEqual(names.count(name), 1)
+            self.assertEqual(
+                archive.extractfile("html/1.html").read(), b"<p>new</p>"
+            )
+        with open(path, "rb") as f:
+            f.seek(index["b.mp3"]["offset"])
+            self.assertEqual(f.read(1), b"b")
+
+        path = os.path.join(self.directory, "course.zip")
+        self.check_resume(ZipStorage, path)
+        with zipfile.ZipFile(path) as archive:
+            self.assertIsNone(archive.testzip())
+            names = archive.namelist()
+            for name in ["a.mp3", LOG_NAME, INDEX_NAME]:
+                self.assertEqual(names.count(name), 1)
+            self.assertEqual(archive.read("html/1.html"), b"<p>new</p>")
+
+    @unittest.skipUnless(zstd_available(), "zstandard is not installed")
+    def test_006_resume_compressed(self):
+        """Compressed archives are appended to, one frame per member."""
+        path = os.path.join(self.directory, "course.tar.zst")
+        index = self.check_resume(
+            lambda location: TarStorage(location, compression="zstd"), path
+        )
+        # the members are not compressed again
+        end = self.written_index[LOG_NAME]["frame"]
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(end), self.written[:end])
+        self.assertEqual(
+            index["a.mp3"]["frame"], self.written_index["a.mp3"]["frame"]
+        )
+        self.assertFalse(os.path.exists(f"{path}.previous"))
+
+        import zstandard
+        with open(path, "rb") as f:
+            reader = zstandard.ZstdDecompressor().stream_reader(
+                f, read_across_frames=True
+            )
+            with tarfile.open(fileobj=reader, mode="r|") as archive:
+                names = [member.name for member in archive]
+        self.assertEqual(names.count("a.mp3"), 1)
+        self.assertEqual(names[-2:], [LOG_NAME, INDEX_NAME])
+
+    def check_resume_interrupted(self, storage_class, path: str):
+        storage = storage_class(path)
+        storage.write("first.pdf", b"first")
+        storage.write("second.mp3", os.urandom(6000))
+        # the process is killed during the transfer
+        storage.file.close()
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) - 1000)
+
+        storage = storage_class(path)
+        self.assertTrue(storage.exists("first.pdf"))
+        self.assertFalse(storage.exists("second.mp3"))
+        storage.write("second.mp3", b"second")
+        storage.close()
+        self.assertEqual(
+            list(read_index(path)["members"]), ["first.pdf", "second.mp3"]
+        )
+        self.assertEqual(read_member(path, "second.mp3"), b"second")
+
+    def test_007_resume_interrupted(self):
+        """An archive cut within a member is resumed before that member."""
+        path = os.path.join(self.directory, "course.tar")
+        self.check_resume_interrupted(TarStorage, path)
+        with tarfile.open(path) as archive:
+            self.assertEqual(
+                archive.getnames(), ["first.pdf", "second.mp3", INDEX_NAME]
+            )
+
+    @unittest.skipUnless(zstd_available(), "zstandard is not installed")
+    def test_008_resume_interrupted_compressed(self):
+        """A compressed archive cut within a frame is resumed before it."""
+        path = os.path.join(self.directory, "course.tar.zst")
+        self.check_resume_interrupted(
+            lambda location: TarStorage(location, compression="zstd"), path
+        )
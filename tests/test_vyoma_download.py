@@ -3,19 +3,818 @@
 """Tests for `vyoma_download` package."""
 
 
+import contextlib
+import gzip
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-from vyoma_download import vyoma_download
+import requests
+
+from vyoma_download import fastjson
+from vyoma_download.defaults import TIMEOUT
+from vyoma_download.downloader import LinkExpired
+from vyoma_download.edmingle import ACCEPT_ENCODING, EdmingleAPI
+from vyoma_download.records import (
+    MaterialRecord, MaterialResult, SectionRecord
+)
+from vyoma_download.storage import ObjectStorage
+from vyoma_download.vyoma import Vyoma
+from vyoma_download.worker import QueueWorker
+
+from .mock_server import MockConfig, MockEdmingleServer
 
 
 class TestVyoma_download(unittest.TestCase):
     """Tests for `vyoma_download` package."""
 
+    config = MockConfig()
+
     def setUp(self):
         """Set up test fixtures, if any."""
+        self.server = MockEdmingleServer(self.config).start()
+        self.download_dir = tempfile.mkdtemp(prefix="vyoma-test-")
 
     def tearDown(self):
         """Tear down test fixtures, if any."""
+        if self.server is not None:
+            self.server.stop()
+        shutil.rmtree(self.download_dir, ignore_errors=True)
+
+    def session(self, **kwargs) -> Vyoma:
+        kwargs.setdefault("download_dir", self.download_dir)
+        return Vyoma(
+            username=self.config.username,
+            password=self.config.password,
+            api_host=self.server.api_host,
+            protocol=self.server.protocol,
+            **kwargs
+        )
+
+    def download(self, vyoma: Vyoma, course_id: int) -> dict:
+        with contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()):
+            return vyoma.download_course(course_id)
+
+    def test_000_login(self):
+        """Login fetches the user and organization."""
+        vyoma = self.session()
+        self.assertTrue(vyoma.logged_in)
+        self.assertEqual(vyoma.organization["organization_id"], 1)
+
+    def test_001_login_failure(self):
+        """Invalid credentials do not log in."""
+        api = EdmingleAPI(
+            username=self.config.username,
+            password="wrong",
+            hostname="localhost",
+            api_host=self.server.api_host,
+            protocol=self.server.protocol,
+        )
+        self.assertFalse(api.login())
+
+    def test_002_find_course(self):
+        """Courses are searched by name."""
+        vyoma = self.session()
+        courses = vyoma.find_course("gita")
+        self.assertEqual(len(courses), 1)
+        self.assertEqual(courses[0]["course_name"], "Bhagavad Gita")
+
+    def test_003_download_course(self):
+        """Every material of a course is downloaded and logged."""
+        vyoma = self.session()
+        data = self.server.data
+        course_id = 1000
+        download_log = self.download(vyoma, course_id)
+
+        course_dir = download_log["course"]["local_path"]
+        self.assertTrue(os.path.isfile(os.path.join(course_dir, "log.json")))
+
+        material = download_log["material"]
+        files = material["file"]["audio"] + material["file"]["document"]
+        self.assertEqual(
+            len(files),
+            self.config.num_sections * (
+                self.config.audio_per_section +
+                self.config.document_per_section
+            )
+        )
+        for entry in files:
+            with open(entry["local_path"], "rb") as f:
+                content = f.read()
+            expected = data.content(
+                entry["id"], 0, data.materials[entry["id"]]["size"]
+            )
+            self.assertEqual(content, expected)
+
+        self.assertEqual(
+            len(material["external_url"]["video"]),
+            self.config.num_sections * self.config.external_per_section
+        )
+        self.assertEqual(
+            len(material["html_text"]),
+            self.config.num_sections * self.config.html_per_section
+        )
+        for entry in material["html_text"]:
+            self.assertNotIn("html", entry)
+            self.assertEqual(
+                vyoma.load_html(course_dir, entry),
+                data.materials[entry["id"]]["html_text"]
+            )
+        self.assertFalse(material["failed"])
+
+        with open(os.path.join(course_dir, "log.json")) as f:
+            self.assertEqual(json.load(f)["course"]["course_id"], course_id)
+
+    def test_004_record_replay(self):
+        """Recorded traffic replays the download without the server."""
+        archive = os.path.join(self.download_dir, "traffic.jsonl.gz")
+        vyoma = self.session(record=archive)
+        recorded_log = self.download(vyoma, 1001)
+        vyoma.close()
+
+        with gzip.open(archive, "rt") as f:
+            traffic = f.read()
+        self.assertNotIn(self.config.password, traffic)
+        self.assertNotIn(self.server.data.apikey, traffic)
+
+        self.server.stop()
+        shutil.rmtree(recorded_log["course"]["local_path"])
+        replayed = Vyoma(
+            username="anyone",
+            password="anything",
+            download_dir=self.download_dir,
+            api_host=self.server.api_host,
+            protocol=self.server.protocol,
+            replay=archive,
+            replay_scale=0,
+        )
+        self.server = None
+        self.assertTrue(replayed.logged_in)
+        replayed_log = self.download(replayed, 1001)
+        self.assertEqual(
+            recorded_log["material"]["html_text"],
+            replayed_log["material"]["html_text"]
+        )
+        for entry in replayed_log["material"]["file"]["audio"]:
+            self.assertEqual(
+                os.path.getsize(entry["local_path"]), self.config.audio_size
+            )
+
+    def test_005_plan_course(self):
+        """Planning reports sizes without downloading anything."""
+        download_dir = os.path.join(self.download_dir, "new")
+        vyoma = self.session(download_dir=download_dir)
+        data = self.server.data
+        self.assertTrue(vyoma.find_course("", refresh=True))
+        plan = vyoma.plan_course(1000, probe_size=4096)
+        self.assertEqual(plan["total_bytes"], data.course_bytes(1000))
+        self.assertEqual(plan["present_bytes"], 0)
+        self.assertEqual(plan["num_materials"], data.num_materials // 2)
+        self.assertGreater(plan["throughput"], 0)
+        # neither the directory nor the state is created
+        self.assertFalse(os.path.exists(download_dir))
+
+        self.download(vyoma, 1000)
+        self.assertTrue(os.path.isfile(vyoma.state_path))
+        self.assertTrue(os.path.isfile(vyoma.catalog.path))
+        plan = vyoma.plan_course(1000)
+        self.assertEqual(plan["remaining_bytes"], 0)
+        self.assertEqual(plan["num_pending"], 0)
+
+        # sizes and throughput are unknown when the files are unreachable
+        url = next(
+            record.url for record in vyoma.iter_materials(1000)
+            if isinstance(record, MaterialRecord) and record.source == "file"
+        )
+        vyoma.close()
+        self.server.stop()
+        self.server = None
+        self.assertIsNone(vyoma.get_material_size(url)["size"])
+        self.assertIsNone(vyoma.measure_throughput(url, 4096))
+
+    def test_006_state_store(self):
+        """Downloads are tracked in the state store and resumed."""
+        vyoma = self.session()
+        self.download(vyoma, 1000)
+        requests_made = self.server.stats["files"]
+
+        counts = vyoma.get_material_count(1000)
+        self.assertEqual(
+            counts["file"]["audio"],
+            self.config.num_sections * self.config.audio_per_section
+        )
+        self.assertEqual(counts["failed"], 0)
+        summary = vyoma.state.course_summary()
+        self.assertEqual(summary[0]["num_failed"], 0)
+        self.assertEqual(
+            summary[0]["num_complete"], self.server.data.num_materials // 2
+        )
+
+        self.download(vyoma, 1000)
+        self.assertEqual(self.server.stats["files"], requests_made)
+        material_id = self.server.data.sections[10000]["resources"][0][1]
+        self.assertEqual(len(vyoma.state.get_attempts(1000, material_id)), 1)
+        vyoma.close()
+
+    def test_007_catalog_offline(self):
+        """Course lookup uses the cached catalog."""
+        vyoma = self.session()
+        self.assertEqual(vyoma.find_course("bagavad")[0]["course_id"], 1001)
+        searches = self.server.stats["student/masterbatches"]
+        self.assertEqual(len(vyoma.find_course("")), self.config.num_courses)
+        self.assertEqual(self.server.stats["student/masterbatches"], searches)
+
+        self.server.stop()
+        self.server = None
+        self.assertEqual(vyoma.find_course("Gita")[0]["course_id"], 1001)
+        vyoma.close()
+
+    def test_008_html_compression(self):
+        """HTML text materials are saved to (compressed) files."""
+        for compression, suffix in [("none", ".html"), ("gzip", ".html.gz")]:
+            vyoma = self.session(html_compression=compression)
+            download_log = self.download(vyoma, 1000)
+            course_dir = download_log["course"]["local_path"]
+            for entry in download_log["material"]["html_text"]:
+                self.assertTrue(entry["filename"].endswith(suffix))
+                self.assertEqual(
+                    os.path.getsize(entry["local_path"]), entry["size"]
+                )
+                self.assertEqual(
+                    vyoma.load_html(course_dir, entry),
+                    self.server.data.materials[entry["id"]]["html_text"]
+                )
+            vyoma.close()
+
+    def test_009_check_links(self):
+        """External links are checked and recorded in the download log."""
+        vyoma = self.session()
+        download_log = self.download(vyoma, 1000)
+        results = vyoma.check_links(download_log)
+        self.assertEqual(
+            len(results),
+            self.config.num_sections * self.config.external_per_section
+        )
+        course_dir = download_log["course"]["local_path"]
+        with open(os.path.join(course_dir, "log.json")) as f:
+            saved_log = json.load(f)
+        for entry in saved_log["material"]["external_url"]["video"]:
+            self.assertTrue(entry["link"]["ok"])
+            self.assertEqual(entry["link"]["title"], entry["name"])
+        vyoma.close()
+
+    def test_010_json_progress(self):
+        """Machine-readable progress reports every file and byte."""
+        vyoma = self.session(progress="json")
+        output = io.StringIO()
+        with contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(output):
+            vyoma.download_course(1000)
+        final = json.loads(output.getvalue().strip().split("\n")[-1])
+        course_bytes = self.server.data.course_bytes(1000)
+        self.assertEqual(final["done_files"], final["total_files"])
+        self.assertEqual(final["failed_files"], 0)
+        self.assertEqual(final["transferred_bytes"], course_bytes)
+        vyoma.close()
+
+    def test_011_iter_materials(self):
+        """The curriculum is walked lazily, one request at a time."""
+        vyoma = self.session()
+        records = vyoma.iter_materials(1000)
+        section = next(records)
+        self.assertIsInstance(section, SectionRecord)
+        material = next(records)
+        self.assertIsInstance(material, MaterialRecord)
+        self.assertTrue(material.resolved)
+        self.assertEqual(self.server.stats.get("files", 0), 0)
+        self.assertEqual(self.server.stats["student/materials"], 1)
+
+        materials = [material] + [
+            record for record in records
+            if isinstance(record, MaterialRecord)
+        ]
+        self.assertEqual(
+            len(materials),
+            sum(
+                len(self.server.data.sections[section_id]["resources"])
+                for section_id in self.server.data.courses[1000]["sections"]
+            )
+        )
+        vyoma.close()
+
+    def test_012_download_materials(self):
+        """Filtered material streams are downloaded in parallel."""
+        vyoma = self.session()
+        audios = (
+            record for record in vyoma.iter_materials(1000)
+            if isinstance(record, MaterialRecord) and record.type == "audio"
+        )
+        with contextlib.redirect_stderr(io.StringIO()):
+            results = list(vyoma.download_materials(audios, max_workers=4))
+        self.assertEqual(
+            len(results),
+            self.config.num_sections * self.config.audio_per_section
+        )
+        for result in results:
+            self.assertEqual(result.status, "complete")
+            self.assertEqual(
+                os.path.getsize(result.record.local_path),
+                self.config.audio_size
+            )
+            self.assertTrue(
+                vyoma.is_downloaded(1000, result.record.material_id)
+            )
+        vyoma.close()
+
+    def test_013_archive_storage(self):
+        """Courses are streamed into a single archive."""
+        vyoma = self.session(storage="tar")
+        download_log = self.download(vyoma, 1000)
+        archive_path = download_log["course"]["local_path"]
+        self.assertTrue(archive_path.endswith(".tar"))
+        self.assertFalse(os.path.exists(archive_path[:-len(".tar")]))
+
+        data = self.server.data
+        with tarfile.open(archive_path) as archive:
+            self.assertIn("log.json", archive.getnames())
+            for entry in download_log["material"]["file"]["audio"]:
+                content = archive.extractfile(entry["filename"]).read()
+                self.assertEqual(
+                    content,
+                    data.content(entry["id"], 0, len(content))
+                )
+                self.assertEqual(len(content), entry["size"])
+
+        # a second run resumes the archive, without downloading its files
+        downloads = self.server.stats["files"]
+        self.download(vyoma, 1000)
+        self.assertEqual(self.server.stats["files"], downloads)
+        with tarfile.open(archive_path) as archive:
+            names = archive.getnames()
+        self.assertEqual(len(names), len(set(names)))
+        vyoma.close()
+
+    def test_014_object_storage(self):
+        """Materials are uploaded to an S3-compatible endpoint."""
+        bucket = f"http://{self.server.api_host}/bucket/vyoma"
+        vyoma = self.session(storage=bucket)
+        download_log = self.download(vyoma, 1000)
+        entries = download_log["material"]["file"]["document"]
+        for entry in entries:
+            key = entry["local_path"].split(self.server.api_host)[1]
+            self.assertEqual(len(self.server.objects[key]), entry["size"])
+
+        # uploaded objects are not downloaded again
+        downloads = self.server.stats["files"]
+        self.download(vyoma, 1000)
+        self.assertEqual(self.server.stats["files"], downloads)
+
+        # uploads use the timeouts of the session
+        storage = vyoma.get_storage({"local_path": self.download_dir})
+        self.assertIs(storage.session, vyoma.session)
+        self.assertEqual(storage.session.timeout, vyoma.session.timeout)
+        self.assertEqual(ObjectStorage(bucket).session.timeout, TIMEOUT)
+
+        # objects of known size are uploaded as they are written
+        with storage.open("streamed.mp3", 6) as f:
+            f.write(b"str")
+            f.write(b"eam")
+        key = storage.path("streamed.mp3").split(self.server.api_host)[1]
+        self.assertEqual(self.server.objects[key], b"stream")
+        with self.assertRaises(IOError):
+            with storage.open("short.mp3", 6) as f:
+                f.write(b"sh")
+        key = storage.path("short.mp3").split(self.server.api_host)[1]
+        self.assertNotIn(key, self.server.objects)
+        vyoma.close()
+
+    def test_015_concurrent_reauthentication(self):
+        """Workers sharing a client sign-in again only once."""
+        vyoma = self.session()
+        material_ids = sorted(self.server.data.materials)[:8]
+        stale = vyoma.auth
+        apikey = self.server.data.rotate_apikey(self.config.username)
+
+        barrier = threading.Barrier(len(material_ids))
+
+        def fetch(material_id):
+            barrier.wait()
+            return vyoma.get_material(2000, material_id)
+
+        with ThreadPoolExecutor(max_workers=len(material_ids)) as executor:
+            responses = list(executor.map(fetch, material_ids))
+
+        for material_id, response in zip(material_ids, responses):
+            self.assertEqual(response["material"]["material_id"], material_id)
+        self.assertEqual(self.server.stats["tutor/login"], 2)
+        self.assertEqual(vyoma.apikey, apikey)
+        self.assertEqual(vyoma.auth.generation, stale.generation + 1)
+        self.assertEqual(vyoma.auth.organization_id, stale.organization_id)
+        vyoma.close()
+
+    def test_016_adaptive_concurrency(self):
+        """Transfers ramp up in parallel, with decisions in the metrics."""
+        vyoma = self.session(progress="json", max_workers=4)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(output):
+            download_log = vyoma.download_course(1000)
+        self.assertFalse(download_log["material"]["failed"])
+        final = json.loads(output.getvalue().strip().split("\n")[-1])
+        transfer = final["metrics"]["concurrency"]["transfer"]
+        self.assertLessEqual(transfer["limit"], 4)
+        self.assertEqual(
+            final["metrics"]["pipeline"]["transfer"]["workers"], 4
+        )
+        self.assertGreater(transfer["increases"], 0)
+        self.assertIsNotNone(transfer["last_decision"])
+        vyoma.close()
+
+    def test_017_hedged_metadata(self):
+        """Hedged metadata requests return the same curriculum."""
+        vyoma = self.session(hedge=0.5, hedge_budget=0.5)
+        vyoma.hedger.min_samples = 2
+        records = list(vyoma.iter_materials(1000))
+        self.assertTrue(all(
+            record.resolved for record in records
+            if isinstance(record, MaterialRecord)
+        ))
+        metrics = vyoma.concurrency_metrics()["hedging"]
+        self.assertGreater(metrics["requests"], len(records) // 2)
+        self.assertLessEqual(metrics["hedged"], metrics["requests"] * 0.5)
+        vyoma.close()
+
+    def test_018_duplicate_materials(self):
+        """Materials listed in several sections are fetched once."""
+        self.server.stop()
+        self.server = MockEdmingleServer(
+            MockConfig(shared_materials=True)
+        ).start()
+        data = self.server.data
+        course = data.courses[1000]
+        resources = [
+            resource
+            for section_id in course["sections"]
+            for resource in data.sections[section_id]["resources"]
+        ]
+        unique = {resource[1] for resource in resources}
+        files = {
+            resource[1] for resource in resources if resource[5] == "file"
+        }
+        shared_id = resources[0][1]
+
+        for max_workers in [1, 3]:
+            stats = dict(self.server.stats)
+            vyoma = Vyoma(
+                username=self.config.username,
+                password=self.config.password,
+                download_dir=os.path.join(self.download_dir, str(max_workers)),
+                api_host=self.server.api_host,
+                protocol=self.server.protocol,
+                max_workers=max_workers,
+                progress="none",
+            )
+            download_log = self.download(vyoma, 1000)
+            self.assertEqual(
+                self.server.stats["student/materials"] -
+                stats.get("student/materials", 0),
+                len(unique)
+            )
+            self.assertEqual(
+                self.server.stats["files"] - stats.get("files", 0),
+                len(files)
+            )
+
+            audios = download_log["material"]["file"]["audio"]
+            shared = [entry for entry in audios if entry["id"] == shared_id]
+            self.assertEqual(len(shared), len(course["sections"]))
+            self.assertEqual(
+                {entry["section_id"] for entry in shared},
+                set(course["sections"])
+            )
+            self.assertEqual(len({entry["local_path"] for entry in shared}), 1)
+            self.assertTrue(all(
+                entry["size"] == data.materials[shared_id]["size"]
+                for entry in shared
+            ))
+            self.assertNotIn("duplicate_of", shared[0])
+            self.assertIn("duplicate_of", shared[1])
+
+            plan = vyoma.plan_course(1000)
+            self.assertEqual(plan["num_materials"], len(unique))
+            self.assertEqual(
+                plan["num_duplicates"], len(resources) - len(unique)
+            )
+            vyoma.close()
+
+    def test_019_expiring_urls(self):
+        """Expired material URLs are resolved again before the transfer."""
+        for expiry_param in ["Expires", "token"]:
+            self.server.stop()
+            self.server = MockEdmingleServer(
+                MockConfig(url_ttl=2, url_expiry_param=expiry_param)
+            ).start()
+            vyoma = self.session(
+                download_dir=os.path.join(self.download_dir, expiry_param)
+            )
+            vyoma.urls.margin = 0
+            audios = [
+                record for record in vyoma.iter_materials(1000)
+                if isinstance(record, MaterialRecord) and
+                record.type == "audio"
+            ]
+            resolved = self.server.stats["student/materials"]
+            time.sleep(2.1)
+
+            with contextlib.redirect_stderr(io.StringIO()):
+                results = list(
+                    vyoma.download_materials(audios, max_workers=2)
+                )
+            self.assertTrue(all(
+                result.status == "complete" for result in results
+            ))
+            self.assertEqual(
+                self.server.stats["student/materials"] - resolved,
+                len(audios)
+            )
+            # unknown signing schemes are only detected by the server
+            self.assertEqual(
+                self.server.stats.get("files/expired", 0),
+                len(audios) if expiry_param == "token" else 0
+            )
+            vyoma.close()
+
+    def test_020_request_path(self):
+        """API headers are built once, and parameters are URL-encoded."""
+        vyoma = self.session()
+        headers = vyoma.request_headers(vyoma.auth)
+        self.assertIs(vyoma.request_headers(vyoma.auth), headers)
+        self.assertEqual(headers["APIKEY"], vyoma.apikey)
+        self.assertEqual(headers["Accept-Encoding"], ACCEPT_ENCODING)
+
+        self.assertEqual(
+            len(vyoma.get_courses("Bhagavad Gita")["batches"]), 1
+        )
+        self.assertEqual(
+            len(vyoma.get_courses("Gita&search=")["batches"]), 0
+        )
+        self.assertEqual(fastjson.loads(b' {"a": [1]}\n'), {"a": [1]})
+        vyoma.close()
+
+    def test_021_lazy_imports(self):
+        """The package and the console script import the stack lazily."""
+        code = (
+            "import logging, sys\n"
+            "import vyoma_download, vyoma_download.cli\n"
+            "heavy = ['requests', 'tqdm', 'tabulate',"
+            " 'vyoma_download.vyoma']\n"
+            "print([m for m in heavy if m in sys.modules])\n"
+            "print(logging.getLogger().handlers)\n"
+            "print(vyoma_download.Vyoma.__name__)\n"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            stdout=subprocess.PIPE, check=True, text=True
+        )
+        self.assertEqual(result.stdout.split("\n")[:3], ["[]", "[]", "Vyoma"])
+
+    def test_022_parallel_startup(self):
+        """Startup steps overlap, and file hosts are warmed up next time."""
+        vyoma = self.session(startup_workers=1)
+        self.assertTrue(vyoma.logged_in)
+        self.assertIsNone(vyoma.catalog_refresh)
+        self.assertEqual(vyoma.state.recent_hosts("files"), [])
+        self.download(vyoma, 1000)
+        file_host = f"http://{self.server.api_host}"
+        self.assertEqual(vyoma.state.recent_hosts("files"), [file_host])
+        vyoma.close()
+
+        connections = self.server.stats["connections"]
+        vyoma = self.session(startup_workers=4, max_workers=2)
+        self.assertIsNotNone(vyoma.catalog_refresh)
+        self.assertEqual(vyoma.find_course("bagavad")[0]["course_id"], 1001)
+        self.assertIsNone(vyoma.catalog_refresh)
+        self.assertEqual(
+            set(vyoma.startup_timings), {"login", "local_state", "catalog"}
+        )
+        # login, catalog and warm-ups of the API and file hosts
+        self.assertGreaterEqual(
+            self.server.stats["connections"] - connections, 3
+        )
+        vyoma.close()
+
+    def test_023_queue_workers(self):
+        """Workers sharing a download directory split the queued jobs."""
+        data = self.server.data
+        # a material that is listed in two sections
+        sections = data.courses[1000]["sections"]
+        shared = list(data.sections[sections[0]]["resources"][0])
+        resources = data.sections[sections[1]]["resources"]
+        resources.append([sections[1], shared[1], len(resources)] + shared[3:])
+
+        resources = [
+            (course_id, resource)
+            for course_id in data.courses
+            for section_id in data.courses[course_id]["sections"]
+            for resource in data.sections[section_id]["resources"]
+        ]
+        materials = {
+            (course_id, resource[1]) for course_id, resource in resources
+        }
+        files = {
+            (course_id, resource[1])
+            for course_id, resource in resources if resource[5] == "file"
+        }
+
+        sessions = [self.session(progress="none") for _ in range(2)]
+        workers = [
+            QueueWorker(vyoma, threads=2, poll_interval=0.05, name=f"w{idx}")
+            for idx, vyoma in enumerate(sessions)
+        ]
+        for course_id in data.courses:
+            self.assertTrue(workers[0].add_course(course_id))
+        self.assertFalse(workers[1].add_course(1000))
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            stats = list(executor.map(lambda worker: worker.run(), workers))
+        num_jobs = len(data.courses) + len(data.sections) + len(materials)
+        self.assertEqual(sum(stat["done"] for stat in stats), num_jobs)
+        self.assertTrue(all(stat["done"] for stat in stats))
+        self.assertEqual(workers[0].queue.counts()["done"], num_jobs)
+        self.assertEqual(self.server.stats["files"], len(files))
+
+        state = sessions[0].state
+        for course_id, material_id in files:
+            stored = state.get_material(course_id, material_id)
+            with open(stored["local_path"], "rb") as f:
+                self.assertEqual(
+                    f.read(),
+                    data.content(
+                        material_id, 0, data.materials[material_id]["size"]
+                    )
+                )
+        # every section of a shared material is recorded, and logged
+        for course_id in data.courses:
+            rows = state.get_materials(course_id)
+            self.assertEqual(
+                len(rows),
+                sum(1 for owner, _ in resources if owner == course_id)
+            )
+            self.assertTrue(all(row["status"] != "pending" for row in rows))
+            course_dir = state.get_course(course_id)["local_path"]
+            with open(os.path.join(course_dir, "log.json")) as f:
+                download_log = json.load(f)
+            self.assertEqual(
+                len(download_log["section"]),
+                len(data.courses[course_id]["sections"])
+            )
+        copies = [
+            row for row in state.get_materials(1000)
+            if row["material_id"] == str(shared[1])
+        ]
+        self.assertEqual(len(copies), 2)
+        # either section may be fetched first
+        primary, duplicate = sorted(
+            copies, key=lambda row: "duplicate_of" in row
+        )
+        self.assertEqual(
+            duplicate["duplicate_of"]["section_id"], primary["section_id"]
+        )
+        self.assertEqual(duplicate["local_path"], primary["local_path"])
+
+        # a synced course can be queued again, without fetching its files
+        self.assertTrue(workers[1].add_course(1000))
+        self.assertFalse(workers[0].add_course(1000))
+        workers[1].run()
+        self.assertEqual(self.server.stats["files"], len(files))
+        self.assertEqual(workers[1].queue.counts()["pending"], 0)
+        for worker, vyoma in zip(workers, sessions):
+            worker.close()
+            vyoma.close()
+
+    def test_024_nested_duplicates(self):
+        """ID duplicates of URL duplicates are logged like any duplicate."""
+        data = self.server.data
+        course = data.courses[1000]
+        first = data.sections[course["sections"][0]]["resources"][0]
+        # another material ID with the URL of the first material, listed
+        # in two sections
+        alias_id = max(data.materials) + 1
+        data.materials[alias_id] = dict(data.materials[first[1]])
+        for section_id in course["sections"][1:3]:
+            resources = data.sections[section_id]["resources"]
+            resources.append([
+                section_id, alias_id, len(resources), "Alias", "audio",
+                "file", 0, None
+            ])
+        num_resources = sum(
+            len(data.sections[section_id]["resources"])
+            for section_id in course["sections"]
+        )
+
+        def num_entries(material_log: dict) -> int:
+            return sum(
+                len(value) if isinstance(value, list) else
+                sum(len(entries) for entries in value.values())
+                for value in material_log.values()
+            )
+
+        for max_workers in [1, 4]:
+            vyoma = self.session(
+                download_dir=os.path.join(self.download_dir, str(max_workers)),
+                max_workers=max_workers,
+                progress="none",
+            )
+            download_log = self.download(vyoma, 1000)
+            material_log = download_log["material"]
+            self.assertEqual(num_entries(material_log), num_resources)
+            aliases = [
+                entry for entry in material_log["file"]["audio"]
+                if entry["id"] == alias_id
+            ]
+            self.assertEqual(len(aliases), 2)
+            for entry in aliases:
+                self.assertEqual(entry["duplicate_of"]["id"], first[1])
+
+            records = vyoma.iter_materials(1000)
+            results = [
+                item for item in vyoma.download_materials(
+                    records, max_workers=max_workers
+                )
+                if isinstance(item, MaterialResult)
+            ]
+            self.assertEqual(len(results), num_resources)
+            vyoma.close()
+        # every file is fetched once per download directory
+        self.assertEqual(
+            self.server.stats["files"],
+            2 * len({
+                resource[1]
+                for section_id in course["sections"]
+                for resource in data.sections[section_id]["resources"]
+                if resource[5] == "file" and resource[1] != alias_id
+            })
+        )
+
+    def test_025_material_lookup_error(self):
+        """A failed material lookup fails only that material."""
+        data = self.server.data
+        course = data.courses[1000]
+        broken = data.sections[course["sections"][0]]["resources"][0][1]
+        vyoma = self.session(progress="none")
+        get_material = vyoma.get_material
+
+        def lookup(class_id, material_id):
+            if int(material_id) == broken:
+                raise requests.ConnectionError("connection reset")
+            return get_material(class_id, material_id)
+
+        with mock.patch.object(vyoma, "get_material", lookup):
+            download_log = self.download(vyoma, 1000)
+        material_log = download_log["material"]
+        self.assertEqual(
+            [entry["id"] for entry in material_log["failed"]], [broken]
+        )
+        self.assertIn(
+            "ConnectionError",
+            material_log["failed"][0]["response"]["message"]
+        )
+        self.assertEqual(
+            len(material_log["file"]["audio"]) + 1,
+            self.config.num_sections * self.config.audio_per_section
+        )
+        vyoma.close()
+
+    def test_026_refresh_error(self):
+        """A failed resolution after a rejected URL fails the attempt."""
+        vyoma = self.session(progress="none")
+        record = next(
+            record for record in vyoma.iter_materials(1000)
+            if isinstance(record, MaterialRecord) and record.source == "file"
+        )
+
+        def lookup(class_id, material_id):
+            raise requests.ConnectionError("connection reset")
 
-    def test_000_something(self):
-        """Test something."""
+        with mock.patch.object(
+            vyoma, "_transfer", side_effect=LinkExpired("URL has expired")
+        ), mock.patch.object(vyoma, "get_material", lookup):
+            result = vyoma.fetch_material(record)
+        self.assertEqual(result.status, "failed")
+        self.assertIn("ConnectionError", result.entry["error"])
+        attempts = vyoma.state.get_attempts(1000, record.material_id)
+        self.assertEqual(len(attempts), 1)
+        self.assertEqual(attempts[0]["status"], "failed")
+        self.assertEqual(attempts[0]["error"], result.entry["error"])
+        vyoma.close()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+"""Tests for the durable work queue."""
+
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from multiprocessing import Process
+
+from vyoma_download.workqueue import Heartbeat, WorkQueue
+
+
+def lease_and_exit(path: str):
+    """Lease a job and die without completing it"""
+    WorkQueue(path).lease("crashed", duration=0.2)
+    os._exit(0)
+
+
+class TestWorkQueue(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="vyoma-queue-")
+        self.path = os.path.join(self.directory, "queue.sqlite3")
+        self.queue = WorkQueue(self.path)
+
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_000_put_and_lease(self):
+        """Jobs are unique by key, and leased by priority."""
+        self.assertTrue(self.queue.put("course", "course:1", {"id": 1}))
+        self.assertFalse(self.queue.put("course", "course:1", {"id": 1}))
+        self.assertEqual(self.queue.put_many([
+            ("material", "material:1", {"id": 1}),
+            ("material", "material:2", {"id": 2}),
+        ], priority=2), 2)
+
+        leased = [self.queue.lease("w1") for _ in range(4)]
+        self.assertEqual(
+            [job.key for job in leased[:3]],
+            ["material:1", "material:2", "course:1"]
+        )
+        self.assertIsNone(leased[3])
+        self.assertEqual(leased[0].payload, {"id": 1})
+        self.assertEqual(self.queue.counts()["leased"], 3)
+
+        for job in leased[:3]:
+            self.assertTrue(self.queue.complete(job))
+        self.assertEqual(self.queue.counts()["done"], 3)
+        self.assertEqual(self.queue.active(), 0)
+
+    def test_001_retries(self):
+        """Failed jobs are retried with backoff, up to max_attempts."""
+        self.queue.put("material", "material:1", {}, max_attempts=2)
+        job = self.queue.lease("w1")
+        self.assertTrue(self.queue.fail(job, "boom", retry_delay=0.2))
+        self.assertIsNone(self.queue.lease("w1"))
+        time.sleep(0.25)
+        job = self.queue.lease("w1")
+        self.assertEqual(job.attempts, 2)
+        self.queue.fail(job, "boom again")
+        self.assertEqual(self.queue.counts()["failed"], 1)
+        self.assertEqual(
+            self.queue.failed_jobs()[0]["error"], "boom again"
+        )
+
+        self.assertEqual(self.queue.retry_failed(), 1)
+        self.assertEqual(self.queue.lease("w1").attempts, 1)
+
+    def test_002_expired_lease(self):
+        """The job of a dead worker is reclaimed, and its worker loses it."""
+        self.queue.put("course", "course:1", {}, max_attempts=2)
+        process = Process(target=lease_and_exit, args=(self.path,))
+        process.start()
+        process.join()
+        self.assertEqual(self.queue.counts()["leased"], 1)
+        self.assertIsNone(self.queue.lease("w1"))
+
+        time.sleep(0.25)
+        job = self.queue.lease("w1", duration=0.3)
+        self.assertEqual((job.key, job.attempts), ("course:1", 2))
+        # a late update from the dead worker is rejected
+        stale = type(job)(**dict(vars(job), worker="crashed"))
+        self.assertFalse(self.queue.complete(stale))
+
+        # heartbeats keep the lease beyond its duration
+        with Heartbeat(self.queue, job, duration=0.3) as heartbeat:
+            time.sleep(0.5)
+            self.assertIsNone(self.queue.lease("w2"))
+        self.assertFalse(heartbeat.lost.is_set())
+        self.assertTrue(self.queue.complete(job))
+
+    def test_003_last_attempt_expired(self):
+        """A job whose last lease expires is marked as failed."""
+        self.queue.put("course", "course:1", {}, max_attempts=1)
+        self.queue.lease("w1", duration=0.1)
+        time.sleep(0.15)
+        self.assertIsNone(self.queue.lease("w2"))
+        self.assertEqual(self.queue.counts()["failed"], 1)
+
+    def test_004_batches(self):
+        """A batch is run again once all of its jobs have finished."""
+        self.assertTrue(self.queue.put_batch("course", "course:1", {}, "1"))
+        self.queue.put("course", "course:2", {}, batch="2")
+        job = self.queue.lease("w1")
+        self.queue.put_many([
+            ("section", "section:1:1", {}),
+            ("section", "section:1:2", {}),
+        ], batch=job.batch)
+        self.queue.complete(job)
+        self.assertEqual(self.queue.active("1"), 2)
+        self.assertFalse(self.queue.put_batch("course", "course:1", {}, "1"))
+
+        for _ in range(3):
+            self.queue.complete(self.queue.lease("w1"))
+        self.assertEqual(self.queue.active(), 0)
+        self.assertTrue(self.queue.put_batch("course", "course:1", {}, "1"))
+        self.assertEqual(self.queue.counts(), {
+            "pending": 1, "leased": 0, "done": 1, "failed": 0
+        })
+        self.assertEqual(self.queue.lease("w1").key, "course:1")
+
+
+if __name__ == "__main__":
+    unittest.main()
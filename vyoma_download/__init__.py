@@ -8,4 +8,12 @@ __version__ = "1.0.1"
 
 ###############################################################################
 
-from .vyoma import Vyoma  # noqa
+# submodules are imported on first use, so that importing the package (or
+# running a short command) does not load the download stack
+
+
+def __getattr__(name: str):
+    if name == "Vyoma":
+        from .vyoma import Vyoma
+        return Vyoma
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Multi-Account Synchronisation
+
+A `Vyoma` session is created for every account. The sessions share one
+scheduler, the concurrency limiters of metadata calls and transfers, one
+connection pool per host and a cache of account-independent API responses,
+while the APIKEY of every account stays with its session.
+
+@author: Hrishikesh Terdalkar
+"""
+
+import logging
+import os
+from typing import Dict, List, Tuple
+
+from .progress import create_progress
+from .shared import SharedResources
+from .vyoma import Vyoma
+
+###############################################################################
+
+LOGGER = logging.getLogger(__name__)
+
+###############################################################################
+
+
+def read_accounts(path: str) -> List[Tuple[str, str]]:
+    """Read `username:password` lines from a file
+
+    Blank lines and lines starting with '#' are ignored.
+    """
+    accounts = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            username, _, password = line.partition(":")
+            accounts.append((username.strip(), password.strip()))
+    return accounts
+
+###############################################################################
+
+
+class MultiAccountSync:
+    def __init__(
+        self,
+        accounts: List[Tuple[str, str]],
+        download_dir: str = None,
+        max_workers: int = 4,
+        session_workers: int = 1,
+        progress: str = "bar",
+        **kwargs,
+    ):
+        """Sessions of several accounts sharing resources
+
+        Parameters
+        ----------
+        accounts : List[Tuple[str, str]]
+            Username and password of every account
+        download_dir : str, optional
+            Location in which a directory is created for every account.
+            The default is None, which uses the default location of every
+            account.
+        max_workers : int, optional
+            Number of accounts synced in parallel.
+            The default is 4.
+        session_workers : int, optional
+            Maximum number of parallel downloads of every account.
+            The default is 1.
+        progress : str, optional
+            Progress display shared by the accounts, one of "bar", "json" or
+            "none".
+            The default is "bar".
+
+        Additional keyword arguments are passed to every Vyoma session,
+        except for `record` and `replay`, since the traffic of several
+        accounts can not share an archive.
+        """
+        for option in ["record", "replay"]:
+            if kwargs.get(option):
+                raise ValueError(
+                    f"'{option}' is not supported with several accounts"
+                )
+        session_workers = max(session_workers, 1)
+        self.shared = SharedResources(
+            max_workers=max_workers,
+            progress=create_progress(progress, max_workers * session_workers),
+            # metadata calls and transfers of every session
+            connections=2 * max_workers * session_workers,
+            max_operations=max_workers * session_workers,
+        )
+        futures = {
+            username: self.shared.executor.submit(
+                Vyoma,
+                username=username,
+                password=password,
+                download_dir=(
+                    os.path.join(download_dir, username)
+                    if download_dir else None
+                ),
+                progress=progress,
+                max_workers=session_workers,
+                shared=self.shared,
+                **kwargs,
+            )
+            for username, password in accounts
+        }
+
+        self.sessions = {}
+        for username, future in futures.items():
+            try:
+                session = future.result()
+            except Exception as e:
+                LOGGER.error(f"Could not create a session for {username}: {e}")
+                continue
+            if not session.logged_in:
+                LOGGER.error(f"Could not sign-in as {username}.")
+                session.close()
+                continue
+            self.sessions[username] = session
+
+    def find_course(self, search_pattern: str, **kwargs) -> List[Dict]:
+        """Find courses using the first signed-in session"""
+        for session in self.sessions.values():
+            return session.find_course(search_pattern, **kwargs)
+        return []
+
+    def download_course(self, course_id: str, **kwargs) -> Dict:
+        """Download a course for every account
+
+        Returns
+        -------
+        Dict
+            Download log of every account (None if the download failed)
+        """
+        futures = {
+            username: self.shared.executor.submit(
+                session.download_course, course_id, **kwargs
+            )
+            for username, session in self.sessions.items()
+        }
+        download_logs = {}
+        for username, future in futures.items():
+            try:
+                download_logs[username] = future.result()
+            except Exception:
+                LOGGER.exception(f"Could not download for {username}.")
+                download_logs[username] = None
+        return download_logs
+
+    def close(self):
+        for session in self.sessions.values():
+            session.close()
+        if self.shared.progress is not None:
+            self.shared.progress.close()
+        self.shared.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+###############################################################################
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Authentication Context and Session Pool
+
+An `EdmingleAPI` client may be used by several worker threads at once.
+The credentials of a signed-in client are held in an immutable
+`AuthContext`, which is replaced as a whole on (re-)authentication, so that
+every request sees a consistent APIKEY and ORGID. HTTP requests are made
+with sessions checked out of a `SessionPool`, so that no two workers use the
+same `requests.Session` at the same time.
+
+@author: Hrishikesh Terdalkar
+"""
+
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterator, Tuple
+from urllib.parse import urlsplit
+
+import requests
+
+###############################################################################
+
+
+@dataclass(frozen=True)
+class AuthContext:
+    """Credentials of a signed-in client
+
+    `generation` is incremented on every successful sign-in, and is used to
+    detect whether a stale context has already been refreshed.
+    """
+    apikey: str = None
+    organization_id: str = ""
+    generation: int = 0
+
+    @property
+    def headers(self) -> Dict:
+        return {"APIKEY": self.apikey, "ORGID": self.organization_id}
+
+###############################################################################
+
+
+class SessionPool:
+    def __init__(
+        self,
+        shared=None,
+        timeout: float or Tuple[float, float] = None,
+    ):
+        """Pool of sessions, checked out by one worker at a time
+
+        The pool can be used in place of a `requests.Session`: every request
+        is made with a session checked out for its duration.
+
+        Parameters
+        ----------
+        shared : SharedResources, optional
+            Resources whose connection pools are mounted on every session.
+            The default is None.
+        timeout : float or Tuple[float, float], optional
+            Default (connect, read) timeout of every request, in seconds.
+            The default is None, which waits forever.
+        """
+        self.shared = shared
+        self.timeout = timeout
+        self.idle = []
+        self.sessions = []
+        self.environment = {}
+        self.lock = threading.Lock()
+
+    def _create(self) -> requests.Session:
+        session = requests.Session()
+        if self.shared is not None:
+            self.shared.mount(session)
+        with self.lock:
+            self.sessions.append(session)
+        return session
+
+    @contextmanager
+    def checkout(self) -> Iterator[requests.Session]:
+        """Check out a session for exclusive use"""
+        with self.lock:
+            session = self.idle.pop() if self.idle else None
+        if session is None:
+            session = self._create()
+        try:
+            yield session
+        finally:
+            with self.lock:
+                self.idle.append(session)
+
+    # ----------------------------------------------------------------------- #
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        if self.timeout is not None:
+            kwargs.setdefault("timeout", self.timeout)
+        with self.checkout() as session:
+            return session.request(method, url, **kwargs)
+
+    def send(
+        self,
+        prepared: requests.PreparedRequest,
+        **kwargs,
+    ) -> requests.Response:
+        """Send a prepared request
+
+        Unlike `request`, the request is sent as prepared, without merging
+        the session headers and cookies. Environment settings (proxies and
+        CA bundle) are resolved once per host, instead of on every request.
+        """
+        if self.timeout is not None:
+            kwargs.setdefault("timeout", self.timeout)
+        origin = urlsplit(prepared.url)[:2]
+        with self.checkout() as session:
+            settings = self.environment.get(origin)
+            if settings is None:
+                settings = session.merge_environment_settings(
+                    prepared.url, {}, None, None, None
+                )
+                with self.lock:
+                    self.environment[origin] = settings
+            for key, value in settings.items():
+                kwargs.setdefault(key, value)
+            return session.send(prepared, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("allow_redirects", True)
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("allow_redirects", False)
+        return self.request("HEAD", url, **kwargs)
+
+    def post(self, url: str, data=None, **kwargs) -> requests.Response:
+        return self.request("POST", url, data=data, **kwargs)
+
+    def put(self, url: str, data=None, **kwargs) -> requests.Response:
+        return self.request("PUT", url, data=data, **kwargs)
+
+    # ----------------------------------------------------------------------- #
+
+    def close(self):
+        with self.lock:
+            sessions, self.sessions, self.idle = self.sessions, [], []
+        # shared connection pools are closed by their owner
+        if self.shared is None:
+            for session in sessions:
+                session.close()
+
+###############################################################################
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local Course Catalog
+
+All the courses (masterbatches) are cached on the disk and indexed in memory
+so that course lookup is instant and works offline. Course names and tutors
+are matched by token prefix and by fuzzy similarity after a
+transliteration-aware normalization, so that "bhagavad", "bagavad",
+"Bhagavad" and "भगवद्" all find the same course.
+
+@author: Hrishikesh Terdalkar
+"""
+
+import difflib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from typing import Dict, List
+
+###############################################################################
+
+CATALOG_FILE = ".catalog.json"
+CATALOG_TTL = 24 * 60 * 60
+MAX_PREFIX_LENGTH = 16
+
+###############################################################################
+
+DEVANAGARI_VOWELS = {
+    "अ": "a", "आ": "aa", "इ": "i", "ई": "ii", "उ": "u", "ऊ": "uu",
+    "ऋ": "r", "ॠ": "r", "ऌ": "l", "ए": "e", "ऐ": "ai", "ओ": "o", "औ": "au",
+}
+DEVANAGARI_MATRAS = {
+    "ा": "aa", "ि": "i", "ी": "ii", "ु": "u", "ू": "uu", "ृ": "r",
+    "ॄ": "r", "ॢ": "l", "े": "e", "ै": "ai", "ो": "o", "ौ": "au",
+}
+DEVANAGARI_CONSONANTS = {
+    "क": "k", "ख": "kh", "ग": "g", "घ": "gh", "ङ": "n",
+    "च": "c", "छ": "ch", "ज": "j", "झ": "jh", "ञ": "n",
+    "ट": "t", "ठ": "th", "ड": "d", "ढ": "dh", "ण": "n",
+    "त": "t", "थ": "th", "द": "d", "ध": "dh", "न": "n",
+    "प": "p", "फ": "ph", "ब": "b", "भ": "bh", "म": "m",
+    "य": "y", "र": "r", "ल": "l", "व": "v", "ळ": "l",
+    "श": "s", "ष": "s", "स": "s", "ह": "h",
+}
+DEVANAGARI_OTHERS = {
+    "ं": "m", "ँ": "m", "ः": "h", "ऽ": "", "।": " ", "॥": " ",
+}
+DEVANAGARI_VIRAMA = "्"
+
+# applied in order, after diacritics have been removed
+PHONETIC_FOLDS = [
+    (r"ch", "c"),
+    (r"x", "ks"),
+    (r"w", "v"),
+    (r"([bcdgjkpt])h", r"\1"),
+    (r"sh", "s"),
+    (r"aa", "a"),
+    (r"(ee|ii)", "i"),
+    (r"(oo|uu)", "u"),
+]
+
+###############################################################################
+
+
+def transliterate(text: str) -> str:
+    """Transliterate Devanagari to a plain Latin approximation"""
+    output = []
+    pending_vowel = False
+    for char in text:
+        if char in DEVANAGARI_CONSONANTS:
+            if pending_vowel:
+                output.append("a")
+            output.append(DEVANAGARI_CONSONANTS[char])
+            pending_vowel = True
+            continue
+        if char in DEVANAGARI_MATRAS:
+            output.append(DEVANAGARI_MATRAS[char])
+        elif char == DEVANAGARI_VIRAMA:
+            pass
+        else:
+            if pending_vowel:
+                output.append("a")
+            output.append(
+                DEVANAGARI_VOWELS.get(char) or
+                DEVANAGARI_OTHERS.get(char, char)
+            )
+        pending_vowel = False
+    if pending_vowel:
+        output.append("a")
+    return "".join(output)
+
+
+def normalize(text: str) -> str:
+    """Transliteration-aware normalization of a name"""
+    text = transliterate(text or "")
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^a-z0-9]+", " ", text.lower())
+    for pattern, replacement in PHONETIC_FOLDS:
+        text = re.sub(pattern, replacement, text)
+    return " ".join(text.split())
+
+
+def tokenize(text: str) -> List[str]:
+    return normalize(text).split()
+
+###############################################################################
+
+
+class CourseCatalog:
+    def __init__(self, path: str, ttl: float = CATALOG_TTL):
+        """Locally cached and indexed catalog of courses
+
+        Parameters
+        ----------
+        path : str
+            Path of the JSON file in which the catalog is cached
+        ttl : float, optional
+            Time (in seconds) after which the catalog is considered stale.
+            The default is CATALOG_TTL (one day).
+        """
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.courses = []
+        self.updated_at = 0
+        self.prefixes = defaultdict(set)
+        self.vocabulary = defaultdict(set)
+        self.names = []
+        self.tokens = []
+        self.load()
+
+    @property
+    def stale(self) -> bool:
+        return not self.courses or time.time() - self.updated_at > self.ttl
+
+    # ----------------------------------------------------------------------- #
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                catalog = json.load(f)
+        except ValueError:
+            return
+        self.updated_at = catalog.get("updated_at", 0)
+        self.index(catalog.get("courses", []))
+
+    def save(self):
+        """Save the catalog, unless its directory has not been created yet"""
+        with self.lock:
+            if not os.path.isdir(os.path.dirname(os.path.abspath(self.path))):
+                return
+            temporary_path = f"{self.path}.tmp"
+            with open(temporary_path, "w", encoding="utf-8") as f:
+                json.dump({
+                    "updated_at": self.updated_at,
+                    "courses": self.courses
+                }, f, ensure_ascii=False)
+            os.replace(temporary_path, self.path)
+
+    def update(self, courses: List[Dict]):
+        """Replace the catalog and save it to the disk
+
+        Parameters
+        ----------
+        courses : List[Dict]
+            List of courses, each containing "course_id", "course_name"
+            and "course_instructor"
+        """
+        self.updated_at = time.time()
+        self.index(courses)
+        self.save()
+
+    def index(self, courses: List[Dict]):
+        self.courses = list(courses)
+        self.prefixes = defaultdict(set)
+        self.vocabulary = defaultdict(set)
+        self.names = []
+        self.tokens = []
+        for idx, course in enumerate(self.courses):
+            name = normalize(course.get("course_name"))
+            self.names.append(name)
+            tokens = name.split() + tokenize(course.get("course_instructor"))
+            self.tokens.append(set(tokens))
+            for token in tokens:
+                self.vocabulary[token].add(idx)
+                for length in range(min(len(token), MAX_PREFIX_LENGTH)):
+                    self.prefixes[token[:length + 1]].add(idx)
+
+    # ----------------------------------------------------------------------- #
+
+    def search(self, pattern: str, cutoff: float = 0.75) -> List[Dict]:
+        """Search courses by name or tutor
+
+        Every word of the pattern must match a word of the course name or
+        tutor, either as a prefix or approximately.
+
+        Parameters
+        ----------
+        pattern : str
+            Search pattern
+        cutoff : float, optional
+            Minimum similarity (0 to 1) for a fuzzy match.
+            The default is 0.75.
+
+        Returns
+        -------
+        List[Dict]
+            Matching courses, best matches first
+        """
+        query = normalize(pattern)
+        if not query:
+            return list(self.courses)
+
+        scores = None
+        for token in query.split():
+            token_scores = defaultdict(float)
+            for idx in self.vocabulary.get(token, ()):
+                token_scores[idx] = 3.0
+            candidates = self.prefixes.get(token[:MAX_PREFIX_LENGTH], ())
+            if len(token) > MAX_PREFIX_LENGTH:
+                # only the first characters of the words are indexed
+                candidates = [
+                    idx for idx in candidates
+                    if any(word.startswith(token) for word in self.tokens[idx])
+                ]
+            for idx in candidates:
+                token_scores[idx] = max(token_scores[idx], 2.0)
+            for word in difflib.get_close_matches(
+                token, self.vocabulary, n=10, cutoff=cutoff
+            ):
+                ratio = difflib.SequenceMatcher(None, token, word).ratio()
+                for idx in self.vocabulary[word]:
+                    token_scores[idx] = max(token_scores[idx], ratio)
+
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {
+                    idx: score + token_scores[idx]
+                    for idx, score in scores.items()
+                    if idx in token_scores
+                }
+
+        # compounds are often written without spaces (e.g. in Devanagari)
+        compact_query = query.replace(" ", "")
+        for idx, name in enumerate(self.names):
+            if query in name or compact_query in name.replace(" ", ""):
+                scores[idx] = scores.get(idx, 0) + 1.0 + len(query.split())
+
+        ranked = sorted(
+            scores, key=lambda idx: (-scores[idx], self.names[idx])
+        )
+        return [self.courses[idx] for idx in ranked]
+
+
+###############################################################################
@@ -11,29 +11,84 @@ import getpass
 import logging
 import argparse
 
-from tabulate import tabulate
-
 from . import __version__
-from .verbose_logger import VERBOSE, install as install_logger
-from .vyoma import Vyoma
-
-###############################################################################
+from .compression import COMPRESSION_SUFFIXES, DEFAULT_COMPRESSION
+from .defaults import MIRROR_PORT, STALL_SPEED, TIMEOUT
+from .progress import PROGRESS_MODES
+from .utils import human_duration, human_size
 
-install_logger()
+# The download stack (requests, tabulate, Vyoma) is imported by the commands
+# that need it, so that --help and --version return immediately.
 
-# --------------------------------------------------------------------------- #
+###############################################################################
 
 ROOT_LOGGER = logging.getLogger()
-ROOT_LOGGER.addHandler(logging.StreamHandler()),
-ROOT_LOGGER.setLevel(logging.INFO)
 
 ###############################################################################
 
 
+def setup_logging(verbose: bool = False, debug: bool = False):
+    """Configure the root logger of the console script"""
+    from .verbose_logger import VERBOSE, install as install_logger
+
+    install_logger()
+    ROOT_LOGGER.addHandler(logging.StreamHandler())
+    ROOT_LOGGER.setLevel(logging.INFO)
+    if verbose:
+        ROOT_LOGGER.setLevel(VERBOSE)
+    if debug:
+        ROOT_LOGGER.setLevel(logging.DEBUG)
+
+
+def read_credentials(args):
+    """Credentials from the arguments, the environment or the config file
+
+    Returns
+    -------
+    tuple
+        Username and password (None if not found), path of the config file
+    """
+    config = {}
+
+    home_dir = os.path.expanduser('~')
+    config_file = os.path.join(home_dir, '.vyoma.cfg')
+    if os.path.isfile(config_file):
+        with open(config_file) as f:
+            lines = f.read().split('\n')
+            for line in lines:
+                if line.strip():
+                    key, value = line.split('=')
+                config[key.strip()] = value.strip()
+
+    username = (
+        args['username'] or
+        os.environ.get('VYOMA_USER') or
+        config.get('username')
+    )
+    password = (
+        args['password'] or
+        os.environ.get('VYOMA_PASS') or
+        config.get('password')
+    )
+    return username, password, config_file
+
+# --------------------------------------------------------------------------- #
+
+
 def main():
+    if sys.argv[1:2] == ["worker"]:
+        return worker_main(sys.argv[2:])
+    if sys.argv[1:2] == ["serve"]:
+        return serve_main(sys.argv[2:])
+
     desc = "Download course contents from 'sanskritfromhome.in'."
 
-    p = argparse.ArgumentParser(description=desc)
+    epilog = (
+        "Use 'vyoma-dl worker --help' to sync courses from a work queue "
+        "shared by several processes, and 'vyoma-dl serve --help' to serve "
+        "the downloaded courses on the local network."
+    )
+    p = argparse.ArgumentParser(description=desc, epilog=epilog)
     p.add_argument("course-pattern", help="URL of the relevant course")
     p.add_argument("-a", "--audio", action='store_true',
                    help="Download audios only")
@@ -43,6 +98,55 @@ def main():
                    help="Path to the download directory")
     p.add_argument("-u", "--username", default=None)
     p.add_argument("-p", "--password", default=None)
+    p.add_argument("-j", "--workers", type=int, default=1,
+                   help="Maximum number of parallel downloads; the actual "
+                   "number adapts to the server (default: 1)")
+    p.add_argument('--timeout', type=float, default=TIMEOUT[1],
+                   metavar="SECONDS",
+                   help="Read timeout of every request "
+                   f"(default: {TIMEOUT[1]:.0f})")
+    p.add_argument('--connect-timeout', type=float, default=TIMEOUT[0],
+                   metavar="SECONDS",
+                   help="Connect timeout of every request "
+                   f"(default: {TIMEOUT[0]:.0f})")
+    p.add_argument('--stall-speed', type=int, default=STALL_SPEED,
+                   metavar="BYTES",
+                   help="Resume transfers slower than this many bytes per "
+                   f"second (default: {STALL_SPEED}, use 0 to disable)")
+    p.add_argument('--hedge', type=float, default=None,
+                   metavar="PERCENTILE",
+                   help="Duplicate metadata requests slower than this "
+                   "percentile of the observed latency, e.g., 0.95")
+    p.add_argument('--accounts', metavar="FILE",
+                   help="Download for every account listed in a file "
+                   "(one username:password per line)")
+    p.add_argument('--record', metavar="ARCHIVE",
+                   help="Record the API traffic to an archive")
+    p.add_argument('--replay', metavar="ARCHIVE",
+                   help="Replay the API traffic from a recorded archive")
+    p.add_argument('--replay-scale', type=float, default=1.0,
+                   help="Scale the recorded timings during replay "
+                   "(default: 1.0, use 0 to disable delays)")
+    p.add_argument('--html-compression', default=DEFAULT_COMPRESSION,
+                   choices=list(COMPRESSION_SUFFIXES),
+                   help="Compression of the saved HTML text materials "
+                   f"(default: {DEFAULT_COMPRESSION})")
+    p.add_argument('--storage', default="dir", metavar="STORAGE",
+                   help="Store the course in a directory (dir), a single "
+                   "archive (tar, tar.zst, zip) or an S3-compatible bucket "
+                   "(URL) (default: dir)")
+    p.add_argument('--progress', default="bar", choices=PROGRESS_MODES,
+                   help="Progress display: a progress bar, periodic JSON "
+                   "lines on stderr, or none (default: bar)")
+    p.add_argument('--refresh',
+                   help="Refresh the local course catalog",
+                   action="store_true")
+    p.add_argument('--plan',
+                   help="Estimate download size and time without downloading",
+                   action="store_true")
+    p.add_argument('--check-links',
+                   help="Check the external links after downloading",
+                   action="store_true")
     p.add_argument('--status',
                    help="Display status of the current course",
                    action="store_true")
@@ -57,35 +161,31 @@ def main():
                    version='%(prog)s ' + __version__)
 
     args = vars(p.parse_args())
+    from .storage import STORAGE_MODES
 
-    if args['verbose']:
-        ROOT_LOGGER.setLevel(VERBOSE)
-    if args['debug']:
-        ROOT_LOGGER.setLevel(logging.DEBUG)
+    if args['workers'] < 1:
+        p.error("the number of workers must be at least 1")
+    if args['hedge'] is not None and not 0 < args['hedge'] < 1:
+        p.error("the hedging percentile must be between 0 and 1")
+    if args['accounts'] and (args['record'] or args['replay']):
+        p.error("--record and --replay can not be used with --accounts")
+    if not (
+        args['storage'] in STORAGE_MODES or
+        args['storage'].startswith(('http://', 'https://'))
+    ):
+        p.error(f"invalid storage '{args['storage']}'")
 
-    # credentials
-    config = {}
+    setup_logging(verbose=args['verbose'], debug=args['debug'])
 
-    home_dir = os.path.expanduser('~')
-    config_file = os.path.join(home_dir, '.vyoma.cfg')
-    if os.path.isfile(config_file):
-        with open(config_file) as f:
-            lines = f.read().split('\n')
-            for line in lines:
-                if line.strip():
-                    key, value = line.split('=')
-                config[key.strip()] = value.strip()
+    if args['accounts']:
+        return run_accounts(args)
 
-    username = (
-        args['username'] or
-        os.environ.get('VYOMA_USER') or
-        config.get('username')
-    )
-    password = (
-        args['password'] or
-        os.environ.get('VYOMA_PASS') or
-        config.get('password')
-    )
+    # credentials
+    username, password, config_file = read_credentials(args)
+    if args['replay']:
+        # recorded traffic has credentials scrubbed
+        username = username or 'replay'
+        password = password or 'replay'
     manual = not (username and password)
 
     if not username:
@@ -96,12 +196,33 @@ def main():
     password = password.strip()
 
     # initiate vyoma session
+    from .vyoma import Vyoma
 
     vyoma_session = Vyoma(
         username=username,
         password=password,
-        download_dir=args['output']
+        download_dir=args['output'],
+        record=args['record'],
+        replay=args['replay'],
+        replay_scale=args['replay_scale'],
+        html_compression=args['html_compression'],
+        progress=args['progress'],
+        storage=args['storage'],
+        max_workers=args['workers'],
+        timeout=(args['connect_timeout'], args['timeout']),
+        stall_speed=args['stall_speed'],
+        hedge=args['hedge'],
     )
+    try:
+        return run(vyoma_session, args, manual, config_file)
+    finally:
+        vyoma_session.close()
+
+
+def run(vyoma_session, args, manual, config_file):
+    """Run the console interface using an initiated session"""
+    username = vyoma_session.username
+    password = vyoma_session.password
     if not vyoma_session.logged_in:
         ROOT_LOGGER.error("Could not sign-in. Are the credentials correct?")
         return 1
@@ -117,10 +238,286 @@ def main():
             ROOT_LOGGER.info("Credentials saved!")
             os.chmod(config_file, stat.S_IREAD + stat.S_IWRITE)
 
-    courses = vyoma_session.find_course(args['course-pattern'])
+    courses = vyoma_session.find_course(
+        args['course-pattern'], refresh=args['refresh']
+    )
+    course_id = choose_course(courses)
+    if course_id is None:
+        return 1
+
+    if args["status"]:
+        vyoma_session.show_course_status(course_id)
+        return 0
+
+    if args["plan"]:
+        show_plan(vyoma_session.plan_course(course_id))
+        return 0
+
+    if not(any([args["audio"], args["document"]])):
+        download_log = vyoma_session.download_course(
+            course_id,
+            fetch_audio=True,
+            fetch_document=True
+        )
+    else:
+        download_log = vyoma_session.download_course(
+            course_id,
+            fetch_audio=args["audio"],
+            fetch_document=args["document"]
+        )
+
+    if args["check_links"]:
+        show_links(vyoma_session.check_links(download_log))
+
+    return 0
+
+
+def run_accounts(args):
+    """Download a course for several accounts concurrently"""
+    from .accounts import MultiAccountSync, read_accounts
+
+    accounts = read_accounts(args['accounts'])
+    if not accounts:
+        ROOT_LOGGER.error("No accounts found in '%s'.", args['accounts'])
+        return 1
+
+    sync = MultiAccountSync(
+        accounts,
+        download_dir=args['output'],
+        session_workers=args['workers'],
+        progress=args['progress'],
+        html_compression=args['html_compression'],
+        storage=args['storage'],
+        timeout=(args['connect_timeout'], args['timeout']),
+        stall_speed=args['stall_speed'],
+        hedge=args['hedge'],
+    )
+    try:
+        if not sync.sessions:
+            ROOT_LOGGER.error("Could not sign-in to any account.")
+            return 1
+
+        courses = sync.find_course(
+            args['course-pattern'], refresh=args['refresh']
+        )
+        course_id = choose_course(courses)
+        if course_id is None:
+            return 1
+
+        fetch_all = not any([args["audio"], args["document"]])
+        download_logs = sync.download_course(
+            course_id,
+            fetch_audio=fetch_all or args["audio"],
+            fetch_document=fetch_all or args["document"]
+        )
+        failed = [
+            username
+            for username, download_log in download_logs.items()
+            if download_log is None
+        ]
+        if failed:
+            ROOT_LOGGER.error("Download failed for: %s", ", ".join(failed))
+            return 1
+    finally:
+        sync.close()
+    return 0
+
+
+def worker_main(argv=None):
+    """Sync courses from the work queue shared by several workers"""
+    desc = (
+        "Sync courses from a work queue in the download directory, shared "
+        "by all the worker processes that use the directory."
+    )
+    p = argparse.ArgumentParser(prog="vyoma-dl worker", description=desc)
+    p.add_argument("-o", "--output", default=None,
+                   help="Path to the shared download directory")
+    p.add_argument("-u", "--username", default=None)
+    p.add_argument("-p", "--password", default=None)
+    p.add_argument("-j", "--workers", type=int, default=1,
+                   help="Number of jobs run concurrently (default: 1)")
+    p.add_argument("--add", nargs="+", default=[], metavar="COURSE_ID",
+                   help="Add courses to the queue")
+    p.add_argument("--add-all", action="store_true",
+                   help="Add every course of the catalog to the queue")
+    p.add_argument("--retry-failed", action="store_true",
+                   help="Retry the jobs that have failed")
+    p.add_argument("--no-run", action="store_true",
+                   help="Only update the queue, without running jobs")
+    p.add_argument("--follow", action="store_true",
+                   help="Wait for new jobs instead of stopping once the "
+                   "queue is drained")
+    p.add_argument('--lease', type=float, default=None, metavar="SECONDS",
+                   help="Duration after which the jobs of a dead worker are "
+                   "reclaimed")
+    p.add_argument('--timeout', type=float, default=TIMEOUT[1],
+                   metavar="SECONDS",
+                   help="Read timeout of every request "
+                   f"(default: {TIMEOUT[1]:.0f})")
+    p.add_argument('--connect-timeout', type=float, default=TIMEOUT[0],
+                   metavar="SECONDS",
+                   help="Connect timeout of every request "
+                   f"(default: {TIMEOUT[0]:.0f})")
+    p.add_argument('--verbose', action="store_true",
+                   help="Enable verbose output")
+    p.add_argument('--debug', action="store_true",
+                   help="Enable debug information")
+    args = vars(p.parse_args(argv))
+
+    if args['workers'] < 1:
+        p.error("the number of workers must be at least 1")
+    setup_logging(verbose=args['verbose'], debug=args['debug'])
+
+    username, password, _ = read_credentials(args)
+    if not (username and password):
+        ROOT_LOGGER.error("Credentials are required to run a worker.")
+        return 1
+
+    from .vyoma import Vyoma
+    from .worker import QueueWorker
+
+    vyoma_session = Vyoma(
+        username=username,
+        password=password,
+        download_dir=args['output'],
+        progress="none",
+        max_workers=args['workers'],
+        timeout=(args['connect_timeout'], args['timeout']),
+    )
+    options = {}
+    if args['lease'] is not None:
+        options['lease_duration'] = args['lease']
+    worker = QueueWorker(vyoma_session, threads=args['workers'], **options)
+    try:
+        if not vyoma_session.logged_in:
+            ROOT_LOGGER.error("Could not sign-in.")
+            return 1
+
+        course_ids = list(args['add'])
+        if args['add_all']:
+            course_ids.extend(
+                course["course_id"]
+                for course in vyoma_session.find_course("")
+            )
+        added = sum(worker.add_course(course_id) for course_id in course_ids)
+        if course_ids:
+            ROOT_LOGGER.info(f"Added {added} of {len(course_ids)} courses.")
+        if args['retry_failed']:
+            retried = worker.queue.retry_failed()
+            ROOT_LOGGER.info(f"Retrying {retried} failed jobs.")
+
+        if not args['no_run']:
+            stats = worker.run(stop_when_idle=not args['follow'])
+            ROOT_LOGGER.info(
+                f"Jobs done: {stats['done']}, failed: {stats['failed']}, "
+                f"lost: {stats['lost']}"
+            )
+        counts = worker.queue.counts()
+        ROOT_LOGGER.info(
+            "Queue: " + ", ".join(f"{k}: {v}" for k, v in counts.items())
+        )
+        for job in worker.queue.failed_jobs():
+            ROOT_LOGGER.error(f"Failed: {job['key']} ({job['error']})")
+        return 1 if counts["failed"] else 0
+    finally:
+        worker.close()
+        vyoma_session.close()
+
+
+def serve_main(argv=None):
+    """Serve the download directory on the local network"""
+    desc = (
+        "Serve the downloaded courses over HTTP. Materials that have not "
+        "been downloaded yet are fetched on their first request, unless "
+        "--offline is used."
+    )
+    p = argparse.ArgumentParser(prog="vyoma-dl serve", description=desc)
+    p.add_argument("-o", "--output", default=None,
+                   help="Path to the download directory")
+    p.add_argument("-u", "--username", default=None)
+    p.add_argument("-p", "--password", default=None)
+    p.add_argument("--host", default="",
+                   help="Address to listen on (default: all interfaces)")
+    p.add_argument("--port", type=int, default=MIRROR_PORT,
+                   help=f"Port to listen on (default: {MIRROR_PORT})")
+    p.add_argument("--offline", action="store_true",
+                   help="Serve the downloaded files only, without signing-in")
+    p.add_argument("-j", "--workers", type=int, default=4,
+                   help="Maximum number of parallel upstream downloads "
+                   "(default: 4)")
+    p.add_argument('--timeout', type=float, default=TIMEOUT[1],
+                   metavar="SECONDS",
+                   help="Read timeout of every upstream request "
+                   f"(default: {TIMEOUT[1]:.0f})")
+    p.add_argument('--connect-timeout', type=float, default=TIMEOUT[0],
+                   metavar="SECONDS",
+                   help="Connect timeout of every upstream request "
+                   f"(default: {TIMEOUT[0]:.0f})")
+    p.add_argument('--verbose', action="store_true",
+                   help="Enable verbose output")
+    p.add_argument('--debug', action="store_true",
+                   help="Enable debug information")
+    args = vars(p.parse_args(argv))
+
+    if args['workers'] < 1:
+        p.error("the number of workers must be at least 1")
+    setup_logging(verbose=args['verbose'], debug=args['debug'])
+
+    username, password, _ = read_credentials(args)
+    download_dir = args['output']
+    if args['offline'] and not download_dir:
+        if not username:
+            p.error("the download directory is required with --offline")
+        home_dir = os.path.expanduser('~')
+        download_dir = os.path.join(home_dir, 'vyoma', username)
+    if not args['offline'] and not (username and password):
+        ROOT_LOGGER.error("Credentials are required, unless --offline.")
+        return 1
+
+    from .mirror import MirrorServer
+
+    vyoma_session = None
+    if not args['offline']:
+        from .vyoma import Vyoma
+
+        vyoma_session = Vyoma(
+            username=username,
+            password=password,
+            download_dir=download_dir,
+            progress="none",
+            max_workers=args['workers'],
+            timeout=(args['connect_timeout'], args['timeout']),
+        )
+        if not vyoma_session.logged_in:
+            ROOT_LOGGER.error("Could not sign-in.")
+            vyoma_session.close()
+            return 1
+
+    server = MirrorServer(
+        download_dir, vyoma_session, host=args['host'], port=args['port']
+    )
+    ROOT_LOGGER.info(
+        f"Serving '{server.download_dir}' on "
+        f"http://{args['host'] or '0.0.0.0'}:{server.server_address[1]}/"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        ROOT_LOGGER.info("Stopping the server ...")
+    finally:
+        server.server_close()
+        if vyoma_session is not None:
+            vyoma_session.close()
+    return 0
+
+
+def choose_course(courses):
+    """Prompt for one of the courses, returning its ID"""
+    from tabulate import tabulate
+
     if not courses:
         ROOT_LOGGER.error("Course not found. Please try a different pattern.")
-        return 1
+        return None
 
     print(tabulate(courses, headers={
         "course_id": "ID",
@@ -135,28 +532,50 @@ def main():
         if selection not in map(str, range(len(courses))):
             ROOT_LOGGER.error("Invalid selection.")
         else:
-            selection = int(selection)
-            course_id = courses[selection]["course_id"]
-            break
+            return courses[int(selection)]["course_id"]
 
-    if args["status"]:
-        vyoma_session.show_course_status(course_id)
-        return 0
 
-    if not(any([args["audio"], args["document"]])):
-        vyoma_session.download_course(
-            course_id,
-            fetch_audio=True,
-            fetch_document=True
-        )
+def show_plan(plan):
+    """Display a download plan"""
+    from tabulate import tabulate
+
+    print(f"Course: {plan['course']['class_name']}")
+    print(f"Teacher: {plan['course']['tutor_name']}")
+    print(tabulate([
+        [
+            kind,
+            stats["count"],
+            human_size(stats["bytes"]),
+            human_size(stats["present_bytes"]),
+            stats["unknown_size"],
+        ]
+        for kind, stats in sorted(plan["by_type"].items())
+    ], headers=["Type", "Count", "Size", "Present", "Unknown Size"],
+        tablefmt="fancy_grid"))
+    print(f"Materials: {plan['num_materials']} "
+          f"({plan['num_files']} files, {plan['num_pending']} pending, "
+          f"{plan['num_duplicates']} duplicates)")
+    print(f"Total: {human_size(plan['total_bytes'])}, "
+          f"present: {human_size(plan['present_bytes'])}, "
+          f"remaining: {human_size(plan['remaining_bytes'])}")
+    if plan["throughput"]:
+        print(f"Throughput: {human_size(plan['throughput'])}/s, "
+              f"ETA: {human_duration(plan['eta'])}")
     else:
-        vyoma_session.download_course(
-            course_id,
-            fetch_audio=args["audio"],
-            fetch_document=args["document"]
-        )
+        print("Throughput could not be measured.")
 
-    return 0
+
+def show_links(links):
+    """Display the results of external link checks"""
+    from tabulate import tabulate
+
+    broken = [link for link in links.values() if not link["ok"]]
+    print(f"Links: {len(links)} checked, {len(broken)} broken")
+    if broken:
+        print(tabulate([
+            [link["url"], link["status"], link["error"]]
+            for link in broken
+        ], headers=["URL", "Status", "Error"], tablefmt="fancy_grid"))
 
 ###############################################################################
 
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Optionally Compressed Files
+
+Text bodies (such as html_text materials) are compressed with gzip or, if
+the `zstandard` package is installed, zstd, before they are stored. The
+compression is identified by the file extension when reading.
+
+@author: Hrishikesh Terdalkar
+"""
+
+import gzip
+import logging
+
+###############################################################################
+
+COMPRESSION_SUFFIXES = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+DEFAULT_COMPRESSION = "gzip"
+
+LOGGER = logging.getLogger(__name__)
+
+###############################################################################
+
+
+def zstd_available() -> bool:
+    try:
+        import zstandard  # noqa
+    except ImportError:
+        return False
+    return True
+
+
+def resolve_compression(compression: str) -> str:
+    """Compression that can be used, falling back to gzip for zstd"""
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(f"Unknown compression '{compression}'")
+    if compression == "zstd" and not zstd_available():
+        LOGGER.warning("zstandard is not installed, using gzip instead.")
+        return "gzip"
+    return compression
+
+
+def compress(data: bytes, compression: str = DEFAULT_COMPRESSION) -> bytes:
+    """Compress data with a compression that has been resolved"""
+    if compression == "gzip":
+        return gzip.compress(data, mtime=0)
+    if compression == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def read_compressed(path: str) -> bytes:
+    """Read a file compressed with `compress`, as told by its suffix"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if path.endswith(COMPRESSION_SUFFIXES["gzip"]):
+        return gzip.decompress(data)
+    if path.endswith(COMPRESSION_SUFFIXES["zstd"]):
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+###############################################################################
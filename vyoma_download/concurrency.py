@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Adaptive Concurrency
+
+An `AdaptiveLimiter` bounds the number of concurrent operations of a kind
+(metadata calls or file transfers) and adjusts the bound with AIMD
+(additive increase, multiplicative decrease):
+
+* After every window of `limit` completed operations, the limit is raised by
+  one if the window was healthy: no errors above the tolerated rate, no
+  latency spike and no drop in throughput.
+* On a congestion signal (timeout, HTTP 429 or 503), a latency spike or a
+  sharp drop in throughput, the limit is multiplied by `decrease`, at most
+  once per window.
+
+Throughput is measured over the time during which operations are in flight
+(idle time is not a drop in throughput), and only once enough operations
+and busy time have accumulated, possibly over several windows, so that a
+few fast or slow operations are not mistaken for a trend.
+
+Every decision is recorded and exposed with `metrics`.
+
+@author: Hrishikesh Terdalkar
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterator
+
+import requests
+
+###############################################################################
+
+# HTTP status codes that signal an overloaded server
+CONGESTION_STATUS = {429, 503}
+
+ERROR_THRESHOLD = 0.1
+LATENCY_FACTOR = 2.0
+# latencies below this (in seconds) are never considered a spike
+LATENCY_FLOOR = 0.05
+THROUGHPUT_TOLERANCE = 0.1
+# minimum busy time (in seconds) and operations of a throughput sample
+MIN_SAMPLE_DURATION = 0.2
+MIN_SAMPLE_COUNT = 4
+DECISION_HISTORY = 50
+
+###############################################################################
+
+
+@dataclass
+class Outcome:
+    """Outcome of an operation, filled in by the caller"""
+    num_bytes: int = 0
+    status: int = None
+    failed: bool = False
+    congested: bool = False
+
+    def set_status(self, status: int):
+        self.status = status
+        self.congested = status in CONGESTION_STATUS
+        self.failed = status >= 400
+
+###############################################################################
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        name: str,
+        maximum: int = 8,
+        minimum: int = 1,
+        initial: int = 1,
+        decrease: float = 0.5,
+        latency_factor: float = LATENCY_FACTOR,
+        error_threshold: float = ERROR_THRESHOLD,
+    ):
+        """Concurrency limit adjusted with AIMD
+
+        Parameters
+        ----------
+        name : str
+            Kind of operations, used in the metrics
+        maximum : int, optional
+            Upper bound of the limit.
+            The default is 8.
+        minimum : int, optional
+            Lower bound of the limit.
+            The default is 1.
+        initial : int, optional
+            Initial limit.
+            The default is 1.
+        decrease : float, optional
+            Factor applied to the limit on back-off.
+            The default is 0.5.
+        latency_factor : float, optional
+            Ratio of the average latency of a window to the baseline latency
+            that is considered a spike. Use None for operations whose latency
+            depends on their size (e.g., file transfers).
+            The default is LATENCY_FACTOR.
+        error_threshold : float, optional
+            Fraction of failed operations in a window above which the limit
+            is not raised.
+            The default is ERROR_THRESHOLD.
+        """
+        self.name = name
+        self.maximum = max(maximum, 1)
+        self.minimum = max(min(minimum, self.maximum), 1)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.error_threshold = error_threshold
+
+        self.condition = threading.Condition()
+        self.local = threading.local()
+        self.in_flight = 0
+        self.busy_since = None
+        self.baseline = None
+        self.latency = None
+        self.throughput = None
+        self.previous_throughput = None
+        self.increases = 0
+        self.decreases = 0
+        self.decisions = deque(maxlen=DECISION_HISTORY)
+        self._reset_window()
+        self._reset_sample()
+
+    def _reset_window(self):
+        self.window_count = 0
+        self.window_failed = 0
+        self.window_latency = 0.0
+
+    def _reset_sample(self):
+        self.sample_count = 0
+        self.sample_bytes = 0
+        self.sample_busy = 0.0
+        if self.busy_since is not None:
+            self.busy_since = time.monotonic()
+
+    def _busy_time(self) -> float:
+        """Busy time of the current sample (called with the lock held)"""
+        if self.busy_since is not None:
+            now = time.monotonic()
+            self.sample_busy += now - self.busy_since
+            self.busy_since = now if self.in_flight else None
+        return self.sample_busy
+
+    # ----------------------------------------------------------------------- #
+
+    @contextmanager
+    def slot(self) -> Iterator[Outcome]:
+        """Run an operation within the concurrency limit
+
+        The yielded Outcome should be updated by the caller. Timeouts and
+        connection errors raised by the operation count as congestion.
+        """
+        with self.condition:
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+            if not self.in_flight:
+                self.busy_since = time.monotonic()
+            self.in_flight += 1
+
+        outcome = Outcome()
+        self.local.outcome = outcome
+        start = time.monotonic()
+        try:
+            yield outcome
+        except (requests.Timeout, requests.ConnectionError):
+            outcome.failed = outcome.congested = True
+            raise
+        except Exception:
+            outcome.failed = True
+            raise
+        finally:
+            self.local.outcome = None
+            with self.condition:
+                self.in_flight -= 1
+                self._record(time.monotonic() - start, outcome)
+                self.condition.notify_all()
+
+    def report_status(self, status: int):
+        """Report an HTTP status to the slot held by the current thread
+
+        Only the last status of an operation is taken into account, except
+        for congestion signals, which are kept.
+        """
+        outcome = getattr(self.local, "outcome", None)
+        if outcome is not None and not outcome.congested:
+            outcome.set_status(status)
+
+    def _record(self, latency: float, outcome: Outcome):
+        """Update the window with an outcome (called with the lock held)"""
+        self.window_count += 1
+        self.window_failed += outcome.failed
+        self.window_latency += latency
+        self.sample_count += 1
+        self.sample_bytes += outcome.num_bytes
+        busy = self._busy_time()
+        if not outcome.failed:
+            self.latency = (
+                latency if self.latency is None
+                else 0.8 * self.latency + 0.2 * latency
+            )
+
+        if outcome.congested:
+            self._back_off(
+                f"status {outcome.status}" if outcome.status else "timeout"
+            )
+            return
+
+        if self.window_count < self.limit:
+            return
+
+        average_latency = self.window_latency / self.window_count
+        sampled = (
+            self.sample_count >= MIN_SAMPLE_COUNT and
+            busy >= MIN_SAMPLE_DURATION
+        )
+        if sampled and self.sample_bytes:
+            self.previous_throughput = self.throughput
+            self.throughput = self.sample_bytes / busy
+        if sampled:
+            self._reset_sample()
+
+        if (
+            self.latency_factor is not None and
+            self.baseline is not None and
+            average_latency > self.latency_factor * max(
+                self.baseline, LATENCY_FLOOR
+            )
+        ):
+            self._back_off(
+                f"latency {average_latency:.3f}s > "
+                f"{self.latency_factor} x {self.baseline:.3f}s"
+            )
+            return
+        if self.latency_factor is not None and not self.window_failed:
+            self.baseline = (
+                average_latency if self.baseline is None
+                else min(average_latency, 0.9 * self.baseline +
+                         0.1 * average_latency)
+            )
+
+        # the throughput is compared once per sample
+        drop = None
+        if sampled and self.previous_throughput and self.throughput:
+            drop = 1 - self.throughput / self.previous_throughput
+        if drop is not None and drop > 0.5:
+            self._back_off(f"throughput dropped by {drop:.0%}")
+        elif self.window_failed / self.window_count > self.error_threshold:
+            self._decide("hold", self.limit, "errors")
+        elif drop is not None and drop > THROUGHPUT_TOLERANCE:
+            self._decide("hold", self.limit, "throughput did not improve")
+        elif self.limit < self.maximum:
+            self.increases += 1
+            self._decide("increase", self.limit + 1, "healthy")
+        self._reset_window()
+
+    def _back_off(self, reason: str):
+        limit = max(self.minimum, int(self.limit * self.decrease))
+        self.decreases += 1
+        self._decide("decrease", limit, reason)
+        self._reset_window()
+        # measurements at the old limit are not comparable
+        self._reset_sample()
+        self.throughput = self.previous_throughput = None
+
+    def _decide(self, action: str, limit: int, reason: str):
+        self.decisions.append({
+            "time": time.time(),
+            "action": action,
+            "limit": limit,
+            "previous_limit": self.limit,
+            "reason": reason,
+        })
+        self.limit = limit
+
+    # ----------------------------------------------------------------------- #
+
+    def metrics(self) -> Dict:
+        """Current limit and the latest decision"""
+        with self.condition:
+            return {
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "minimum": self.minimum,
+                "maximum": self.maximum,
+                "latency": self.latency,
+                "baseline_latency": self.baseline,
+                "throughput": self.throughput,
+                "increases": self.increases,
+                "decreases": self.decreases,
+                "last_decision": (
+                    dict(self.decisions[-1]) if self.decisions else None
+                ),
+            }
+
+# --------------------------------------------------------------------------- #
+
+
+def create_limiters(maximum: int) -> Dict[str, AdaptiveLimiter]:
+    """Limiters of the metadata calls and of the file transfers
+
+    Parameters
+    ----------
+    maximum : int
+        Upper bound of the concurrency of either kind of operations
+
+    Returns
+    -------
+    Dict[str, AdaptiveLimiter]
+        Limiter of every kind ("metadata" and "transfer")
+    """
+    return {
+        "metadata": AdaptiveLimiter("metadata", maximum),
+        # transfer times depend on the size of the files
+        "transfer": AdaptiveLimiter(
+            "transfer", maximum, latency_factor=None
+        ),
+    }
+
+###############################################################################
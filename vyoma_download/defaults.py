@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Default Network Settings
+
+Kept free of dependencies, so that the console script can build its
+argument parser without importing the download stack.
+
+@author: Hrishikesh Terdalkar
+"""
+
+###############################################################################
+
+# connect and read timeouts (in seconds)
+TIMEOUT = (10.0, 60.0)
+
+# transfers slower than STALL_SPEED bytes per second over STALL_PERIOD
+# seconds are aborted
+STALL_SPEED = 4 * 1024
+STALL_PERIOD = 60.0
+
+# port of the LAN mirror server (vyoma-dl serve)
+MIRROR_PORT = 8080
+
+###############################################################################
@@ -0,0 +1,745 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming Downloader
+
+Files are streamed from the socket into a reusable preallocated buffer
+(`readinto`), and written to the disk with large sequential writes. The
+target file is preallocated from the Content-Length, and interrupted
+downloads are resumed using byte ranges.
+
+Large files are split into byte ranges (segments) that are fetched in
+parallel into the same preallocated file, if the server supports ranges.
+Progress of every segment is checkpointed to a sidecar file, so that each
+segment is retried and resumed independently.
+
+A watchdog aborts transfers whose throughput stays below a floor for a
+period (`TransferStalled`), so that they can be resumed on a new connection
+instead of holding up a run. Hung sockets are caught by the read timeout of
+the session.
+
+Responses that reject the URL itself (HTTP 403 or 410, e.g., an expired
+signed link) raise `LinkExpired`, so that the caller can resolve the URL
+again and resume the download with it.
+
+@author: Hrishikesh Terdalkar
+"""
+
+import http.client
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Dict, List
+
+import requests
+
+from .defaults import STALL_PERIOD, STALL_SPEED
+
+###############################################################################
+
+CHUNK_SIZE = 1024 * 1024
+CHECKPOINT_SIZE = 16 * 1024 * 1024
+SEGMENTS = 4
+SEGMENT_THRESHOLD = 32 * 1024 * 1024
+SEGMENT_RETRIES = 3
+
+PART_SUFFIX = ".part"
+STATE_SUFFIX = ".part.json"
+
+# HTTP status codes of signed URLs that have expired (or been revoked)
+EXPIRED_STATUS = {403, 410}
+
+TRANSFER_ERRORS = (
+    requests.RequestException, http.client.HTTPException, OSError
+)
+
+###############################################################################
+
+
+class RangeNotSupported(Exception):
+    """Server ignored a byte range request"""
+
+
+class TransferStalled(IOError):
+    """Throughput of a transfer stayed below the floor for too long"""
+
+
+class LinkExpired(Exception):
+    """Server rejected the URL, which has to be resolved again"""
+
+# --------------------------------------------------------------------------- #
+
+
+class StallWatchdog:
+    def __init__(self, min_speed: float, period: float):
+        """Detect transfers slower than `min_speed` over a `period`
+
+        The throughput is measured over consecutive periods, so a stall is
+        detected within two periods.
+        """
+        self.min_speed = min_speed
+        self.period = period
+        self.reset()
+
+    def reset(self):
+        self.started_at = time.monotonic()
+        self.received = 0
+
+    def update(self, num_bytes: int):
+        self.received += num_bytes
+        elapsed = time.monotonic() - self.started_at
+        if elapsed < self.period:
+            return
+        speed = self.received / elapsed
+        if speed < self.min_speed:
+            raise TransferStalled(
+                f"Transfer stalled ({speed:.0f} B/s for {elapsed:.1f}s)"
+            )
+        self.reset()
+
+
+def content_size(response: requests.Response, position: int = 0) -> int:
+    """Complete size of the resource from Content-Range or Content-Length"""
+    content_range = response.headers.get("Content-Range", "")
+    total = content_range.rpartition("/")[2].strip()
+    if total.isdigit():
+        return int(total)
+    content_length = response.headers.get("Content-Length")
+    if content_length and content_length.isdigit():
+        return position + int(content_length)
+    return None
+
+
+def accepts_ranges(response: requests.Response) -> bool:
+    return (
+        response.status_code == 206 or
+        response.headers.get("Accept-Ranges", "").lower() == "bytes"
+    )
+
+
+def preallocate(fd: int, size: int):
+    """Reserve space for a file, falling back to a sparse file"""
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        os.ftruncate(fd, size)
+
+
+def split(size: int, parts: int) -> List[List[int]]:
+    """Split [0, size) into byte ranges of the form [start, end, done]"""
+    step = -(-size // parts)
+    return [
+        [start, min(start + step, size), 0]
+        for start in range(0, size, step)
+    ]
+
+###############################################################################
+
+
+class Downloader:
+    def __init__(
+        self,
+        session: requests.Session,
+        chunk_size: int = CHUNK_SIZE,
+        preallocate: bool = True,
+        checkpoint_size: int = CHECKPOINT_SIZE,
+        segments: int = SEGMENTS,
+        segment_threshold: int = SEGMENT_THRESHOLD,
+        segment_retries: int = SEGMENT_RETRIES,
+        on_status: Callable[[int], None] = None,
+        stall_speed: float = STALL_SPEED,
+        stall_period: float = STALL_PERIOD,
+    ):
+        """Streaming Downloader
+
+        Parameters
+        ----------
+        session : requests.Session
+            Session used to make the requests
+        chunk_size : int, optional
+            Size of the buffer, and of every write, in bytes.
+            The default is CHUNK_SIZE (1 MiB).
+        preallocate : bool, optional
+            If true, space for the file is reserved using the Content-Length.
+            The default is True.
+        checkpoint_size : int, optional
+            Number of bytes after which the progress of a preallocated file
+            is saved, to resume after a crash.
+            The default is CHECKPOINT_SIZE (16 MiB).
+        segments : int, optional
+            Number of byte ranges fetched in parallel for large files.
+            Use 1 to disable segmented downloads.
+            The default is SEGMENTS (4).
+        segment_threshold : int, optional
+            Minimum size of a file, in bytes, to be downloaded in segments.
+            The default is SEGMENT_THRESHOLD (32 MiB).
+        segment_retries : int, optional
+            Number of times a failed segment is retried.
+            The default is SEGMENT_RETRIES (3).
+        on_status : Callable[[int], None], optional
+            Function called with the status code of every response, e.g., to
+            detect throttling.
+            The default is None.
+        stall_speed : float, optional
+            Minimum throughput of a transfer, in bytes per second. Transfers
+            that are slower for `stall_period` seconds raise TransferStalled.
+            Use 0 to disable the watchdog.
+            The default is STALL_SPEED (4 KiB/s).
+        stall_period : float, optional
+            Period (in seconds) over which the throughput is measured.
+            The default is STALL_PERIOD (60 seconds).
+        """
+        self.session = session
+        self.chunk_size = chunk_size
+        self.preallocate = preallocate
+        self.checkpoint_size = checkpoint_size
+        self.segments = segments
+        self.segment_threshold = segment_threshold
+        self.segment_retries = segment_retries
+        self.on_status = on_status
+        self.stall_speed = stall_speed
+        self.stall_period = stall_period
+        self.local = threading.local()
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    @property
+    def buffer(self) -> memoryview:
+        """Buffer reused by all the downloads of the current thread"""
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is None or len(buffer) != self.chunk_size:
+            buffer = memoryview(bytearray(self.chunk_size))
+            self.local.buffer = buffer
+        return buffer
+
+    # ----------------------------------------------------------------------- #
+
+    def load_state(self, path: str) -> Dict or None:
+        """Progress of a partial download
+
+        Returns
+        -------
+        Dict or None
+            "size": size of the file (None if unknown) and
+            "segments": list of [start, end, done] byte ranges,
+            None if there is no partial download
+        """
+        part_path = path + PART_SUFFIX
+        state_path = path + STATE_SUFFIX
+        if not os.path.isfile(part_path):
+            return None
+        if os.path.isfile(state_path):
+            try:
+                with open(state_path) as f:
+                    state = json.load(f)
+                return {"size": state["size"], "segments": state["segments"]}
+            except (ValueError, KeyError):
+                return None
+        # files that are not preallocated only contain the written bytes
+        position = os.path.getsize(part_path)
+        return {"size": None, "segments": [[0, None, position]]}
+
+    def save_state(self, path: str, size: int, segments: List[List[int]]):
+        state_path = path + STATE_SUFFIX
+        with open(state_path + ".tmp", "w") as f:
+            json.dump({"size": size, "segments": segments}, f)
+        os.replace(state_path + ".tmp", state_path)
+
+    def finish(self, path: str):
+        os.replace(path + PART_SUFFIX, path)
+        if os.path.isfile(path + STATE_SUFFIX):
+            os.remove(path + STATE_SUFFIX)
+
+    def discard(self, path: str):
+        for suffix in [PART_SUFFIX, STATE_SUFFIX]:
+            if os.path.isfile(path + suffix):
+                os.remove(path + suffix)
+
+    # ----------------------------------------------------------------------- #
+
+    def download(
+        self,
+        url: str,
+        path: str,
+        headers: Dict = None,
+        callback: Callable[[int], None] = None,
+        resume: bool = True,
+        on_size: Callable[[int, int], None] = None,
+    ) -> str or None:
+        """Download a URL to a file
+
+        Parameters
+        ----------
+        url : str
+            URL to download
+        path : str
+            Path of the downloaded file
+        headers : Dict, optional
+            Additional request headers.
+            The default is None.
+        callback : Callable[[int], None], optional
+            Function called with the number of bytes after every write.
+            The default is None.
+        resume : bool, optional
+            If true, a partial download is resumed.
+            The default is True.
+        on_size : Callable[[int, int], None], optional
+            Function called with the size of the file (None if unknown) and
+            the number of bytes already present, once they are known.
+            The default is None.
+
+        Returns
+        -------
+        str or None
+            Path of the downloaded file if the download was successful,
+            None otherwise
+        """
+        part_path = path + PART_SUFFIX
+        if not os.path.isfile(path) or os.path.isfile(part_path):
+            return self._download(
+                url, path, headers, callback, resume, on_size
+            )
+
+        # an existing file is verified (and completed) like a partial one,
+        # and is put back if the download fails before writing to it
+        os.replace(path, part_path)
+        stat = os.stat(part_path)
+        result = None
+        try:
+            result = self._download(
+                url, path, headers, callback, resume, on_size
+            )
+        finally:
+            if result is None and os.path.isfile(part_path):
+                current = os.stat(part_path)
+                if (current.st_size, current.st_mtime_ns) == (
+                    stat.st_size, stat.st_mtime_ns
+                ):
+                    self.finish(path)
+        return result
+
+    def _download(
+        self,
+        url: str,
+        path: str,
+        headers: Dict,
+        callback: Callable[[int], None],
+        resume: bool,
+        on_size: Callable[[int, int], None],
+    ) -> str or None:
+        state = self.load_state(path) if resume else None
+        request_headers = dict(headers or {})
+        request_headers["Accept-Encoding"] = "identity"
+
+        if state is not None and len(state["segments"]) > 1:
+            if on_size is not None:
+                on_size(
+                    state["size"], sum(s[2] for s in state["segments"])
+                )
+            try:
+                return self._download_segments(
+                    url, path, request_headers, state, callback
+                )
+            except RangeNotSupported:
+                self.logger.warning(
+                    f"Byte ranges are not supported for {url} anymore, "
+                    "restarting the download."
+                )
+                self.discard(path)
+                return self._download(
+                    url, path, headers, callback, False, on_size
+                )
+
+        position = state["segments"][0][2] if state is not None else 0
+        if position:
+            request_headers["Range"] = f"bytes={position}-"
+
+        r = self._get(url, request_headers)
+        result = None
+        reusable = True
+        try:
+            self._check_expired(url, r)
+            if r.status_code == 416 and position:
+                if content_size(r) == position:
+                    if on_size is not None:
+                        on_size(position, position)
+                    self.finish(path)
+                    return path
+                return self._download(
+                    url, path, headers, callback, False, on_size
+                )
+
+            if not r.ok:
+                self.logger.error(
+                    f"Download from {url} failed ({r.status_code})"
+                )
+                return None
+
+            content_type = r.headers.get("Content-Type", "")
+            if content_type.startswith("text/html"):
+                self.logger.error(f"HTML content from {url}, aborted.")
+                return None
+
+            if r.status_code != 206:
+                position = 0
+            if position:
+                self.logger.info(f"Resuming '{path}' from {position} bytes")
+
+            size = None
+            if r.headers.get("Content-Encoding", "identity") == "identity":
+                size = content_size(r, position)
+            if on_size is not None:
+                on_size(size, position)
+
+            if (
+                not position and
+                self.segments > 1 and
+                size is not None and
+                size >= self.segment_threshold and
+                accepts_ranges(r)
+            ):
+                # the open response serves the first segment
+                reusable = False
+                state = {"size": size, "segments": split(size, self.segments)}
+                result = self._download_segments(
+                    url, path, request_headers, state, callback, response=r
+                )
+            else:
+                result = self._download_single(
+                    r, path, position, size, callback
+                )
+        except RangeNotSupported:
+            self.logger.warning(f"Byte ranges are not supported for {url}")
+            self.discard(path)
+            return self._download(
+                url, path, headers, callback, False, on_size
+            )
+        finally:
+            if result is None or not reusable:
+                r.close()
+            else:
+                # the body has been consumed, the connection can be reused
+                r.raw.release_conn()
+        return result
+
+    def stream(
+        self,
+        url: str,
+        open_target: Callable[[int or None], BinaryIO],
+        headers: Dict = None,
+        callback: Callable[[int], None] = None,
+        on_size: Callable[[int, int], None] = None,
+    ) -> int or None:
+        """Stream a URL into a writable target, without a local file
+
+        Downloads into targets cannot be resumed or segmented.
+
+        Parameters
+        ----------
+        url : str
+            URL to download
+        open_target : Callable[[int or None], BinaryIO]
+            Function called with the size of the content (None if unknown),
+            returning a context manager that yields a writable binary target
+        headers : Dict, optional
+            Additional request headers.
+            The default is None.
+        callback : Callable[[int], None], optional
+            Function called with the number of bytes after every write.
+            The default is None.
+        on_size : Callable[[int, int], None], optional
+            Function called with the size of the content, once known.
+            The default is None.
+
+        Returns
+        -------
+        int or None
+            Number of bytes written if the download was successful,
+            None otherwise
+        """
+        request_headers = dict(headers or {})
+        request_headers["Accept-Encoding"] = "identity"
+        r = self._get(url, request_headers)
+        result = None
+        try:
+            self._check_expired(url, r)
+            if not r.ok:
+                self.logger.error(
+                    f"Download from {url} failed ({r.status_code})"
+                )
+                return None
+
+            content_type = r.headers.get("Content-Type", "")
+            if content_type.startswith("text/html"):
+                self.logger.error(f"HTML content from {url}, aborted.")
+                return None
+
+            size = None
+            if r.headers.get("Content-Encoding", "identity") == "identity":
+                size = content_size(r)
+            if on_size is not None:
+                on_size(size, 0)
+
+            with open_target(size) as f:
+                written = self._stream(
+                    self._reader(r), f, None, callback or (lambda n: None)
+                )
+            if size is not None and written != size:
+                self.logger.error(
+                    f"Incomplete download from {url} ({written}/{size} bytes)"
+                )
+                return None
+            result = written
+        finally:
+            if result is None:
+                r.close()
+            else:
+                r.raw.release_conn()
+        return result
+
+    # ----------------------------------------------------------------------- #
+
+    def _get(
+        self,
+        url: str,
+        headers: Dict,
+        on_status: Callable[[int], None] = None,
+    ) -> requests.Response:
+        r = self.session.get(url, headers=headers, stream=True)
+        on_status = on_status or self.on_status
+        if on_status is not None:
+            on_status(r.status_code)
+        return r
+
+    @staticmethod
+    def _check_expired(url: str, r: requests.Response):
+        if r.status_code in EXPIRED_STATUS:
+            raise LinkExpired(
+                f"Download from {url} was rejected ({r.status_code})"
+            )
+
+    def _reader(self, r: requests.Response):
+        """Read directly from the socket unless the content is encoded"""
+        reader = getattr(r.raw, "_fp", None)
+        if (
+            not isinstance(reader, http.client.HTTPResponse) or
+            r.headers.get("Content-Encoding", "identity") != "identity"
+        ):
+            r.raw.decode_content = True
+            reader = r.raw
+        return reader
+
+    def _stream(
+        self,
+        reader,
+        f,
+        limit: int or None,
+        on_chunk: Callable[[int], None],
+    ) -> int:
+        """Copy up to `limit` bytes (or everything) from reader to file"""
+        buffer = self.buffer
+        watchdog = (
+            StallWatchdog(self.stall_speed, self.stall_period)
+            if self.stall_speed else None
+        )
+        total = 0
+        while limit is None or total < limit:
+            size = len(buffer)
+            if limit is not None:
+                size = min(size, limit - total)
+            view = buffer[:size]
+            filled = 0
+            while filled < size:
+                n = reader.readinto(view[filled:])
+                if watchdog is not None:
+                    watchdog.update(n or 0)
+                if not n:
+                    break
+                filled += n
+            if not filled:
+                break
+            written = 0
+            while written < filled:
+                written += f.write(view[written:filled])
+            total += filled
+            on_chunk(filled)
+            if filled < size:
+                break
+        return total
+
+    def _download_single(
+        self,
+        r: requests.Response,
+        path: str,
+        position: int,
+        size: int or None,
+        callback: Callable[[int], None] = None,
+    ) -> str or None:
+        part_path = path + PART_SUFFIX
+        mode = "r+b" if position and os.path.isfile(part_path) else "wb"
+        preallocated = (
+            self.preallocate and size is not None and size > len(self.buffer)
+        )
+        segment = [0, size, position]
+        checkpoint = [position + self.checkpoint_size]
+
+        def on_chunk(n: int):
+            segment[2] += n
+            if callback is not None:
+                callback(n)
+            if preallocated and segment[2] >= checkpoint[0]:
+                self.save_state(path, size, [segment])
+                checkpoint[0] = segment[2] + self.checkpoint_size
+
+        with open(part_path, mode, buffering=0) as f:
+            if preallocated:
+                self.save_state(path, size, [segment])
+                preallocate(f.fileno(), size)
+            f.seek(position)
+            try:
+                self._stream(self._reader(r), f, None, on_chunk)
+            except BaseException:
+                if preallocated:
+                    self.save_state(path, size, [segment])
+                raise
+
+        position = segment[2]
+        if size is not None and position != size:
+            if preallocated:
+                self.save_state(path, size, [segment])
+            self.logger.error(
+                f"Incomplete download of '{path}' ({position}/{size} bytes)"
+            )
+            return None
+
+        if preallocated:
+            os.truncate(part_path, position)
+        self.finish(path)
+        return path
+
+    # ----------------------------------------------------------------------- #
+
+    def _download_segments(
+        self,
+        url: str,
+        path: str,
+        headers: Dict,
+        state: Dict,
+        callback: Callable[[int], None] = None,
+        response: requests.Response = None,
+    ) -> str or None:
+        """Fetch the byte ranges of a file in parallel
+
+        Parameters
+        ----------
+        response : requests.Response, optional
+            Open response for the complete file, used for the first segment.
+            The default is None.
+        """
+        part_path = path + PART_SUFFIX
+        size = state["size"]
+        segments = state["segments"]
+        lock = threading.Lock()
+        checkpoint = [sum(s[2] for s in segments) + self.checkpoint_size]
+
+        def on_chunk(segment: List[int], n: int):
+            with lock:
+                segment[2] += n
+                done = sum(s[2] for s in segments)
+                if done >= checkpoint[0]:
+                    self.save_state(path, size, segments)
+                    checkpoint[0] = done + self.checkpoint_size
+            if callback is not None:
+                callback(n)
+
+        # statuses are reported from the calling thread, which holds the
+        # slot of the transfer (e.g., in an AdaptiveLimiter)
+        statuses = []
+
+        def on_status(status: int):
+            with lock:
+                statuses.append(status)
+
+        mode = "r+b" if os.path.isfile(part_path) else "wb"
+        with open(part_path, mode) as f:
+            if mode == "wb" or os.path.getsize(part_path) != size:
+                preallocate(f.fileno(), size)
+        self.save_state(path, size, segments)
+        self.logger.debug(f"Downloading '{path}' in {len(segments)} segments")
+
+        pending = [s for s in segments if s[0] + s[2] < s[1]]
+        first = response if pending and pending[0][0] == 0 else None
+        try:
+            with ThreadPoolExecutor(max_workers=len(pending) or 1) as pool:
+                futures = [
+                    pool.submit(
+                        self._fetch_segment, url, part_path, headers, segment,
+                        on_chunk, first if segment is pending[0] else None,
+                        on_status
+                    )
+                    for segment in pending
+                ]
+                results = [future.result() for future in futures]
+        finally:
+            with lock:
+                self.save_state(path, size, segments)
+            if self.on_status is not None:
+                for status in statuses:
+                    self.on_status(status)
+
+        if not all(results):
+            self.logger.error(f"Incomplete download of '{path}'")
+            return None
+
+        self.finish(path)
+        return path
+
+    def _fetch_segment(
+        self,
+        url: str,
+        part_path: str,
+        headers: Dict,
+        segment: List[int],
+        on_chunk: Callable[[List[int], int], None],
+        response: requests.Response = None,
+        on_status: Callable[[int], None] = None,
+    ) -> bool:
+        """Fetch one byte range, retrying and resuming it on errors"""
+        failures = 0
+        while segment[0] + segment[2] < segment[1]:
+            position = segment[0] + segment[2]
+            try:
+                if response is None:
+                    segment_headers = dict(headers)
+                    segment_headers["Range"] = (
+                        f"bytes={position}-{segment[1] - 1}"
+                    )
+                    response = self._get(url, segment_headers, on_status)
+                    self._check_expired(url, response)
+                    if response.status_code == 200:
+                        raise RangeNotSupported(url)
+                    response.raise_for_status()
+                with open(part_path, "r+b", buffering=0) as f:
+                    f.seek(position)
+                    self._stream(
+                        self._reader(response), f, segment[1] - position,
+                        lambda n: on_chunk(segment, n)
+                    )
+            except TRANSFER_ERRORS as e:
+                failures += 1
+                self.logger.warning(
+                    f"Segment {segment[0]}-{segment[1]} of {url} failed "
+                    f"({failures}/{self.segment_retries}): {e}"
+                )
+                if failures > self.segment_retries:
+                    return False
+            finally:
+                if response is not None:
+                    response.close()
+                    response = None
+        return True
+
+
+###############################################################################
@@ -8,17 +8,34 @@ Edmingle API
 
 import json
 import logging
+import os
+import threading
+import time
 # from functools import cached_property
-from typing import Dict
+from typing import BinaryIO, Callable, Dict, Tuple
+from urllib.parse import urlencode, urlsplit
 
 import requests
-from requests_downloader import download
+from urllib3.util import make_headers
+
+from .auth import AuthContext, SessionPool
+from .concurrency import Outcome, create_limiters
+from .defaults import STALL_PERIOD, STALL_SPEED, TIMEOUT
+from .downloader import Downloader
+from .fastjson import loads
+from .hedging import HEDGE_BUDGET, Hedger
+from .replay import TrafficRecorder, TrafficReplayer
+from .shared import SharedResources, cache_key, is_cacheable
 
 ###############################################################################
 
 PROTOCOL = "https:"
 ENDPOINT = "/nuSource/api/v1"
 
+# content encodings that can be decoded (gzip and deflate, and br or zstd if
+# the respective packages are installed)
+ACCEPT_ENCODING = make_headers(accept_encoding=True)["accept-encoding"]
+
 ###############################################################################
 
 
@@ -31,8 +48,63 @@ class EdmingleAPI:
         api_host: str,
         endpoint: str = ENDPOINT,
         protocol: str = PROTOCOL,
+        record: str = None,
+        replay: str = None,
+        replay_scale: float = 1.0,
+        shared: SharedResources = None,
+        max_workers: int = 1,
+        timeout: float or Tuple[float, float] = TIMEOUT,
+        stall_speed: float = STALL_SPEED,
+        stall_period: float = STALL_PERIOD,
+        hedge: float = None,
+        hedge_budget: float = HEDGE_BUDGET,
     ):
-        """Edmingle API"""
+        """Edmingle API
+
+        The client can be shared by several worker threads. The credentials
+        are held in an immutable AuthContext (`auth`), which is replaced on
+        sign-in, and requests are made with sessions from a SessionPool.
+
+        Parameters
+        ----------
+        record : str, optional
+            Path of an archive to record the API traffic to.
+            The default is None.
+        replay : str, optional
+            Path of a recorded archive to serve the API traffic from,
+            instead of the network.
+            The default is None.
+        replay_scale : float, optional
+            Factor applied to the recorded timings during replay.
+            The default is 1.0.
+        shared : SharedResources, optional
+            Connection pools, concurrency limiters and response cache shared
+            with the sessions of other accounts.
+            The default is None.
+        max_workers : int, optional
+            Upper bound of the adaptive concurrency of metadata calls, and of
+            file transfers (of all the accounts, with `shared` resources,
+            whose limiters are used instead).
+            The default is 1.
+        timeout : float or Tuple[float, float], optional
+            Connect and read timeouts of every request, in seconds.
+            The default is TIMEOUT.
+        stall_speed : float, optional
+            Transfers slower than this (in bytes per second) for
+            `stall_period` seconds are aborted. Use 0 to disable.
+            The default is STALL_SPEED.
+        stall_period : float, optional
+            Period (in seconds) over which the throughput is measured.
+            The default is STALL_PERIOD.
+        hedge : float, optional
+            Percentile of the observed latency (e.g., 0.95) after which a
+            duplicate of a metadata GET request is issued.
+            The default is None, which disables hedging.
+        hedge_budget : float, optional
+            Maximum number of duplicate requests, as a fraction of the
+            metadata requests.
+            The default is HEDGE_BUDGET.
+        """
 
         self.protocol = protocol
         self.hostname = hostname
@@ -42,7 +114,8 @@ class EdmingleAPI:
 
         self.username = username
         self.password = password
-        self.apikey = None
+        self.auth = AuthContext()
+        self.auth_lock = threading.Lock()
         self.logged_in = False
 
         self.user = {}
@@ -50,15 +123,48 @@ class EdmingleAPI:
         self.user_classes = {}
         self.organization = {}
 
-        self.session = requests.Session()
+        self.shared = shared
+        self.session = SessionPool(shared, timeout=timeout)
+        self.max_workers = max(max_workers, 1)
+        # the operations of several accounts are scheduled together
+        self.limiters = (
+            shared.limiters if shared is not None else
+            create_limiters(self.max_workers)
+        )
+        self.hedger = (
+            Hedger(hedge, hedge_budget, max_workers=2 * self.max_workers + 2)
+            if hedge else None
+        )
+        self.downloader = Downloader(
+            self.session,
+            on_status=self.limiters["transfer"].report_status,
+            stall_speed=stall_speed,
+            stall_period=stall_period,
+        )
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.setLevel(logging.INFO)
 
+        # headers and prepared GET request of the latest AuthContext
+        self.api_headers = self.build_api_headers()
+        self.auth_requests = (None, self.api_headers, None)
+
+        self.recorder = TrafficRecorder(record) if record else None
+        self.replayer = (
+            TrafficReplayer(replay, scale=replay_scale) if replay else None
+        )
+
     # ----------------------------------------------------------------------- #
 
+    @property
+    def apikey(self) -> str:
+        return self.auth.apikey
+
     def login(self) -> bool:
         """Login to Edmingle Platform
 
+        The new credentials are published as a whole, once the user details
+        have been fetched.
+
         Returns
         -------
         bool
@@ -73,26 +179,54 @@ class EdmingleAPI:
         }
         data = {"JSONString": json.dumps(data)}
         response = self.api(path=path, data=data, method="post")
-        if response["message"] == "Login successful":
-            self.logger.info("Login successful")
-            self.logged_in = True
-            self.user = response["user"]
-            self.apikey = response["user"]["apikey"]
-        else:
+        if response["message"] != "Login successful":
             self.logger.error("Login failed")
+            return self.logged_in
+
+        self.logger.info("Login successful")
+        user = response["user"]
+        generation = self.auth.generation + 1
+        auth = AuthContext(apikey=user["apikey"], generation=generation)
+
+        response = self.get_usermeta(auth=auth)
+        if response["message"] == "Success":
+            self.usermeta = response["user"]
+            if response["user"]["org_data"]:
+                self.organization = response["user"]["org_data"][0]
+                auth = AuthContext(
+                    apikey=auth.apikey,
+                    organization_id=str(
+                        self.organization.get("organization_id", "")
+                    ),
+                    generation=generation,
+                )
+            if response["user_classes"]:
+                self.user_classes = {
+                    str(k): {} for k in response["user_classes"]
+                }
+
+        self.user = user
+        self.auth = auth
+        self.logged_in = True
+        return self.logged_in
 
-        if self.logged_in:
-            response = self.get_usermeta()
-            if response["message"] == "Success":
-                self.usermeta = response["user"]
-                if response["user"]["org_data"]:
-                    self.organization = response["user"]["org_data"][0]
-                if response["user_classes"]:
-                    self.user_classes = {
-                        str(k): {} for k in response["user_classes"]
-                    }
+    def reauthenticate(self, stale: AuthContext) -> bool:
+        """Sign-in again, after the credentials `stale` were rejected
 
-        return self.logged_in
+        Workers that find the same credentials rejected sign-in only once;
+        the others wait and use the refreshed credentials.
+
+        Returns
+        -------
+        bool
+            Indicates whether newer credentials are available
+        """
+        with self.auth_lock:
+            if self.auth.generation != stale.generation:
+                return True
+            self.logger.info("Credentials rejected, signing-in again ...")
+            self.login()
+            return self.auth.generation != stale.generation
 
     # ----------------------------------------------------------------------- #
 
@@ -107,9 +241,9 @@ class EdmingleAPI:
         path = "user/basicinfo"
         return self.api(path=path)
 
-    def get_usermeta(self) -> Dict:
+    def get_usermeta(self, auth: AuthContext = None) -> Dict:
         path = "user/usermeta"
-        return self.api(path=path)
+        return self.api(path=path, auth=auth)
 
     # ----------------------------------------------------------------------- #
 
@@ -162,6 +296,7 @@ class EdmingleAPI:
         data: Dict = None,
         is_json: bool = True,
         method: str = "GET",
+        auth: AuthContext = None,
     ) -> Dict or str:
         """General API Query
 
@@ -171,7 +306,7 @@ class EdmingleAPI:
             API Path
         data : Dict, optional
             Dictionary containing GET or POST data
-            In case of "GET", the data is used to form the GET options string.
+            In case of "GET", the data is URL-encoded into the query string.
             In case of "POST", the data is passed with the POST request.
             The default is None
         is_json : bool, optional
@@ -180,6 +315,10 @@ class EdmingleAPI:
         method : str, optional
             HTTP Method ("GET" or "POST").
             The default is "GET"
+        auth : AuthContext, optional
+            Credentials to use, instead of the current ones. Requests with
+            explicit credentials are not retried after re-authentication.
+            The default is None.
 
         Returns
         -------
@@ -195,17 +334,344 @@ class EdmingleAPI:
         if method not in methods:
             method = default_method
 
-        headers = {
+        data = data or {}
+        if self.replayer is not None:
+            content = self.replayer.api(method, path, data)
+        elif (
+            self.shared is not None and
+            self.recorder is None and
+            is_cacheable(method, path)
+        ):
+            content = self.shared.cache.get_or_fetch(
+                cache_key(method, path, data),
+                lambda: self._request(method, path, data, auth)
+            )
+        else:
+            content = self._request(method, path, data, auth)[1]
+
+        if is_json:
+            return loads(content)
+        if isinstance(content, bytes):
+            return content.decode()
+        return content
+
+    def _request(
+        self,
+        method: str,
+        path: str,
+        data: Dict,
+        auth: AuthContext = None,
+    ) -> Tuple[bool, bytes]:
+        """Make an API request
+
+        If the current credentials are rejected, the client signs-in again
+        and the request is retried once.
+
+        Returns
+        -------
+        Tuple[bool, bytes]
+            Whether the request was successful, and the response content
+        """
+        api_url = f"{self.api_endpoint}/{path}"
+        for attempt in range(2):
+            context = auth or self.auth
+            start = time.perf_counter()
+            with self.limiters["metadata"].slot() as outcome:
+                if method == "GET":
+                    prepared = self.prepared_request(context).copy()
+                    query = urlencode(data)
+                    prepared.prepare_url(
+                        f"{api_url}?{query}" if query else api_url, None
+                    )
+                    r = self._send(prepared)
+                if method == "POST":
+                    headers = self.request_headers(context)
+                    r = self.session.post(api_url, data=data, headers=headers)
+                outcome.set_status(r.status_code)
+                outcome.num_bytes = len(r.content)
+            if (
+                r.status_code != 401 or
+                auth is not None or
+                context.apikey is None or
+                attempt or
+                not self.reauthenticate(context)
+            ):
+                break
+
+        if self.recorder is not None:
+            self.recorder.api(
+                method, path, data, r.status_code, r.content.decode(),
+                time.perf_counter() - start
+            )
+        return r.ok, r.content
+
+    def _auth_requests(self, context: AuthContext) -> Tuple:
+        """Headers and prepared GET request of the credentials `context`
+
+        Both are built once per AuthContext, and must not be modified.
+        """
+        cached = self.auth_requests
+        if cached[0] is not context:
+            headers = dict(self.api_headers)
+            headers.update(
+                (k, v) for k, v in context.headers.items() if v is not None
+            )
+            prepared = requests.Request(
+                "GET", self.api_endpoint, headers=headers
+            ).prepare()
+            cached = (context, headers, prepared)
+            self.auth_requests = cached
+        return cached
+
+    def request_headers(self, context: AuthContext) -> Dict:
+        """Headers of API requests made with the credentials `context`"""
+        return self._auth_requests(context)[1]
+
+    def prepared_request(
+        self,
+        context: AuthContext,
+    ) -> requests.PreparedRequest:
+        """Template of GET requests made with the credentials `context`
+
+        The template is prepared once per AuthContext, and should be copied
+        before its URL is set.
+        """
+        return self._auth_requests(context)[2]
+
+    # ----------------------------------------------------------------------- #
+
+    def download_material(
+        self,
+        url: str,
+        path: str,
+        callback: Callable[[int], None] = None,
+        on_size: Callable[[int, int], None] = None,
+    ) -> str or None:
+        """Download a material
+
+        Parameters
+        ----------
+        url : str
+            Download URL of the material
+        path : str
+            Path of the downloaded file
+        callback : Callable[[int], None], optional
+            Function called with the number of bytes after every write.
+            The default is None.
+        on_size : Callable[[int, int], None], optional
+            Function called with the size of the file and the number of
+            bytes already present, once they are known.
+            The default is None.
+
+        Returns
+        -------
+        str or None
+            Path of the downloaded file if the download was successful,
+            None otherwise
+        """
+        if self.replayer is not None:
+            return self.replayer.download(url, path, callback, on_size)
+
+        start = time.perf_counter()
+        with self.limiters["transfer"].slot() as outcome:
+            result = self.downloader.download(
+                url, path, headers=self.download_headers,
+                callback=self._count_bytes(outcome, callback), on_size=on_size
+            )
+            outcome.failed = outcome.failed or result is None
+        if self.recorder is not None and result:
+            self.recorder.download(
+                url, os.path.getsize(path), time.perf_counter() - start
+            )
+        return result
+
+    def stream_material(
+        self,
+        url: str,
+        open_target: Callable[[int or None], BinaryIO],
+        callback: Callable[[int], None] = None,
+        on_size: Callable[[int, int], None] = None,
+    ) -> int or None:
+        """Stream a material into a writable target (e.g., an archive)
+
+        Parameters
+        ----------
+        url : str
+            Download URL of the material
+        open_target : Callable[[int or None], BinaryIO]
+            Function called with the size of the material (None if unknown),
+            returning a context manager that yields a writable target
+        callback : Callable[[int], None], optional
+            Function called with the number of bytes after every write.
+            The default is None.
+        on_size : Callable[[int, int], None], optional
+            Function called with the size of the material, once known.
+            The default is None.
+
+        Returns
+        -------
+        int or None
+            Number of bytes written if the download was successful,
+            None otherwise
+        """
+        if self.replayer is not None:
+            return self.replayer.stream(url, open_target, callback, on_size)
+
+        start = time.perf_counter()
+        with self.limiters["transfer"].slot() as outcome:
+            result = self.downloader.stream(
+                url, open_target, headers=self.download_headers,
+                callback=self._count_bytes(outcome, callback), on_size=on_size
+            )
+            outcome.failed = outcome.failed or result is None
+        if self.recorder is not None and result is not None:
+            self.recorder.download(url, result, time.perf_counter() - start)
+        return result
+
+    def _send(self, prepared: requests.PreparedRequest) -> requests.Response:
+        """Send a prepared GET request, hedged if enabled"""
+        if self.hedger is None:
+            return self.session.send(prepared)
+        return self.hedger.run(lambda: self.session.send(prepared.copy()))
+
+    @staticmethod
+    def _count_bytes(
+        outcome: Outcome,
+        callback: Callable[[int], None] = None,
+    ) -> Callable[[int], None]:
+        """Callback that also counts the bytes of a transfer"""
+        def count(num_bytes: int):
+            outcome.num_bytes += num_bytes
+            if callback is not None:
+                callback(num_bytes)
+        return count
+
+    def concurrency_metrics(self) -> Dict:
+        """Current limits and decisions of the adaptive concurrency"""
+        metrics = {
+            name: limiter.metrics()
+            for name, limiter in self.limiters.items()
+        }
+        if self.hedger is not None:
+            metrics["hedging"] = self.hedger.metrics()
+        return metrics
+
+    def get_material_size(self, url: str) -> Dict:
+        """Fetch the size of a material without downloading it
+
+        Parameters
+        ----------
+        url : str
+            Download URL of the material
+
+        Returns
+        -------
+        Dict
+            "size": Content-Length in bytes (None if unknown),
+            "accept_ranges": whether byte ranges are supported,
+            "status": HTTP status code (None if the request failed)
+        """
+        if self.replayer is not None:
+            return self.replayer.head(url)
+
+        try:
+            r = self.session.head(
+                url, headers=self.download_headers, allow_redirects=True
+            )
+        except requests.RequestException as e:
+            self.logger.warning(f"Could not fetch the size of '{url}': {e}")
+            return {"size": None, "accept_ranges": False, "status": None}
+        size = r.headers.get("Content-Length")
+        return {
+            "size": int(size) if size and r.ok else None,
+            "accept_ranges": r.headers.get("Accept-Ranges") == "bytes",
+            "status": r.status_code,
+        }
+
+    def warm_up(self, url: str) -> bool:
+        """Open a connection to the host of a URL ahead of its first use
+
+        The root of the host is requested (HEAD) with a session of the
+        pool, which keeps the connection open for the following requests.
+        Concurrent calls open connections on different sessions.
+
+        Parameters
+        ----------
+        url : str
+            Any URL of the host
+
+        Returns
+        -------
+        bool
+            Indicates whether a connection was opened
+        """
+        if self.replayer is not None:
+            return False
+        parts = urlsplit(url)
+        try:
+            self.session.head(f"{parts.scheme}://{parts.netloc}/")
+        except requests.RequestException as e:
+            self.logger.debug(f"Could not connect to {parts.netloc}: {e}")
+            return False
+        return True
+
+    def measure_throughput(self, url: str, num_bytes: int) -> float or None:
+        """Measure download throughput by reading the first bytes of a URL
+
+        Parameters
+        ----------
+        url : str
+            Download URL of the material
+        num_bytes : int
+            Number of bytes to read
+
+        Returns
+        -------
+        float or None
+            Throughput in bytes per second, None if it could not be measured
+        """
+        if self.replayer is not None:
+            return self.replayer.throughput(url)
+
+        headers = dict(self.download_headers)
+        headers["Range"] = f"bytes=0-{num_bytes - 1}"
+        start = time.perf_counter()
+        received = 0
+        try:
+            with self.session.get(url, headers=headers, stream=True) as r:
+                if not r.ok:
+                    return None
+                for chunk in r.iter_content(chunk_size=64 * 1024):
+                    received += len(chunk)
+                    if received >= num_bytes:
+                        break
+        except requests.RequestException as e:
+            self.logger.warning(f"Could not measure throughput: {e}")
+            return None
+        elapsed = time.perf_counter() - start
+        return received / elapsed if received and elapsed else None
+
+    # ----------------------------------------------------------------------- #
+
+    def close(self):
+        """Flush and close the traffic recorder (if any) and the sessions"""
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.hedger is not None:
+            self.hedger.close()
+        self.session.close()
+
+    # ----------------------------------------------------------------------- #
+
+    def build_api_headers(self) -> Dict:
+        return {
             "User-Agent": self.user_agent,
             "Accept": "application/json, text/javascript, */*; q=0.01",
             "Accept-Language": "en-US,en;q=0.5",
-            "Accept-Encoding": "gzip, deflate, br",
-            "APIKEY": self.apikey,
+            "Accept-Encoding": ACCEPT_ENCODING,
             "Connection": "keep-alive",
-            "ORGID": str(self.organization.get("organization_id", "")),
             "Origin": self.host,
             "DNT": "1",
-            "Connection": "keep-alive",
             "Referer": self.host,
             "Sec-Fetch-Dest": "empty",
             "Sec-Fetch-Mode": "cors",
@@ -213,32 +679,17 @@ class EdmingleAPI:
             "Sec-GPC": "1",
             "TE": "trailers",
         }
-        data = data or {}
-        if method == "GET":
-            option_string = "&".join(f"{k}={v}" for k, v in data.items())
-            api_url = f"{self.api_endpoint}/{path}?{option_string}"
-            r = self.session.get(api_url, headers=headers)
-        if method == "POST":
-            api_url = f"{self.api_endpoint}/{path}"
-            r = self.session.post(api_url, data=data, headers=headers)
-
-        content = r.content.decode()
-        if is_json:
-            return json.loads(content.strip())
-        else:
-            return content
 
-    # ----------------------------------------------------------------------- #
-
-    def download_material(self, url: str, path: str) -> str or None:
-        headers = {
+    @property
+    def download_headers(self) -> Dict:
+        return {
             "User-Agent": self.user_agent,
             "Accept": (
                 "text/html,application/xhtml+xml,application/xml;q=0.9,"
                 "image/webp,*/*;q=0.8"
             ),
             "Accept-Language": "en-US,en;q=0.5",
-            "Accept-Encoding": "gzip, deflate, br",
+            "Accept-Encoding": ACCEPT_ENCODING,
             "DNT": "1",
             "Connection": "keep-alive",
             "Referer": self.host,
@@ -248,11 +699,6 @@ class EdmingleAPI:
             "Sec-Fetch-Site": "cross-site",
             "Sec-GPC": "1",
         }
-        return download(
-            url, download_path=path, headers=headers, session=self.session
-        )
-
-    # ----------------------------------------------------------------------- #
 
     @property
     def user_agent(self) -> str:
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Expiring URLs
+
+Material URLs may be signed, time-limited CDN links. The expiry of a URL is
+read from the query parameters of the common signing schemes (S3 and GCS
+V4 signatures, CloudFront and V2 `Expires`, Akamai `exp` tokens), and
+resolved URLs are kept in a `URLCache` until shortly before they expire.
+
+@author: Hrishikesh Terdalkar
+"""
+
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+###############################################################################
+
+# URLs that expire within this many seconds are resolved again
+EXPIRY_MARGIN = 60.0
+
+SIGNED_DATE_FORMAT = "%Y%m%dT%H%M%SZ"
+# (date, lifetime) parameters of V4 signatures
+SIGNED_LIFETIME_PARAMS = [
+    ("x-amz-date", "x-amz-expires"),
+    ("x-goog-date", "x-goog-expires"),
+]
+# parameters holding an absolute expiry (UNIX timestamp)
+SIGNED_EXPIRY_PARAMS = ["expires", "exp", "expiry"]
+# tokens with an embedded expiry (e.g., Akamai "st=...~exp=...~hmac=...")
+TOKEN_EXPIRY_REGEX = re.compile(r"(?:^|[~&])exp=(\d+)")
+
+###############################################################################
+
+
+def url_expiry(url: str) -> float or None:
+    """Expiry of a signed URL
+
+    Parameters
+    ----------
+    url : str
+        URL, possibly signed
+
+    Returns
+    -------
+    float or None
+        UNIX timestamp after which the URL is no longer valid,
+        None if the URL does not carry an expiry
+    """
+    params = {
+        key.lower(): value
+        for key, value in parse_qsl(urlsplit(url).query)
+    }
+    for date_param, lifetime_param in SIGNED_LIFETIME_PARAMS:
+        if date_param in params and lifetime_param in params:
+            try:
+                signed_at = datetime.strptime(
+                    params[date_param], SIGNED_DATE_FORMAT
+                ).replace(tzinfo=timezone.utc)
+                return signed_at.timestamp() + int(params[lifetime_param])
+            except ValueError:
+                pass
+    for param in SIGNED_EXPIRY_PARAMS:
+        if params.get(param, "").isdigit():
+            return float(params[param])
+    for value in params.values():
+        match = TOKEN_EXPIRY_REGEX.search(value)
+        if match:
+            return float(match.group(1))
+    return None
+
+###############################################################################
+
+
+class URLCache:
+    def __init__(self, margin: float = EXPIRY_MARGIN):
+        """Resolved URLs with their expiry
+
+        Parameters
+        ----------
+        margin : float, optional
+            URLs are considered expired this many seconds before their
+            actual expiry, so that a transfer does not start on a URL about
+            to expire.
+            The default is EXPIRY_MARGIN.
+        """
+        self.margin = margin
+        self.entries: Dict[str, Tuple[str, float or None]] = {}
+        self.lock = threading.Lock()
+
+    def put(self, key: str, url: str) -> float or None:
+        """Cache a URL, returning its expiry"""
+        expires_at = url_expiry(url)
+        with self.lock:
+            self.entries[key] = (url, expires_at)
+        return expires_at
+
+    def get(self, key: str) -> str or None:
+        """URL cached for a key, None if it is missing or about to expire"""
+        with self.lock:
+            url, expires_at = self.entries.get(key, (None, None))
+        if url is None or self.is_expiring(expires_at):
+            return None
+        return url
+
+    def expiry(self, key: str) -> float or None:
+        with self.lock:
+            return self.entries.get(key, (None, None))[1]
+
+    def invalidate(self, key: str):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def is_expiring(self, expires_at: float or None) -> bool:
+        return (
+            expires_at is not None and
+            expires_at - self.margin <= time.time()
+        )
+
+    def __contains__(self, key: str) -> bool:
+        with self.lock:
+            return key in self.entries
+
+###############################################################################
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JSON Backend
+
+API responses are parsed directly from bytes, with `orjson` if it is
+installed and with the standard library `json` module otherwise.
+
+@author: Hrishikesh Terdalkar
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+###############################################################################
+
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+
+###############################################################################
+
+
+def loads(data: bytes or str):
+    """Parse a JSON document
+
+    Parameters
+    ----------
+    data : bytes or str
+        JSON document, UTF-8 encoded if bytes
+
+    Returns
+    -------
+    Any
+        Parsed object
+
+    Raises
+    ------
+    ValueError
+        If the document is not valid JSON
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+###############################################################################
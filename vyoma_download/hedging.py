@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Hedged Requests
+
+A few metadata calls take many times the median latency. A `Hedger` issues
+a duplicate of an idempotent request if no response has arrived by a
+percentile of the observed latencies, and takes whichever response arrives
+first. Duplicates are limited to a fraction (budget) of all the requests.
+
+@author: Hrishikesh Terdalkar
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, TypeVar
+
+###############################################################################
+
+HEDGE_PERCENTILE = 0.95
+HEDGE_BUDGET = 0.05
+# latencies observed before the first hedge
+MIN_SAMPLES = 20
+LATENCY_WINDOW = 500
+
+T = TypeVar("T")
+
+###############################################################################
+
+
+class LatencyTracker:
+    def __init__(self, window: int = LATENCY_WINDOW):
+        """Latencies of the most recent requests"""
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def add(self, latency: float):
+        with self.lock:
+            self.samples.append(latency)
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def percentile(self, fraction: float) -> float or None:
+        with self.lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return None
+        index = min(math.ceil(fraction * len(samples)) - 1, len(samples) - 1)
+        return samples[max(index, 0)]
+
+###############################################################################
+
+
+class Hedger:
+    def __init__(
+        self,
+        percentile: float = HEDGE_PERCENTILE,
+        budget: float = HEDGE_BUDGET,
+        min_samples: int = MIN_SAMPLES,
+        max_workers: int = 8,
+    ):
+        """Issue duplicates of slow idempotent requests
+
+        Parameters
+        ----------
+        percentile : float, optional
+            Percentile of the observed latencies after which a duplicate is
+            issued.
+            The default is HEDGE_PERCENTILE.
+        budget : float, optional
+            Maximum number of duplicates, as a fraction of the requests.
+            The default is HEDGE_BUDGET.
+        min_samples : int, optional
+            Number of latencies observed before the first duplicate.
+            The default is MIN_SAMPLES.
+        max_workers : int, optional
+            Number of threads that make the calls, which should be at least
+            twice the number of concurrent callers.
+            The default is 8.
+        """
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.latencies = LatencyTracker()
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="hedge"
+        )
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def _timed(self, fetch: Callable[[], T]) -> T:
+        start = time.monotonic()
+        result = fetch()
+        self.latencies.add(time.monotonic() - start)
+        return result
+
+    def _allow_hedge(self) -> bool:
+        with self.lock:
+            if self.hedged + 1 > self.budget * self.requests:
+                return False
+            self.hedged += 1
+            return True
+
+    def run(self, fetch: Callable[[], T]) -> T:
+        """Call `fetch`, and a duplicate of it if the first call is slow
+
+        Parameters
+        ----------
+        fetch : Callable[[], T]
+            Idempotent function, safe to call from another thread
+
+        Returns
+        -------
+        T
+            Result of the first call that succeeds
+        """
+        with self.lock:
+            self.requests += 1
+        delay = None
+        if len(self.latencies) >= self.min_samples:
+            delay = self.latencies.percentile(self.percentile)
+        if delay is None:
+            return self._timed(fetch)
+
+        primary = self.executor.submit(self._timed, fetch)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._allow_hedge():
+            return primary.result()
+
+        duplicate = self.executor.submit(self._timed, fetch)
+        pending = {primary, duplicate}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is duplicate:
+                        with self.lock:
+                            self.hedge_wins += 1
+                    return future.result()
+        # both calls failed
+        return primary.result()
+
+    def metrics(self) -> Dict:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "delay": self.latencies.percentile(self.percentile),
+            }
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+###############################################################################
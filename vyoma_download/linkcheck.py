@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+External Link Resolver
+
+External URL materials (mostly videos) are checked for liveness, and their
+final URL and title are resolved using oEmbed for known providers, or a HEAD
+request (followed by a partial GET for HTML pages) otherwise. Requests are
+made in parallel with bounded concurrency and the results are cached in the
+state store, so that repeated runs only re-check stale links.
+
+@author: Hrishikesh Terdalkar
+"""
+
+import html
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from urllib.parse import urlsplit
+
+import requests
+
+from .state import StateStore
+
+###############################################################################
+
+LINK_TTL = 7 * 24 * 60 * 60
+LINK_TIMEOUT = 15
+TITLE_BYTES = 64 * 1024
+
+OEMBED_PROVIDERS = {
+    "youtube.com": "https://www.youtube.com/oembed",
+    "youtu.be": "https://www.youtube.com/oembed",
+    "vimeo.com": "https://vimeo.com/api/oembed.json",
+}
+
+TITLE_PATTERN = re.compile(
+    rb"<title[^>]*>(.*?)</title>", re.IGNORECASE | re.DOTALL
+)
+
+###############################################################################
+
+
+def find_provider(url: str, providers: Dict[str, str]) -> str or None:
+    """oEmbed endpoint for a URL, matching the host or its parent domains"""
+    host = (urlsplit(url).hostname or "").lower()
+    while host:
+        if host in providers:
+            return providers[host]
+        host = host.partition(".")[2]
+    return None
+
+
+def extract_title(content: bytes, encoding: str = None) -> str or None:
+    match = TITLE_PATTERN.search(content)
+    if match is None:
+        return None
+    title = match.group(1).decode(encoding or "utf-8", errors="replace")
+    return html.unescape(" ".join(title.split())) or None
+
+###############################################################################
+
+
+class LinkChecker:
+    def __init__(
+        self,
+        session: requests.Session,
+        state: StateStore = None,
+        max_workers: int = 8,
+        ttl: float = LINK_TTL,
+        timeout: float = LINK_TIMEOUT,
+        oembed_providers: Dict[str, str] = None,
+    ):
+        """Concurrent resolver for external links
+
+        Parameters
+        ----------
+        session : requests.Session
+            Session used to make the requests
+        state : StateStore, optional
+            State store in which the results are cached.
+            If None, nothing is cached.
+            The default is None.
+        max_workers : int, optional
+            Maximum number of parallel requests.
+            The default is 8.
+        ttl : float, optional
+            Time (in seconds) after which a cached result is checked again.
+            The default is LINK_TTL (one week).
+        timeout : float, optional
+            Timeout (in seconds) of every request.
+            The default is LINK_TIMEOUT.
+        oembed_providers : Dict[str, str], optional
+            Mapping of hostnames to oEmbed endpoints.
+            The default is None, which uses OEMBED_PROVIDERS.
+        """
+        self.session = session
+        self.state = state
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self.timeout = timeout
+        self.oembed_providers = (
+            OEMBED_PROVIDERS if oembed_providers is None else oembed_providers
+        )
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    # ----------------------------------------------------------------------- #
+
+    def check(self, url: str, refresh: bool = False) -> Dict:
+        """Resolve a single link, using the cached result if it is fresh
+
+        Returns
+        -------
+        Dict
+            "url", "ok", "status", "final_url", "title", "provider",
+            "error" and "checked_at"
+        """
+        if self.state is not None and not refresh:
+            cached = self.state.get_link(url)
+            if cached and time.time() - cached["checked_at"] < self.ttl:
+                return cached
+
+        result = {
+            "url": url,
+            "ok": False,
+            "status": None,
+            "final_url": None,
+            "title": None,
+            "provider": None,
+            "error": None,
+            "checked_at": time.time(),
+        }
+        try:
+            endpoint = find_provider(url, self.oembed_providers)
+            if endpoint is None or not self._oembed(endpoint, result):
+                self._fetch(result)
+        except requests.RequestException as e:
+            result["error"] = str(e)
+            self.logger.debug(f"Link check of {url} failed: {e}")
+
+        if self.state is not None:
+            self.state.update_link(result)
+        return result
+
+    def check_all(self, urls: List[str], refresh: bool = False) -> Dict:
+        """Resolve links in parallel
+
+        Parameters
+        ----------
+        urls : List[str]
+            Links to resolve (duplicates are checked once)
+        refresh : bool, optional
+            If true, cached results are ignored.
+            The default is False.
+
+        Returns
+        -------
+        Dict
+            Mapping of every link to its result
+        """
+        unique_urls = list(dict.fromkeys(urls))
+        if not unique_urls:
+            return {}
+        max_workers = min(self.max_workers, len(unique_urls))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(
+                lambda url: self.check(url, refresh=refresh), unique_urls
+            )
+            return dict(zip(unique_urls, results))
+
+    # ----------------------------------------------------------------------- #
+
+    def _oembed(self, endpoint: str, result: Dict) -> bool:
+        r = self.session.get(
+            endpoint,
+            params={"url": result["url"], "format": "json"},
+            timeout=self.timeout,
+        )
+        if r.status_code in [401, 403, 404]:
+            # private, removed or non-embeddable
+            result["status"] = r.status_code
+            result["provider"] = "oembed"
+            result["error"] = f"oEmbed lookup failed ({r.status_code})"
+            return True
+        if not r.ok:
+            return False
+        try:
+            metadata = r.json()
+        except ValueError:
+            return False
+        result.update({
+            "ok": True,
+            "status": r.status_code,
+            "final_url": result["url"],
+            "title": metadata.get("title"),
+            "provider": metadata.get("provider_name") or "oembed",
+        })
+        return True
+
+    def _fetch(self, result: Dict):
+        r = self.session.head(
+            result["url"], allow_redirects=True, timeout=self.timeout
+        )
+        is_html = r.headers.get("Content-Type", "").startswith("text/html")
+        if r.status_code in [403, 405, 501] or (r.ok and is_html):
+            # HEAD is not supported, or the title is needed
+            r = self.session.get(
+                result["url"], allow_redirects=True, stream=True,
+                timeout=self.timeout
+            )
+            try:
+                is_html = r.headers.get(
+                    "Content-Type", ""
+                ).startswith("text/html")
+                if r.ok and is_html:
+                    content = next(r.iter_content(TITLE_BYTES), b"")
+                    result["title"] = extract_title(content, r.encoding)
+            finally:
+                r.close()
+
+        result.update({
+            "ok": r.ok,
+            "status": r.status_code,
+            "final_url": r.url,
+        })
+        if not r.ok:
+            result["error"] = f"HTTP {r.status_code}"
+
+
+###############################################################################
@@ -0,0 +1,871 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LAN Mirror Server
+
+Serves the download tree over HTTP, so that the students of a network can
+share one copy of every course:
+
+* `/` lists the courses (downloaded, and those of the catalog loaded at
+  the startup, which is refreshed in the background once stale),
+* `/courses/<course_id>/` lists the materials of a course,
+* `/courses/<course_id>/<material_id>` serves a material,
+* `/files/<path>` browses the download directory.
+
+Files are served with byte range support (for seeking in audio players).
+Listings are HTML, or JSON with `?format=json` (or `Accept:
+application/json`).
+
+With a signed-in `Vyoma` session, the server is a read-through cache: a
+material that has not been downloaded yet is fetched from upstream on its
+first request, once however many clients ask for it concurrently, and is
+served from the disk afterwards. Files are streamed to the clients while
+they are written to the disk, so that playback starts without waiting for
+the complete download.
+
+@author: Hrishikesh Terdalkar
+"""
+
+import html
+import json
+import logging
+import mimetypes
+import os
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import formatdate
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import BinaryIO, Dict, Iterator, List, Tuple
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+import requests
+
+from . import __version__
+from .compression import read_compressed
+from .defaults import MIRROR_PORT
+from .records import MaterialRecord, SectionRecord
+from .state import StateStore, STATE_FILE
+from .storage import DirectoryStorage
+from .utils import human_size
+
+###############################################################################
+
+CHUNK_SIZE = 64 * 1024
+# minimum interval between the refreshes of a stale catalog (in seconds)
+CATALOG_RETRY = 5 * 60
+
+LOGGER = logging.getLogger(__name__)
+
+###############################################################################
+
+
+class RangeNotSatisfiable(Exception):
+    """The requested byte range lies beyond the end of the file"""
+
+
+def byte_range(header: str, size: int) -> Tuple[int, int] or None:
+    """Byte range requested by a Range header
+
+    Only a single range of bytes is supported. Other (and malformed)
+    headers are ignored, and the complete file is served.
+
+    Parameters
+    ----------
+    header : str
+        Value of the Range header (e.g., "bytes=0-1023", "bytes=-500")
+    size : int
+        Size of the file
+
+    Returns
+    -------
+    Tuple[int, int] or None
+        First and last (inclusive) byte of the range,
+        None if the complete file is to be served
+
+    Raises
+    ------
+    RangeNotSatisfiable
+        If the range starts beyond the end of the file
+    """
+    if not header:
+        return None
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    first, separator, last = ranges.strip().partition("-")
+    if not separator:
+        return None
+    try:
+        if not first:
+            # the last `last` bytes
+            length = int(last)
+            if length <= 0 or size == 0:
+                raise RangeNotSatisfiable(header)
+            return max(size - length, 0), size - 1
+        first = int(first)
+        last = int(last) if last else None
+    except ValueError:
+        return None
+    if first < 0 or (last is not None and last < first):
+        return None
+    if first >= size:
+        raise RangeNotSatisfiable(header)
+    return first, size - 1 if last is None else min(last, size - 1)
+
+###############################################################################
+
+
+class Transfer:
+    """Upstream fetch of a material, followed by the requests for it
+
+    The file is readable at `path` as soon as it is opened for writing,
+    and its first `written` bytes can be served before the fetch is done.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.path = None
+        self.local_path = None
+        self.size = None
+        self.written = 0
+        self.done = False
+        self.row = None
+
+    def begin(self, path: str, local_path: str, size: int or None):
+        with self.condition:
+            # a restarted download rewrites the same file from the start
+            self.path = path
+            self.local_path = local_path
+            self.size = size
+            self.written = 0
+            self.condition.notify_all()
+
+    def advance(self, num_bytes: int):
+        with self.condition:
+            self.written += num_bytes
+            self.condition.notify_all()
+
+    def finish(self, row: Dict or None):
+        """Conclude the fetch, with the state of the material if complete"""
+        with self.condition:
+            self.done = True
+            self.row = row
+            self.condition.notify_all()
+
+    def wait(self) -> bool:
+        """Wait until the file is being written, or the fetch is done
+
+        Returns
+        -------
+        bool
+            True if the file is being written, False if the fetch is done
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.path is not None or self.done
+            )
+            return not self.done
+
+    def wait_for(self, position: int) -> int:
+        """Wait until the file is written beyond a position
+
+        Returns
+        -------
+        int
+            Number of bytes written, which does not exceed the position if
+            the fetch is done (or has failed)
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.written > position or self.done
+            )
+            return self.written
+
+
+class TransferWriter:
+    """Writer that makes every write readable by the followers"""
+
+    def __init__(self, target: BinaryIO, transfer: Transfer):
+        self.target = target
+        self.transfer = transfer
+
+    def write(self, data) -> int:
+        size = self.target.write(data)
+        self.target.flush()
+        self.transfer.advance(size)
+        return size
+
+
+class CacheStorage(DirectoryStorage):
+    # files are written sequentially, so that a prefix can be served
+    resumable = False
+
+    def __init__(self, location: str, transfer: Transfer):
+        """Course directory, whose files are followed by a transfer"""
+        super().__init__(location)
+        self.transfer = transfer
+
+    @contextmanager
+    def open(self, name: str, size: int = None) -> Iterator[BinaryIO]:
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "wb") as f:
+            self.transfer.begin(temporary_path, path, size)
+            yield TransferWriter(f, self.transfer)
+        # followers open the file by its path, under the same condition
+        with self.transfer.condition:
+            os.replace(temporary_path, path)
+            self.transfer.path = path
+
+###############################################################################
+
+
+class MirrorServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        download_dir: str = None,
+        vyoma=None,
+        host: str = "",
+        port: int = MIRROR_PORT,
+    ):
+        """HTTP server of a download directory
+
+        Parameters
+        ----------
+        download_dir : str, optional
+            Download directory to serve.
+            The default is None, which uses the directory of the session.
+        vyoma : Vyoma, optional
+            Signed-in session, used to list the catalog and to fetch the
+            materials that have not been downloaded yet.
+            The default is None, which serves the local files only.
+        host : str, optional
+            Address to listen on.
+            The default is "", which listens on all interfaces.
+        port : int, optional
+            Port to listen on (0 for any free port).
+            The default is MIRROR_PORT.
+        """
+        super().__init__((host, port), MirrorRequestHandler)
+        self.vyoma = vyoma
+        self.download_dir = os.path.realpath(
+            download_dir or vyoma.download_dir
+        )
+        if vyoma is not None:
+            self.state = vyoma.state
+        else:
+            self.state = StateStore(
+                os.path.join(self.download_dir, STATE_FILE)
+            )
+        self.lock = threading.Lock()
+        # single-flight locks in use, with the number of their users
+        self.fetches = {}
+        # upstream fetches of materials in progress
+        self.transfers = {}
+        self.stats = {"hits": 0, "misses": 0}
+        self._thread = None
+        # time of the latest refresh of the catalog
+        self.catalog_checked = None
+        if vyoma is not None:
+            self.catalog_checked = time.monotonic()
+            vyoma.load_catalog()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, key: str):
+        with self.lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    @contextmanager
+    def single_flight(self, key: Tuple):
+        """Serialize the upstream fetches of a key"""
+        with self.lock:
+            flight = self.fetches.get(key)
+            if flight is None:
+                flight = self.fetches[key] = [threading.Lock(), 0]
+            flight[1] += 1
+        try:
+            with flight[0]:
+                yield
+        finally:
+            with self.lock:
+                flight[1] -= 1
+                if not flight[1]:
+                    del self.fetches[key]
+
+    # ----------------------------------------------------------------------- #
+
+    def refresh_catalog(self) -> bool:
+        """Refresh the course catalog from upstream
+
+        Returns
+        -------
+        bool
+            Indicates whether the catalog was refreshed
+        """
+        with self.lock:
+            self.catalog_checked = time.monotonic()
+        return self.vyoma.refresh_catalog()
+
+    def catalog(self) -> List[Dict]:
+        """Courses of the catalog, without waiting for upstream
+
+        A stale catalog is refreshed in the background, at most once every
+        CATALOG_RETRY seconds (e.g., while upstream is unreachable).
+        """
+        if self.vyoma is None:
+            return []
+        catalog = self.vyoma.catalog
+        with self.lock:
+            due = (
+                catalog.stale and
+                time.monotonic() - self.catalog_checked > CATALOG_RETRY
+            )
+            if due:
+                self.catalog_checked = time.monotonic()
+        if due:
+            threading.Thread(
+                target=self.refresh_catalog, name="mirror-catalog",
+                daemon=True
+            ).start()
+        return list(catalog.courses)
+
+    def courses(self) -> List[Dict]:
+        """Courses of the catalog and of the download directory"""
+        local = {
+            str(row["course_id"]): row for row in self.state.course_summary()
+        }
+        courses = []
+        if self.vyoma is not None:
+            for course in self.catalog():
+                course_id = str(course["course_id"])
+                row = local.pop(course_id, {})
+                courses.append(course_entry(
+                    course_id, course["course_name"],
+                    course["course_instructor"], row
+                ))
+        for course_id, row in local.items():
+            courses.append(course_entry(
+                course_id, row["class_name"], None, row
+            ))
+        return courses
+
+    def materials(self, course_id: str) -> List[Dict]:
+        """Materials of a course, indexed from upstream if unknown"""
+        rows = self.state.get_materials(course_id)
+        if not rows and self.vyoma is not None:
+            if self.index_course(course_id):
+                rows = self.state.get_materials(course_id)
+        return rows
+
+    def index_course(self, course_id: str) -> bool:
+        """Record the curriculum of a course, with its materials pending"""
+        vyoma = self.vyoma
+        with self.single_flight(("course", course_id)):
+            if self.state.get_materials(course_id):
+                return True
+            try:
+                course_log = vyoma.get_course_details(course_id)
+                self.state.update_course(course_log)
+                for record in vyoma.iter_materials(
+                    course_id, resolve=False, course_log=course_log
+                ):
+                    if isinstance(record, SectionRecord):
+                        self.state.update_section(
+                            course_id, record.log_entry(), record.position
+                        )
+                    elif self.state.get_material(
+                        course_id, record.material_id
+                    ) is None:
+                        self.state.update_material(
+                            course_id, record.log_entry(), "pending"
+                        )
+            except (
+                requests.RequestException, ValueError, LookupError, TypeError
+            ) as e:
+                LOGGER.warning(f"Could not index course {course_id}: {e}")
+                return False
+        return True
+
+    def material(
+        self, course_id: str, material_id: str
+    ) -> Dict or Transfer or None:
+        """State of a material available locally, fetching it if needed
+
+        Returns
+        -------
+        Dict or Transfer or None
+            State of the material, its upstream fetch if it is being
+            fetched, None if it is not available
+        """
+        row = self.state.get_material(course_id, material_id)
+        if row is None and self.vyoma is not None:
+            if self.state.get_course(course_id) is None:
+                self.index_course(course_id)
+                row = self.state.get_material(course_id, material_id)
+        if is_present(row):
+            self.count("hits")
+            return row
+        if row is None or self.vyoma is None:
+            return None
+
+        key = (course_id, material_id)
+        with self.single_flight(("material", course_id, material_id)):
+            # fetched (or being fetched) by a concurrent request
+            with self.lock:
+                transfer = self.transfers.get(key)
+            if transfer is None:
+                # a finished fetch has updated the state
+                row = self.state.get_material(course_id, material_id)
+            if transfer is not None or is_present(row):
+                self.count("hits")
+                return transfer or row
+            self.count("misses")
+            course = self.state.get_course(course_id)
+            os.makedirs(course["local_path"], exist_ok=True)
+            record = MaterialRecord(
+                course_id=course_id,
+                class_id=course["class_id"],
+                section_id=row["section_id"],
+                material_id=material_id,
+                position=0,
+                name=row["name"],
+                type=row["type"],
+                source=row["source"],
+                course_dir=course["local_path"],
+            )
+            transfer = self.transfers[key] = Transfer()
+            threading.Thread(
+                target=self._fetch, args=(key, record, transfer),
+                name=f"fetch-{material_id}", daemon=True
+            ).start()
+            return transfer
+
+    def _fetch(self, key: Tuple, record: MaterialRecord, transfer: Transfer):
+        """Fetch a material, independently of the requests that follow it"""
+        row = None
+        try:
+            storage = None
+            if record.source == "file":
+                storage = CacheStorage(record.course_dir, transfer)
+            result = self.vyoma.fetch_material(record, storage=storage)
+            if result.status == "complete":
+                row = self.state.get_material(*key)
+        finally:
+            transfer.finish(row)
+            with self.lock:
+                del self.transfers[key]
+
+    # ----------------------------------------------------------------------- #
+
+    def start(self):
+        """Serve requests in a background thread"""
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="mirror", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def server_close(self):
+        super().server_close()
+        if self.vyoma is None:
+            self.state.close()
+
+###############################################################################
+
+
+class MirrorRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = f"vyoma-mirror/{__version__}"
+
+    def log_message(self, format, *args):
+        LOGGER.debug(f"{self.address_string()} - {format % args}")
+
+    # ----------------------------------------------------------------------- #
+
+    def do_HEAD(self):
+        self._route(head=True)
+
+    def do_GET(self):
+        self._route(head=False)
+
+    def _route(self, head: bool):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        self.head = head
+        self.as_json = (
+            "json" in query.get("format", []) or
+            "application/json" in self.headers.get("Accept", "")
+        )
+        parts = [unquote(part) for part in url.path.split("/") if part]
+        try:
+            if not parts:
+                return self._list_courses()
+            if parts[0] == "courses" and 2 <= len(parts) <= 3:
+                if not all(part.isdigit() for part in parts[1:]):
+                    return self._send_error(HTTPStatus.NOT_FOUND)
+                if len(parts) == 2:
+                    return self._list_materials(parts[1])
+                return self._serve_material(parts[1], parts[2])
+            if parts[0] == "files":
+                return self._serve_tree(parts[1:])
+            return self._send_error(HTTPStatus.NOT_FOUND)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client went away (e.g., a player seeking elsewhere)
+            self.close_connection = True
+
+    # ----------------------------------------------------------------------- #
+
+    def _send_body(
+        self,
+        body: bytes,
+        content_type: str,
+        status: int = HTTPStatus.OK,
+        headers: Dict = None,
+    ):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if not self.head:
+            self.wfile.write(body)
+
+    def _send_json(self, payload, status: int = HTTPStatus.OK):
+        self._send_body(
+            json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+            "application/json", status
+        )
+
+    def _send_html(self, title: str, content: str):
+        self._send_body(
+            render_page(title, content).encode("utf-8"),
+            "text/html; charset=utf-8"
+        )
+
+    def _send_error(self, status: HTTPStatus, message: str = None):
+        message = message or status.phrase
+        if self.as_json:
+            return self._send_json({"message": message}, status)
+        self._send_body(
+            message.encode("utf-8"), "text/plain; charset=utf-8", status
+        )
+
+    def _send_head(
+        self,
+        status: int,
+        path: str,
+        length: int or None,
+        headers: Dict,
+    ):
+        content_type, encoding = mimetypes.guess_type(path)
+        if content_type is None or encoding is not None:
+            content_type = "application/octet-stream"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if length is not None:
+            self.send_header("Content-Length", str(length))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+
+    def _send_file(self, path: str):
+        """Send a file, or the requested range of it"""
+        try:
+            f = open(path, "rb")
+        except OSError:
+            return self._send_error(HTTPStatus.NOT_FOUND)
+        with f:
+            stat = os.fstat(f.fileno())
+            size = stat.st_size
+            etag = f'"{stat.st_mtime_ns:x}-{size:x}"'
+            headers = {
+                "Accept-Ranges": "bytes",
+                "ETag": etag,
+                "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+            }
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                return
+
+            try:
+                requested = byte_range(self.headers.get("Range"), size)
+            except RangeNotSatisfiable:
+                headers["Content-Range"] = f"bytes */{size}"
+                return self._send_body(
+                    b"", "text/plain",
+                    HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE, headers
+                )
+            # a range of a file that has changed is not served
+            if_range = self.headers.get("If-Range")
+            if if_range is not None and if_range != etag:
+                requested = None
+
+            if requested is None:
+                status, first, length = HTTPStatus.OK, 0, size
+            else:
+                first, last = requested
+                status, length = HTTPStatus.PARTIAL_CONTENT, last - first + 1
+                headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+
+            self._send_head(status, path, length, headers)
+            if self.head:
+                return
+
+            f.seek(first)
+            while length > 0:
+                chunk = f.read(min(CHUNK_SIZE, length))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                length -= len(chunk)
+
+    def _send_transfer(self, transfer: Transfer):
+        """Send a file while it is fetched, as its bytes are written"""
+        with transfer.condition:
+            try:
+                f = open(transfer.path, "rb")
+            except OSError:
+                return self._send_error(HTTPStatus.NOT_FOUND)
+            size = transfer.size
+        with f:
+            status, first, length = HTTPStatus.OK, 0, size
+            if size is None:
+                # the end of the body is marked by closing the connection
+                self.close_connection = True
+                headers = {"Connection": "close"}
+            else:
+                headers = {"Accept-Ranges": "bytes"}
+                try:
+                    requested = byte_range(self.headers.get("Range"), size)
+                except RangeNotSatisfiable:
+                    headers["Content-Range"] = f"bytes */{size}"
+                    return self._send_body(
+                        b"", "text/plain",
+                        HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE, headers
+                    )
+                # the file has no validator until it is complete
+                if self.headers.get("If-Range") is not None:
+                    requested = None
+                if requested is not None:
+                    first, last = requested
+                    status = HTTPStatus.PARTIAL_CONTENT
+                    length = last - first + 1
+                    headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+
+            self._send_head(status, transfer.local_path, length, headers)
+            if self.head:
+                return
+
+            position = first
+            end = None if length is None else first + length
+            while end is None or position < end:
+                written = transfer.wait_for(position)
+                if written <= position:
+                    break
+                f.seek(position)
+                limit = written - position
+                if end is not None:
+                    limit = min(limit, end - position)
+                chunk = f.read(min(CHUNK_SIZE, limit))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                position += len(chunk)
+            if end is not None and position < end:
+                # the fetch has failed, the response is incomplete
+                LOGGER.warning(f"Fetch of '{transfer.local_path}' failed")
+                self.close_connection = True
+
+    # ----------------------------------------------------------------------- #
+
+    def _list_courses(self):
+        courses = self.server.courses()
+        if self.as_json:
+            return self._send_json(courses)
+        self._send_html("Courses", render_table(
+            ["Course", "Teacher", "Materials", "Downloaded", "Size"],
+            [
+                [
+                    (course["name"], f"/courses/{course['course_id']}/"),
+                    course["tutor"] or "",
+                    course["num_materials"],
+                    course["num_complete"],
+                    human_size(course["size"]),
+                ]
+                for course in courses
+            ]
+        ))
+
+    def _list_materials(self, course_id: str):
+        rows = self.server.materials(course_id)
+        if not rows:
+            return self._send_error(HTTPStatus.NOT_FOUND, "Unknown course")
+        materials = [
+            {
+                "id": row["material_id"],
+                "section_id": row["section_id"],
+                "name": row["name"],
+                "type": row["type"],
+                "source": row["source"],
+                "status": row["status"],
+                "size": row["size"],
+                "url": f"/courses/{course_id}/{row['material_id']}",
+            }
+            for row in rows
+        ]
+        if self.as_json:
+            return self._send_json(materials)
+        course = self.server.state.get_course(course_id) or {}
+        self._send_html(course.get("class_name", course_id), render_table(
+            ["Material", "Type", "Status", "Size"],
+            [
+                [
+                    (material["name"], material["url"]),
+                    material["type"],
+                    material["status"],
+                    human_size(material["size"] or 0),
+                ]
+                for material in materials
+            ]
+        ))
+
+    def _serve_material(self, course_id: str, material_id: str):
+        row = self.server.material(course_id, material_id)
+        if isinstance(row, Transfer):
+            if row.wait():
+                return self._send_transfer(row)
+            row = row.row
+        if row is None:
+            return self._send_error(
+                HTTPStatus.NOT_FOUND, "Material is not available"
+            )
+        if row["source"] == "external_url":
+            return self._send_body(
+                b"", "text/plain", HTTPStatus.FOUND,
+                {"Location": row["external_url"]}
+            )
+        if row["source"] == "html_text":
+            return self._send_body(
+                read_compressed(row["local_path"]),
+                "text/html; charset=utf-8"
+            )
+        self._send_file(row["local_path"])
+
+    def _serve_tree(self, parts: List[str]):
+        """Browse the download directory, except for hidden files"""
+        if any(part.startswith(".") or os.sep in part for part in parts):
+            return self._send_error(HTTPStatus.NOT_FOUND)
+        root = self.server.download_dir
+        path = os.path.realpath(os.path.join(root, *parts))
+        if os.path.commonpath([root, path]) != root:
+            return self._send_error(HTTPStatus.NOT_FOUND)
+        if os.path.isfile(path):
+            return self._send_file(path)
+        if not os.path.isdir(path):
+            return self._send_error(HTTPStatus.NOT_FOUND)
+
+        prefix = "/".join(["/files"] + [quote(part) for part in parts])
+        entries = []
+        for entry in sorted(os.scandir(path), key=lambda e: e.name):
+            if entry.name.startswith("."):
+                continue
+            is_dir = entry.is_dir()
+            entries.append({
+                "name": entry.name + ("/" if is_dir else ""),
+                "size": None if is_dir else entry.stat().st_size,
+                "url": f"{prefix}/{quote(entry.name)}" + (
+                    "/" if is_dir else ""
+                ),
+            })
+        if self.as_json:
+            return self._send_json(entries)
+        self._send_html("/".join(["files"] + parts), render_table(
+            ["Name", "Size"],
+            [
+                [
+                    (entry["name"], entry["url"]),
+                    human_size(entry["size"]) if entry["size"] else "",
+                ]
+                for entry in entries
+            ]
+        ))
+
+###############################################################################
+
+
+def is_present(row: Dict or None) -> bool:
+    """Check if a material (state row) can be served locally"""
+    if row is None or row["status"] != "complete":
+        return False
+    if row["source"] == "external_url":
+        return bool(row.get("external_url"))
+    return bool(
+        row["local_path"] and
+        os.path.isfile(row["local_path"]) and
+        (
+            row["size"] is None or
+            os.path.getsize(row["local_path"]) == row["size"]
+        )
+    )
+
+
+def course_entry(course_id: str, name: str, tutor: str, row: Dict) -> Dict:
+    return {
+        "course_id": course_id,
+        "name": name,
+        "tutor": tutor,
+        "num_materials": row.get("num_materials") or 0,
+        "num_complete": row.get("num_complete") or 0,
+        "size": row.get("size") or 0,
+    }
+
+
+def render_table(headers: List[str], rows: List[List]) -> str:
+    """HTML table, where a (text, href) cell is rendered as a link"""
+    def cell(value) -> str:
+        if isinstance(value, tuple):
+            text, href = value
+            return f'<a href="{html.escape(href)}">{html.escape(text)}</a>'
+        return html.escape(str(value))
+
+    lines = ["<table>", "<tr>" + "".join(
+        f"<th>{html.escape(header)}</th>" for header in headers
+    ) + "</tr>"]
+    for row in rows:
+        lines.append(
+            "<tr>" + "".join(f"<td>{cell(value)}</td>" for value in row) +
+            "</tr>"
+        )
+    lines.append("</table>")
+    return "\n".join(lines)
+
+
+def render_page(title: str, content: str) -> str:
+    title = html.escape(title)
+    return (
+        "<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n"
+        f"<title>{title}</title>\n</head>\n<body>\n"
+        "<p><a href=\"/\">Courses</a> | <a href=\"/files/\">Files</a></p>\n"
+        f"<h1>{title}</h1>\n{content}\n</body>\n</html>\n"
+    )
+
+###############################################################################
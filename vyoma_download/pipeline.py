@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Staged Pipeline
+
+Items produced by a source flow through stages, every stage run by its own
+worker threads. Stages are connected by bounded queues, so a slow stage
+blocks the stages before it (backpressure) and the number of items in
+flight stays bounded, irrespective of the number of items.
+
+The output of the last stage is consumed by iterating over the pipeline,
+in the order in which items complete.
+
+@author: Hrishikesh Terdalkar
+"""
+
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List
+
+###############################################################################
+
+QUEUE_SIZE = 8
+# interval at which blocked workers check for cancellation (in seconds)
+POLL_INTERVAL = 0.1
+
+LOGGER = logging.getLogger(__name__)
+
+###############################################################################
+
+
+class _Stop:
+    """End of the stream marker"""
+
+# --------------------------------------------------------------------------- #
+
+
+class Stage:
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[Any], Any],
+        workers: int = 1,
+    ):
+        """Stage of a pipeline
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage, used in thread names and metrics
+        func : Callable[[Any], Any]
+            Function applied to every item, returning the item for the next
+            stage (None to drop it)
+        workers : int, optional
+            Number of worker threads.
+            The default is 1.
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(workers, 1)
+        self.input = None
+        self.output = None
+        self.lock = threading.Lock()
+        self.running = 0
+        self.processed = 0
+        self.busy_time = 0.0
+
+    def metrics(self) -> Dict:
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "queued": self.input.qsize() if self.input else 0,
+                "busy": self.running,
+                "processed": self.processed,
+                "busy_time": self.busy_time,
+            }
+
+###############################################################################
+
+
+class Pipeline:
+    def __init__(self, source: Iterable, queue_size: int = QUEUE_SIZE):
+        """Stages connected by bounded queues
+
+        Parameters
+        ----------
+        source : Iterable
+            Items fed to the first stage, consumed by a separate thread
+        queue_size : int, optional
+            Capacity of the queue in front of every stage, and of the
+            output.
+            The default is QUEUE_SIZE.
+        """
+        self.source = source
+        self.queue_size = queue_size
+        self.stages: List[Stage] = []
+        self.threads = []
+        self.cancelled = threading.Event()
+        self.error = None
+
+    def add_stage(
+        self,
+        name: str,
+        func: Callable[[Any], Any],
+        workers: int = 1,
+    ) -> "Pipeline":
+        self.stages.append(Stage(name, func, workers))
+        return self
+
+    def metrics(self) -> Dict:
+        return {stage.name: stage.metrics() for stage in self.stages}
+
+    # ----------------------------------------------------------------------- #
+
+    def _put(self, target: queue.Queue, item) -> bool:
+        """Put an item, unless the pipeline is cancelled"""
+        while not self.cancelled.is_set():
+            try:
+                target.put(item, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, source: queue.Queue):
+        while not self.cancelled.is_set():
+            try:
+                return source.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return _Stop
+
+    def _fail(self, error: BaseException):
+        if self.error is None:
+            self.error = error
+        self.cancelled.set()
+
+    def _produce(self, target: queue.Queue, workers: int):
+        try:
+            for item in self.source:
+                if not self._put(target, item):
+                    return
+        except BaseException as e:
+            LOGGER.exception("Pipeline source failed")
+            self._fail(e)
+            return
+        for _ in range(workers):
+            self._put(target, _Stop)
+
+    def _work(self, stage: Stage, next_workers: int, remaining: List[int]):
+        while True:
+            item = self._get(stage.input)
+            if item is _Stop:
+                break
+            with stage.lock:
+                stage.running += 1
+            start = time.monotonic()
+            try:
+                result = stage.func(item)
+            except BaseException as e:
+                LOGGER.exception(f"Pipeline stage '{stage.name}' failed")
+                self._fail(e)
+                return
+            finally:
+                with stage.lock:
+                    stage.running -= 1
+                    stage.processed += 1
+                    stage.busy_time += time.monotonic() - start
+            if result is not None and not self._put(stage.output, result):
+                return
+
+        # the last worker of a stage stops the workers of the next stage
+        with stage.lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            for _ in range(next_workers):
+                self._put(stage.output, _Stop)
+
+    def start(self):
+        queues = [
+            queue.Queue(maxsize=self.queue_size)
+            for _ in range(len(self.stages) + 1)
+        ]
+        for idx, stage in enumerate(self.stages):
+            stage.input = queues[idx]
+            stage.output = queues[idx + 1]
+        self.output = queues[-1]
+
+        first_workers = self.stages[0].workers if self.stages else 1
+        self.threads.append(threading.Thread(
+            target=self._produce, args=(queues[0], first_workers),
+            name="pipeline-source", daemon=True
+        ))
+        for idx, stage in enumerate(self.stages):
+            next_workers = (
+                self.stages[idx + 1].workers
+                if idx + 1 < len(self.stages) else 1
+            )
+            remaining = [stage.workers]
+            for worker in range(stage.workers):
+                self.threads.append(threading.Thread(
+                    target=self._work,
+                    args=(stage, next_workers, remaining),
+                    name=f"pipeline-{stage.name}-{worker}", daemon=True
+                ))
+        for thread in self.threads:
+            thread.start()
+
+    def close(self):
+        """Stop all the stages and wait for the workers"""
+        self.cancelled.set()
+        for thread in self.threads:
+            thread.join()
+
+    def __iter__(self) -> Iterator:
+        if not self.stages:
+            yield from self.source
+            return
+        self.start()
+        try:
+            while True:
+                item = self._get(self.output)
+                if item is _Stop:
+                    break
+                yield item
+        finally:
+            self.close()
+        if self.error is not None:
+            raise self.error
+
+###############################################################################
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Download Progress
+
+A single reporter aggregates the progress of every concurrent download:
+overall bytes and files, current throughput, ETA and what every worker is
+doing. The download path only calls cheap callbacks; rendering happens at
+most once per refresh interval.
+
+Reporters
+---------
+* `ProgressReporter`: no output, negligible cost (used when disabled)
+* `TqdmProgress`: a byte progress bar with a status line per worker
+* `JsonProgress`: periodic JSON lines, for job runners
+
+@author: Hrishikesh Terdalkar
+"""
+
+import json
+import sys
+import threading
+import time
+from abc import ABCMeta, abstractmethod
+from typing import Callable, Dict, TextIO
+
+from .utils import human_duration, human_size
+
+###############################################################################
+
+REFRESH_INTERVAL = 0.5
+JSON_INTERVAL = 5.0
+THROUGHPUT_WINDOW = 10.0
+
+PROGRESS_MODES = ["bar", "json", "none"]
+
+###############################################################################
+
+
+def worker_key(worker: str = None) -> str:
+    """Key of a worker, the name of the calling thread by default"""
+    return threading.current_thread().name if worker is None else worker
+
+# --------------------------------------------------------------------------- #
+
+
+class ProgressReporter:
+    """Progress reporter that reports nothing
+
+    Subclasses of `AggregateProgress` implement `render` (and optionally
+    override `close`).
+
+    Work is registered using `add_files`, every file is announced with
+    `start` (and its size with `set_size`, once known), bytes are reported
+    with `advance` and a file is concluded using `finish`.
+
+    A file belongs to the worker that started it, identified by the name of
+    its thread. Other threads (e.g., the segments of a transfer) report for
+    that worker by passing the key returned by `start` as `worker`.
+    """
+
+    enabled = False
+
+    def add_files(self, num_files: int):
+        pass
+
+    def add_metrics(self, name: str, source: Callable[[], Dict]):
+        """Include the metrics returned by `source` in the progress"""
+        pass
+
+    def start(self, name: str, worker: str = None) -> str:
+        return worker_key(worker)
+
+    def set_size(
+        self, size: int or None, present: int = 0, worker: str = None
+    ):
+        pass
+
+    def advance(self, num_bytes: int, worker: str = None):
+        pass
+
+    def finish(self, success: bool = True, worker: str = None):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# --------------------------------------------------------------------------- #
+
+
+class AggregateProgress(ProgressReporter, metaclass=ABCMeta):
+    enabled = True
+
+    def __init__(self, interval: float = REFRESH_INTERVAL):
+        """Progress aggregated over all the workers
+
+        Parameters
+        ----------
+        interval : float, optional
+            Minimum time (in seconds) between two renders.
+            The default is REFRESH_INTERVAL.
+        """
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.rendered_at = 0.0
+
+        self.total_files = 0
+        self.done_files = 0
+        self.failed_files = 0
+        self.done_bytes = 0
+        # bytes of completed (or skipped) files
+        self.finished_bytes = 0
+        self.known_bytes = 0
+        self.known_files = 0
+        self.workers = {}
+        self.samples = [(self.started_at, 0)]
+        self.metrics = {}
+
+    # ----------------------------------------------------------------------- #
+
+    def add_files(self, num_files: int):
+        with self.lock:
+            self.total_files += num_files
+
+    def add_metrics(self, name: str, source: Callable[[], Dict]):
+        with self.lock:
+            self.metrics[name] = source
+
+    def start(self, name: str, worker: str = None) -> str:
+        worker = worker_key(worker)
+        with self.lock:
+            self.workers[worker] = {"name": name, "size": None, "done": 0}
+        self.maybe_render()
+        return worker
+
+    def set_size(
+        self, size: int or None, present: int = 0, worker: str = None
+    ):
+        worker = worker_key(worker)
+        with self.lock:
+            status = self.workers.get(worker)
+            if status is None:
+                return
+            if status["size"] is not None:
+                self.known_bytes -= status["size"]
+                self.known_files -= 1
+            status["size"] = size
+            status["done"] = present
+            if size is not None:
+                self.known_bytes += size
+                self.known_files += 1
+
+    def advance(self, num_bytes: int, worker: str = None):
+        worker = worker_key(worker)
+        with self.lock:
+            self.done_bytes += num_bytes
+            status = self.workers.get(worker)
+            if status is not None:
+                status["done"] += num_bytes
+        now = time.monotonic()
+        if now - self.rendered_at >= self.interval:
+            self.maybe_render(now)
+
+    def finish(self, success: bool = True, worker: str = None):
+        worker = worker_key(worker)
+        with self.lock:
+            status = self.workers.pop(worker, None)
+            self.done_files += 1
+            self.failed_files += not success
+            if status is not None:
+                if status["size"] is None:
+                    # count the file as known once it has been seen
+                    self.known_bytes += status["done"]
+                    self.known_files += 1
+                self.finished_bytes += status["size"] or status["done"]
+        self.maybe_render()
+
+    # ----------------------------------------------------------------------- #
+
+    def maybe_render(self, now: float = None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if now - self.rendered_at < self.interval:
+                return
+            self.rendered_at = now
+            snapshot = self.snapshot(now)
+        self.render(snapshot)
+
+    def snapshot(self, now: float = None) -> Dict:
+        """Aggregated progress (must be called with the lock held)"""
+        now = time.monotonic() if now is None else now
+        self.samples.append((now, self.done_bytes))
+        while (
+            len(self.samples) > 2 and
+            now - self.samples[1][0] > THROUGHPUT_WINDOW
+        ):
+            self.samples.pop(0)
+        elapsed = now - self.samples[0][0]
+        throughput = (
+            (self.done_bytes - self.samples[0][1]) / elapsed
+            if elapsed > 0 else 0.0
+        )
+
+        # files whose size is not known yet are assumed to be average
+        pending_files = self.total_files - self.known_files
+        average_size = (
+            self.known_bytes / self.known_files if self.known_files else 0
+        )
+        total_bytes = self.known_bytes + pending_files * average_size
+        active_bytes = sum(
+            status["done"] for status in self.workers.values()
+        )
+        completed_bytes = self.finished_bytes + active_bytes
+        remaining_bytes = max(total_bytes - completed_bytes, 0)
+        eta = remaining_bytes / throughput if throughput > 0 else None
+        snapshot = {
+            "elapsed": now - self.started_at,
+            "transferred_bytes": self.done_bytes,
+            "done_bytes": completed_bytes,
+            "total_bytes": int(total_bytes),
+            "done_files": self.done_files,
+            "failed_files": self.failed_files,
+            "total_files": self.total_files,
+            "throughput": throughput,
+            "eta": eta,
+            "workers": {
+                worker: dict(status)
+                for worker, status in sorted(self.workers.items())
+            },
+        }
+        if self.metrics:
+            snapshot["metrics"] = {
+                name: source() for name, source in self.metrics.items()
+            }
+        return snapshot
+
+    @abstractmethod
+    def render(self, snapshot: Dict):
+        """Display a snapshot of the progress"""
+
+    def close(self):
+        with self.lock:
+            snapshot = self.snapshot()
+        self.render(snapshot)
+
+# --------------------------------------------------------------------------- #
+
+
+class TqdmProgress(AggregateProgress):
+    def __init__(
+        self,
+        max_workers: int = 1,
+        interval: float = REFRESH_INTERVAL,
+        file: TextIO = None,
+    ):
+        """Byte progress bar with a status line for every worker
+
+        Parameters
+        ----------
+        max_workers : int, optional
+            Number of worker status lines.
+            The default is 1.
+        interval : float, optional
+            Minimum time (in seconds) between two renders.
+            The default is REFRESH_INTERVAL.
+        file : TextIO, optional
+            Output stream.
+            The default is None, which uses sys.stderr.
+        """
+        # only the progress bar needs tqdm
+        from tqdm import tqdm
+
+        super().__init__(interval=interval)
+        self.bar = tqdm(
+            total=0, unit="B", unit_scale=True, unit_divisor=1024,
+            dynamic_ncols=True, file=file, position=0,
+            bar_format=(
+                "{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}{postfix}]"
+            ),
+        )
+        self.lines = [
+            tqdm(
+                total=0, bar_format="{desc}", file=file, position=idx + 1,
+                leave=False
+            )
+            for idx in range(max_workers)
+        ]
+
+    def render(self, snapshot: Dict):
+        self.bar.total = max(snapshot["total_bytes"], snapshot["done_bytes"])
+        self.bar.n = snapshot["done_bytes"]
+        eta = snapshot["eta"]
+        postfix = (
+            f"ETA {human_duration(eta) if eta is not None else '?'}, "
+            f"{human_size(snapshot['throughput'])}/s, "
+            f"{snapshot['done_files']}/{snapshot['total_files']} files"
+        )
+        if snapshot["failed_files"]:
+            postfix += f", {snapshot['failed_files']} failed"
+        self.bar.set_postfix_str(postfix, refresh=False)
+        self.bar.refresh()
+        statuses = list(snapshot["workers"].values())
+        for idx, line in enumerate(self.lines):
+            description = ""
+            if idx < len(statuses):
+                status = statuses[idx]
+                description = f"  {status['name']}"
+                if status["size"]:
+                    percentage = 100 * status["done"] / status["size"]
+                    description += f" ({percentage:.0f}%)"
+            line.set_description_str(description, refresh=True)
+
+    def close(self):
+        super().close()
+        for line in self.lines:
+            line.close()
+        self.bar.close()
+
+# --------------------------------------------------------------------------- #
+
+
+class JsonProgress(AggregateProgress):
+    def __init__(self, interval: float = JSON_INTERVAL, file: TextIO = None):
+        """Periodic machine-readable progress, one JSON object per line
+
+        Parameters
+        ----------
+        interval : float, optional
+            Minimum time (in seconds) between two lines.
+            The default is JSON_INTERVAL.
+        file : TextIO, optional
+            Output stream.
+            The default is None, which uses sys.stderr.
+        """
+        super().__init__(interval=interval)
+        self.file = file
+
+    def render(self, snapshot: Dict):
+        snapshot["elapsed"] = round(snapshot["elapsed"], 3)
+        snapshot["throughput"] = round(snapshot["throughput"], 1)
+        if snapshot["eta"] is not None:
+            snapshot["eta"] = round(snapshot["eta"], 1)
+        file = self.file or sys.stderr
+        file.write(json.dumps(snapshot, ensure_ascii=False) + "\n")
+        file.flush()
+
+###############################################################################
+
+
+def create_progress(mode: str, max_workers: int = 1) -> ProgressReporter:
+    """Progress reporter for a mode from PROGRESS_MODES"""
+    if mode == "bar":
+        return TqdmProgress(max_workers=max_workers)
+    if mode == "json":
+        return JsonProgress()
+    return ProgressReporter()
+
+###############################################################################
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Curriculum Records
+
+Typed records yielded while a course curriculum is walked lazily
+(`Vyoma.iter_materials`) and the results of consuming them
+(`Vyoma.download_materials`).
+
+@author: Hrishikesh Terdalkar
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict
+
+###############################################################################
+
+
+@dataclass
+class SectionRecord:
+    course_id: str
+    class_id: str
+    section_id: str
+    position: int
+    name: str
+    num_materials: int
+    num_resources: int
+
+    def log_entry(self) -> Dict:
+        return {
+            "id": self.section_id,
+            "name": self.name,
+            "num_materials": self.num_materials
+        }
+
+
+@dataclass
+class MaterialRecord:
+    course_id: str
+    class_id: str
+    section_id: str
+    material_id: str
+    position: int
+    name: str
+    type: str
+    source: str
+    course_dir: str
+    # resolved from the material details (None if not applicable)
+    url: str = None
+    filename: str = None
+    local_path: str = None
+    html_text: str = None
+    material: Dict = field(default=None, repr=False)
+    # response of a failed material lookup
+    error: Dict = None
+    # earlier record of the same material (by ID or URL) in the course
+    primary: "MaterialRecord" = field(default=None, repr=False)
+
+    @property
+    def resolved(self) -> bool:
+        return self.error is None
+
+    def resolve_from(self, other: "MaterialRecord"):
+        """Copy the details of another record of the same material"""
+        self.url = other.url
+        self.filename = other.filename
+        self.local_path = other.local_path
+        self.html_text = other.html_text
+        self.material = other.material
+        self.error = other.error
+
+    def log_entry(self) -> Dict:
+        return {
+            "section_id": self.section_id,
+            "id": self.material_id,
+            "name": self.name,
+            "type": self.type,
+            "source": self.source
+        }
+
+
+@dataclass
+class MaterialResult:
+    record: MaterialRecord
+    # "complete", "failed" or "unknown"
+    status: str
+    # download log entry
+    entry: Dict
+
+###############################################################################
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Record and Replay Edmingle Traffic
+
+Traffic is stored as gzip-compressed JSON lines, one entry per API call or
+file download. Credentials and personal details are scrubbed before being
+written, the signatures of URLs in responses (e.g., signed CDN links of
+materials) are redacted, and query strings are dropped from download URLs.
+
+@author: Hrishikesh Terdalkar
+"""
+
+import gzip
+import json
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from typing import BinaryIO, Callable, Dict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+###############################################################################
+
+SCRUB_KEYS = {
+    "username", "password", "apikey", "token", "email", "phone",
+    "contact_number",
+}
+SCRUBBED = "REDACTED"
+# query parameters carrying the signature (or credentials) of a signed URL
+SIGNATURE_PARAMS = {
+    "signature", "x-amz-signature", "x-amz-credential",
+    "x-amz-security-token", "x-goog-signature", "x-goog-credential",
+    "key-pair-id", "policy", "sig", "hmac", "token", "hdnts", "__token__",
+}
+
+###############################################################################
+
+
+def scrub(value):
+    """Recursively replace sensitive values in a JSON-like object"""
+    if isinstance(value, dict):
+        return {
+            k: SCRUBBED if k.lower() in SCRUB_KEYS else scrub(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, list):
+        return [scrub(v) for v in value]
+    if isinstance(value, str) and value.startswith(("http://", "https://")):
+        return redact_url(value)
+    return value
+
+
+def scrub_data(data: Dict) -> Dict:
+    """Scrub request data, including JSON encoded values"""
+    scrubbed = {}
+    for k, v in (data or {}).items():
+        if isinstance(v, str) and v.startswith("{"):
+            try:
+                v = json.dumps(scrub(json.loads(v)))
+            except ValueError:
+                pass
+        scrubbed[k] = SCRUBBED if k.lower() in SCRUB_KEYS else v
+    return scrubbed
+
+
+def scrub_content(content: str) -> str:
+    """Scrub a response body, if it is JSON"""
+    try:
+        return json.dumps(scrub(json.loads(content)), ensure_ascii=False)
+    except ValueError:
+        return content
+
+
+def redact_url(url: str) -> str:
+    """Replace the signature parameters of a URL"""
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if not any(k.lower() in SIGNATURE_PARAMS for k, _ in query):
+        return url
+    query = [
+        (k, SCRUBBED if k.lower() in SIGNATURE_PARAMS else v)
+        for k, v in query
+    ]
+    return urlunsplit(parts._replace(query=urlencode(query, safe="~")))
+
+
+def strip_query(url: str) -> str:
+    return urlunsplit(urlsplit(url)._replace(query="", fragment=""))
+
+
+def request_key(method: str, path: str, data: Dict) -> str:
+    return json.dumps(
+        [method.upper(), path, scrub_data(data)], sort_keys=True
+    )
+
+###############################################################################
+
+
+class TrafficRecorder:
+    def __init__(self, path: str):
+        """Record API responses and downloads to a compact archive
+
+        Parameters
+        ----------
+        path : str
+            Path of the archive (gzip-compressed JSON lines)
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.file = gzip.open(path, "wt", encoding="utf-8")
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def _write(self, entry: Dict):
+        entry["t"] = round(time.perf_counter() - self.start, 6)
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+        with self.lock:
+            if not self.file.closed:
+                self.file.write(line + "\n")
+
+    def api(
+        self,
+        method: str,
+        path: str,
+        data: Dict,
+        status: int,
+        content: str,
+        elapsed: float,
+    ):
+        self._write({
+            "kind": "api",
+            "method": method.upper(),
+            "path": path,
+            "data": scrub_data(data),
+            "status": status,
+            "elapsed": round(elapsed, 6),
+            "content": scrub_content(content),
+        })
+
+    def download(self, url: str, size: int, elapsed: float):
+        self._write({
+            "kind": "download",
+            "url": strip_query(url),
+            "size": size,
+            "elapsed": round(elapsed, 6),
+        })
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+                self.logger.info(f"Traffic recorded to '{self.path}'")
+
+# --------------------------------------------------------------------------- #
+
+
+class TrafficReplayer:
+    def __init__(self, path: str, scale: float = 1.0):
+        """Serve recorded API responses and downloads
+
+        Parameters
+        ----------
+        path : str
+            Path of an archive written by TrafficRecorder
+        scale : float, optional
+            Factor applied to the recorded timings.
+            1.0 replays with the original timings, 0 replays without delay.
+            The default is 1.0.
+        """
+        self.path = path
+        self.scale = scale
+        self.lock = threading.Lock()
+        self.responses = defaultdict(deque)
+        self.downloads = defaultdict(deque)
+        self.last = {}
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._load()
+
+    def _load(self):
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    entry = json.loads(line)
+                    if entry["kind"] == "api":
+                        key = request_key(
+                            entry["method"], entry["path"], entry["data"]
+                        )
+                        self.responses[key].append(entry)
+                    if entry["kind"] == "download":
+                        self.downloads[entry["url"]].append(entry)
+            except EOFError:
+                self.logger.warning(
+                    f"Archive '{self.path}' is truncated, "
+                    "replaying the complete entries only."
+                )
+
+    def _next(self, queues: Dict, key: str) -> Dict:
+        """Recorded entries are served in order, repeating the last one"""
+        with self.lock:
+            if queues[key]:
+                self.last[key] = queues[key].popleft()
+            return self.last.get(key)
+
+    def _wait(self, entry: Dict):
+        if self.scale:
+            time.sleep(entry["elapsed"] * self.scale)
+
+    def api(self, method: str, path: str, data: Dict) -> str:
+        key = request_key(method, path, data)
+        entry = self._next(self.responses, key)
+        if entry is None:
+            raise KeyError(f"No recorded response for {method} '{path}'")
+        self._wait(entry)
+        return entry["content"]
+
+    def download(
+        self,
+        url: str,
+        path: str,
+        callback: Callable[[int], None] = None,
+        on_size: Callable[[int, int], None] = None,
+    ) -> str or None:
+        """Write a placeholder file of the recorded size"""
+        written = self.stream(
+            url, lambda size: open(path, "wb"), callback, on_size
+        )
+        return path if written is not None else None
+
+    def stream(
+        self,
+        url: str,
+        open_target: Callable[[int], BinaryIO],
+        callback: Callable[[int], None] = None,
+        on_size: Callable[[int, int], None] = None,
+    ) -> int or None:
+        """Write placeholder content of the recorded size to a target"""
+        entry = self._next(self.downloads, strip_query(url))
+        if entry is None:
+            self.logger.error(f"No recorded download for '{url}'")
+            return None
+        self._wait(entry)
+        if on_size is not None:
+            on_size(entry["size"], 0)
+        block = memoryview(bytes(1024 * 1024))
+        remaining = entry["size"]
+        with open_target(entry["size"]) as f:
+            while remaining > 0:
+                written = f.write(block[:min(remaining, len(block))])
+                remaining -= written
+                if callback is not None:
+                    callback(written)
+        return entry["size"]
+
+    def _peek(self, url: str) -> Dict:
+        key = strip_query(url)
+        with self.lock:
+            if self.downloads[key]:
+                return self.downloads[key][0]
+            return self.last.get(key)
+
+    def head(self, url: str) -> Dict:
+        entry = self._peek(url)
+        return {
+            "size": entry["size"] if entry else None,
+            "accept_ranges": False,
+            "status": 200 if entry else 404,
+        }
+
+    def throughput(self, url: str) -> float or None:
+        entry = self._peek(url)
+        if entry is None or not entry["elapsed"]:
+            return None
+        return entry["size"] / entry["elapsed"]
+
+    def close(self):
+        pass
+
+
+###############################################################################
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Resources Shared by Sessions
+
+Sessions of several accounts in the same process share one connection pool
+per host, one scheduler (thread pool) of the accounts, the limiters of the
+metadata calls and file transfers, and a cache of account-independent API
+responses (course classes and curricula). The pipeline stages of every
+account acquire their slots from the shared limiters, so the concurrency
+(and its adaptation to the server) is that of all the accounts together.
+Account-specific headers (APIKEY) are sent with every request and are never
+shared.
+
+@author: Hrishikesh Terdalkar
+"""
+
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Tuple
+
+from requests.adapters import HTTPAdapter
+
+from .concurrency import create_limiters
+from .progress import ProgressReporter
+
+###############################################################################
+
+# API paths whose responses do not depend on the account
+CACHEABLE_PATHS = [
+    re.compile(r"student/masterbatches/classes/\d+"),
+    re.compile(r"student/classcurriculum/\d+/resources"),
+    re.compile(r"student/sections/\d+/resources"),
+]
+
+CACHE_SIZE = 4096
+POOL_CONNECTIONS = 16
+
+###############################################################################
+
+
+def is_cacheable(method: str, path: str) -> bool:
+    return method == "GET" and any(
+        pattern.fullmatch(path) for pattern in CACHEABLE_PATHS
+    )
+
+
+def cache_key(method: str, path: str, data: Dict) -> Tuple:
+    return (method, path, tuple(sorted((data or {}).items())))
+
+###############################################################################
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = CACHE_SIZE):
+        """Thread-safe LRU cache of API responses
+
+        Concurrent lookups of the same key result in a single fetch.
+
+        Parameters
+        ----------
+        max_entries : int, optional
+            Maximum number of cached responses.
+            The default is CACHE_SIZE.
+        """
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_fetch(
+        self,
+        key: Tuple,
+        fetch: Callable[[], Tuple[bool, bytes]],
+    ) -> bytes:
+        """Cached response, or the response of `fetch`
+
+        Parameters
+        ----------
+        key : Tuple
+            Cache key
+        fetch : Callable[[], Tuple[bool, bytes]]
+            Function returning whether the response can be cached, and the
+            response
+
+        Returns
+        -------
+        bytes
+            Response content
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            event = self.inflight.get(key)
+            if event is None:
+                event = self.inflight[key] = threading.Event()
+                owner = True
+                self.misses += 1
+            else:
+                owner = False
+
+        if not owner:
+            event.wait()
+            with self.lock:
+                if key in self.entries:
+                    self.hits += 1
+                    return self.entries[key]
+            # the owner could not cache the response
+            return fetch()[1]
+
+        try:
+            cacheable, content = fetch()
+            if cacheable:
+                with self.lock:
+                    self.entries[key] = content
+                    while len(self.entries) > self.max_entries:
+                        self.entries.popitem(last=False)
+            return content
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+            event.set()
+
+# --------------------------------------------------------------------------- #
+
+
+class SharedResources:
+    def __init__(
+        self,
+        max_workers: int = 4,
+        progress: ProgressReporter = None,
+        cache_size: int = CACHE_SIZE,
+        connections: int = None,
+        max_operations: int = None,
+    ):
+        """Connection pools, scheduler, limiters and cache shared by sessions
+
+        Parameters
+        ----------
+        max_workers : int, optional
+            Number of worker threads of the shared scheduler.
+            The default is 4.
+        progress : ProgressReporter, optional
+            Progress reporter shared by all the sessions.
+            The default is None.
+        cache_size : int, optional
+            Maximum number of cached API responses.
+            The default is CACHE_SIZE.
+        connections : int, optional
+            Maximum number of connections kept open to every host.
+            The default is None, which uses twice `max_workers`.
+        max_operations : int, optional
+            Upper bound of the concurrent metadata calls, and of the
+            concurrent file transfers, of all the sessions.
+            The default is None, which uses `max_workers`.
+        """
+        self.max_workers = max_workers
+        if connections is None:
+            connections = max(max_workers, 1) * 2
+        # urllib3 keeps one pool per host in the adapter's pool manager
+        self.adapter = HTTPAdapter(
+            pool_connections=POOL_CONNECTIONS,
+            pool_maxsize=connections,
+        )
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="vyoma"
+        )
+        self.limiters = create_limiters(max_operations or max_workers)
+        self.cache = ResponseCache(cache_size)
+        self.progress = progress
+
+    def mount(self, session):
+        """Use the shared connection pools in a session"""
+        session.mount("http://", self.adapter)
+        session.mount("https://", self.adapter)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.adapter.close()
+
+###############################################################################
@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Download State Store
+
+A single SQLite database under the download root keeps track of courses,
+sections, materials and every download attempt. Each material is updated in
+its own transaction, so an interrupted sync can be resumed, and status
+queries are index lookups instead of re-parsing JSON logs.
+
+@author: Hrishikesh Terdalkar
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+###############################################################################
+
+STATE_FILE = ".vyoma.sqlite3"
+
+# time to wait for a lock held by another process (in seconds)
+BUSY_TIMEOUT = 30.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS courses (
+    course_id TEXT PRIMARY KEY,
+    class_id TEXT,
+    class_name TEXT,
+    class_name_pretty TEXT,
+    tutor_name TEXT,
+    num_exercises INTEGER,
+    num_materials INTEGER,
+    local_path TEXT,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS sections (
+    course_id TEXT NOT NULL,
+    section_id TEXT NOT NULL,
+    position INTEGER,
+    name TEXT,
+    num_materials INTEGER,
+    updated_at REAL,
+    PRIMARY KEY (course_id, section_id)
+);
+CREATE TABLE IF NOT EXISTS materials (
+    course_id TEXT NOT NULL,
+    section_id TEXT NOT NULL,
+    material_id TEXT NOT NULL,
+    name TEXT,
+    type TEXT,
+    source TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    filename TEXT,
+    local_path TEXT,
+    size INTEGER,
+    details TEXT,
+    updated_at REAL,
+    PRIMARY KEY (course_id, section_id, material_id)
+);
+CREATE INDEX IF NOT EXISTS materials_status
+    ON materials (course_id, status, source, type);
+CREATE INDEX IF NOT EXISTS materials_material
+    ON materials (material_id);
+CREATE TABLE IF NOT EXISTS attempts (
+    attempt_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    course_id TEXT NOT NULL,
+    material_id TEXT NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    status TEXT,
+    bytes INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS attempts_material
+    ON attempts (course_id, material_id);
+CREATE TABLE IF NOT EXISTS links (
+    url TEXT PRIMARY KEY,
+    ok INTEGER,
+    status INTEGER,
+    final_url TEXT,
+    title TEXT,
+    provider TEXT,
+    error TEXT,
+    checked_at REAL
+);
+CREATE TABLE IF NOT EXISTS hosts (
+    origin TEXT PRIMARY KEY,
+    kind TEXT,
+    used_at REAL
+);
+"""
+
+MATERIAL_COLUMNS = [
+    "name", "type", "source", "status", "filename", "local_path", "size",
+]
+
+###############################################################################
+
+
+class StateStore:
+    def __init__(self, path: str, timeout: float = BUSY_TIMEOUT):
+        """SQLite-backed download state
+
+        Parameters
+        ----------
+        path : str
+            Path of the SQLite database
+        timeout : float, optional
+            Time to wait for a lock held by another process, in seconds.
+            The default is BUSY_TIMEOUT.
+        """
+        self.path = path
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(
+            path, timeout=timeout, check_same_thread=False,
+            isolation_level=None
+        )
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            else:
+                self.connection.execute("COMMIT")
+
+    def query(self, sql: str, parameters=()) -> List[Dict]:
+        with self.lock:
+            rows = self.connection.execute(sql, parameters).fetchall()
+        return [dict(row) for row in rows]
+
+    # ----------------------------------------------------------------------- #
+
+    def update_course(self, course: Dict):
+        with self.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO courses VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    str(course["course_id"]), str(course["class_id"]),
+                    course["class_name"], course["class_name_pretty"],
+                    course["tutor_name"], course["num_exercises"],
+                    course["num_materials"], course["local_path"],
+                    time.time()
+                )
+            )
+
+    def update_section(self, course_id: str, section: Dict, position: int):
+        with self.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO sections VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    str(course_id), str(section["id"]), position,
+                    section["name"], section["num_materials"], time.time()
+                )
+            )
+
+    def update_material(
+        self,
+        course_id: str,
+        material: Dict,
+        status: str,
+        attempt: Dict = None,
+    ):
+        """Record the state of a material, and optionally an attempt
+
+        Parameters
+        ----------
+        course_id : str
+            Course ID
+        material : Dict
+            Material log entry, containing at least "section_id", "id",
+            "name", "type" and "source"
+        status : str
+            Status of the material ("pending", "complete" or "failed")
+        attempt : Dict, optional
+            Download attempt containing "started_at", "finished_at",
+            "bytes" and "error".
+            The default is None.
+        """
+        course_id = str(course_id)
+        material_id = str(material["id"])
+        known = {"section_id", "id"} | set(MATERIAL_COLUMNS)
+        details = {k: v for k, v in material.items() if k not in known}
+        with self.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO materials VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    course_id, str(material["section_id"]), material_id,
+                    material.get("name"), material.get("type"),
+                    material.get("source"), status,
+                    material.get("filename"), material.get("local_path"),
+                    material.get("size"),
+                    json.dumps(details, ensure_ascii=False),
+                    time.time()
+                )
+            )
+            if attempt is not None:
+                db.execute(
+                    "INSERT INTO attempts (course_id, material_id, "
+                    "started_at, finished_at, status, bytes, error) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        course_id, material_id, attempt.get("started_at"),
+                        attempt.get("finished_at"), status,
+                        attempt.get("bytes"), attempt.get("error")
+                    )
+                )
+
+    def add_materials(self, course_id: str, materials: List[Dict]):
+        """Record the materials of a section, unless they are known
+
+        A material that has already been fetched in another section is
+        recorded as its duplicate, the others as pending.
+
+        Parameters
+        ----------
+        course_id : str
+            Course ID
+        materials : List[Dict]
+            Material log entries, containing "section_id", "id", "name",
+            "type" and "source"
+        """
+        course_id = str(course_id)
+        with self.transaction() as db:
+            for material in materials:
+                section_id = str(material["section_id"])
+                material_id = str(material["id"])
+                fetched = db.execute(
+                    "SELECT * FROM materials WHERE course_id = ? AND "
+                    "material_id = ? AND section_id != ? AND "
+                    "status != 'pending' ORDER BY updated_at LIMIT 1",
+                    (course_id, material_id, section_id)
+                ).fetchone()
+                if fetched is None:
+                    values = (
+                        "pending", None, None, None,
+                        json.dumps({}), time.time()
+                    )
+                else:
+                    values = duplicate_values(fetched)
+                db.execute(
+                    "INSERT OR IGNORE INTO materials VALUES "
+                    "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        course_id, section_id, material_id,
+                        material.get("name"), material.get("type"),
+                        material.get("source"), *values
+                    )
+                )
+
+    def copy_material(
+        self,
+        course_id: str,
+        section_id: str,
+        material_id: str,
+    ) -> int:
+        """Copy the state of a material to its other sections
+
+        Returns
+        -------
+        int
+            Number of sections updated
+        """
+        parameters = (str(course_id), str(material_id), str(section_id))
+        with self.transaction() as db:
+            fetched = db.execute(
+                "SELECT * FROM materials WHERE course_id = ? AND "
+                "material_id = ? AND section_id = ?",
+                parameters
+            ).fetchone()
+            if fetched is None:
+                return 0
+            cursor = db.execute(
+                "UPDATE materials SET status = ?, filename = ?, "
+                "local_path = ?, size = ?, details = ?, updated_at = ? "
+                "WHERE course_id = ? AND material_id = ? AND section_id != ?",
+                (*duplicate_values(fetched), *parameters)
+            )
+        return cursor.rowcount
+
+    def update_link(self, link: Dict):
+        """Record the result of an external link check"""
+        with self.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO links VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    link["url"], int(link["ok"]), link["status"],
+                    link["final_url"], link["title"], link["provider"],
+                    link["error"], link["checked_at"]
+                )
+            )
+
+    def update_host(self, origin: str, kind: str):
+        """Record the use of a host (e.g., the file server of materials)"""
+        with self.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO hosts VALUES (?, ?, ?)",
+                (origin, kind, time.time())
+            )
+
+    # ----------------------------------------------------------------------- #
+
+    def get_course(self, course_id: str) -> Dict or None:
+        rows = self.query(
+            "SELECT * FROM courses WHERE course_id = ?", (str(course_id),)
+        )
+        return rows[0] if rows else None
+
+    def get_material(self, course_id: str, material_id: str) -> Dict or None:
+        rows = self.query(
+            "SELECT * FROM materials WHERE course_id = ? AND material_id = ? "
+            "ORDER BY status = 'pending', updated_at DESC LIMIT 1",
+            (str(course_id), str(material_id))
+        )
+        if not rows:
+            return None
+        row = rows[0]
+        row.update(json.loads(row.pop("details") or "{}"))
+        return row
+
+    def get_sections(self, course_id: str) -> List[Dict]:
+        return self.query(
+            "SELECT * FROM sections WHERE course_id = ? ORDER BY position",
+            (str(course_id),)
+        )
+
+    def get_materials(self, course_id: str) -> List[Dict]:
+        """Materials of a course, in the order of their sections"""
+        rows = self.query(
+            "SELECT m.* FROM materials m LEFT JOIN sections s "
+            "USING (course_id, section_id) WHERE m.course_id = ? "
+            "ORDER BY s.position, m.rowid",
+            (str(course_id),)
+        )
+        for row in rows:
+            row.update(json.loads(row.pop("details") or "{}"))
+        return rows
+
+    def get_attempts(self, course_id: str, material_id: str) -> List[Dict]:
+        return self.query(
+            "SELECT * FROM attempts WHERE course_id = ? AND material_id = ? "
+            "ORDER BY attempt_id",
+            (str(course_id), str(material_id))
+        )
+
+    def get_link(self, url: str) -> Dict or None:
+        rows = self.query("SELECT * FROM links WHERE url = ?", (url,))
+        if not rows:
+            return None
+        row = rows[0]
+        row["ok"] = bool(row["ok"])
+        return row
+
+    def material_counts(self, course_id: str) -> List[Dict]:
+        """Number of materials of a course by source, type and status"""
+        return self.query(
+            "SELECT source, type, status, COUNT(*) AS count, "
+            "SUM(size) AS size FROM materials WHERE course_id = ? "
+            "GROUP BY source, type, status",
+            (str(course_id),)
+        )
+
+    def recent_hosts(self, kind: str, limit: int = 2) -> List[str]:
+        """Origins of the most recently used hosts of a kind"""
+        return [
+            row["origin"] for row in self.query(
+                "SELECT origin FROM hosts WHERE kind = ? "
+                "ORDER BY used_at DESC LIMIT ?",
+                (kind, limit)
+            )
+        ]
+
+    def course_summary(self) -> List[Dict]:
+        """Status of all the known courses"""
+        return self.query(
+            "SELECT c.course_id, c.class_name, c.local_path, "
+            "COUNT(m.material_id) AS num_materials, "
+            "SUM(m.status = 'complete') AS num_complete, "
+            "SUM(m.status = 'failed') AS num_failed, "
+            "SUM(CASE WHEN m.status = 'complete' THEN m.size END) AS size "
+            "FROM courses c LEFT JOIN materials m USING (course_id) "
+            "GROUP BY c.course_id ORDER BY c.class_name"
+        )
+
+    # ----------------------------------------------------------------------- #
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+###############################################################################
+
+
+def duplicate_values(row: sqlite3.Row) -> tuple:
+    """State of a fetched material, for its duplicates in other sections"""
+    details = json.loads(row["details"] or "{}")
+    details.setdefault("duplicate_of", {
+        "section_id": row["section_id"],
+        "id": row["material_id"],
+    })
+    return (
+        row["status"], row["filename"], row["local_path"], row["size"],
+        json.dumps(details, ensure_ascii=False), time.time()
+    )
+
+###############################################################################
@@ -0,0 +1,885 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Storage Backends
+
+Materials of a course are written to a storage backend:
+
+* `DirectoryStorage`: one file per material under the course directory
+  (resumable downloads)
+* `TarStorage`: a single tar archive, optionally zstd-compressed
+* `ZipStorage`: a single zip archive
+* `ObjectStorage`: objects uploaded with HTTP PUT to an S3-compatible
+  endpoint (e.g., a local stand-in for a bucket)
+
+Members of known size are streamed into an archive as they arrive, one
+at a time, and a failed member is cut from the end of the archive. Members
+of unknown size are staged in a temporary file (in memory while they are
+small) and appended once they are complete. Archives contain an index
+(INDEX_NAME) with the offset, size and SHA-256 digest of every member, for
+random access (see `read_member`). An existing archive is reopened and
+appended to, so that an interrupted download can be resumed.
+
+@author: Hrishikesh Terdalkar
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import warnings
+import zipfile
+from contextlib import contextmanager
+from typing import BinaryIO, Callable, Dict, Iterator, Tuple
+from urllib.parse import quote
+
+import requests
+
+from .auth import SessionPool
+from .defaults import TIMEOUT
+
+###############################################################################
+
+INDEX_NAME = ".index.json"
+LOG_NAME = "log.json"
+# members written again by every run, which are kept at the end of archives
+TRAILER_NAMES = {LOG_NAME, INDEX_NAME}
+
+SPOOL_SIZE = 16 * 1024 * 1024
+READ_SIZE = 64 * 1024
+ZIP64_LIMIT = zipfile.ZIP64_LIMIT
+
+STORAGE_MODES = ["dir", "tar", "tar.zst", "zip"]
+
+###############################################################################
+
+
+class IncompleteWrite(IOError):
+    """Fewer bytes were written than announced"""
+
+# --------------------------------------------------------------------------- #
+
+
+class CountingWriter:
+    """Writer that counts (and optionally limits) the bytes written"""
+
+    def __init__(self, target: BinaryIO, limit: int = None):
+        self.target = target
+        self.limit = limit
+        self.written = 0
+        self.digest = hashlib.sha256()
+
+    def write(self, data) -> int:
+        size = len(data)
+        if self.limit is not None and self.written + size > self.limit:
+            raise IOError(f"Write exceeds the announced size {self.limit}")
+        self.target.write(data)
+        self.digest.update(data)
+        self.written += size
+        return size
+
+###############################################################################
+
+
+class Storage:
+    """Storage backend
+
+    Subclasses implement `open` (and optionally `exists` and `close`).
+    """
+
+    # files can be downloaded to `path(name)` directly (and resumed)
+    resumable = False
+    # objects can be written by several transfers at once
+    concurrent = True
+
+    def __init__(self, location: str):
+        self.location = location
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def path(self, name: str) -> str:
+        """Reference to a stored object, used in the download log"""
+        return f"{self.location}::{name}"
+
+    def exists(self, name: str, size: int = None) -> bool:
+        return False
+
+    @contextmanager
+    def open(self, name: str, size: int = None) -> Iterator[BinaryIO]:
+        """Open an object for writing
+
+        Parameters
+        ----------
+        name : str
+            Relative name of the object
+        size : int, optional
+            Size of the object, if known in advance.
+            The default is None.
+        """
+        raise NotImplementedError
+        yield
+
+    def write(self, name: str, data: bytes):
+        with self.open(name, len(data)) as f:
+            f.write(data)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# --------------------------------------------------------------------------- #
+
+
+class DirectoryStorage(Storage):
+    resumable = True
+
+    def __init__(self, location: str):
+        """One file per object under a directory"""
+        super().__init__(location)
+        if not os.path.isdir(location):
+            os.makedirs(location)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.location, name)
+
+    def exists(self, name: str, size: int = None) -> bool:
+        path = self.path(name)
+        return os.path.isfile(path) and (
+            size is None or os.path.getsize(path) == size
+        )
+
+    @contextmanager
+    def open(self, name: str, size: int = None) -> Iterator[BinaryIO]:
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "wb") as f:
+            yield f
+        os.replace(temporary_path, path)
+
+# --------------------------------------------------------------------------- #
+
+
+class ArchiveStorage(Storage):
+    # members are written one at a time
+    concurrent = False
+
+    def __init__(self, location: str):
+        """Single archive, to which complete members are appended"""
+        super().__init__(location)
+        self.lock = threading.RLock()
+        self.index = {}
+        # members cut from the end of a reopened archive, written on close
+        self.trailer = {}
+        self.closed = False
+
+    def exists(self, name: str, size: int = None) -> bool:
+        # the index is read without waiting for a member being written
+        member = self.index.get(name)
+        return member is not None and (size is None or member["size"] == size)
+
+    @contextmanager
+    def open(self, name: str, size: int = None) -> Iterator[BinaryIO]:
+        """Open a member for writing
+
+        A member of known size is written into the archive as it arrives,
+        holding the lock of the archive until it is complete. A member of
+        unknown size is staged in a temporary file (in memory while it is
+        small) and appended once it is complete.
+        """
+        if size is not None:
+            with self.lock:
+                self.trailer.pop(name, None)
+                with self.open_member(name, size) as f:
+                    yield f
+            return
+
+        with tempfile.SpooledTemporaryFile(SPOOL_SIZE) as spool:
+            writer = CountingWriter(spool)
+            yield writer
+            spool.seek(0)
+            self.add_member(
+                name, spool, writer.written, writer.digest.hexdigest()
+            )
+
+    def write(self, name: str, data: bytes):
+        self.add_member(
+            name, io.BytesIO(data), len(data),
+            hashlib.sha256(data).hexdigest()
+        )
+
+    def add_member(
+        self,
+        name: str,
+        source: BinaryIO,
+        size: int,
+        digest: str = None,
+    ):
+        """Append a member, unless it is stored with the same content
+
+        Parameters
+        ----------
+        name : str
+            Name of the member
+        source : BinaryIO
+            File containing exactly `size` bytes of the member
+        size : int
+            Size of the member
+        digest : str, optional
+            SHA-256 digest of the member.
+            The default is None.
+        """
+        with self.lock:
+            self.trailer.pop(name, None)
+            member = self.index.get(name)
+            if digest is not None and member is not None and (
+                member.get("sha256") == digest
+            ):
+                return
+            with self.open_member(name, size) as f:
+                shutil.copyfileobj(source, f, 1024 * 1024)
+
+    def open_member(self, name: str, size: int):
+        """Append a member of known size, indexing it once it is complete
+
+        Nothing of a failed member is left in the archive.
+        """
+        raise NotImplementedError
+
+    def index_members(
+        self,
+        members: Iterator[Tuple[str, Dict, Callable[[], bytes], object]],
+    ) -> object or None:
+        """Index the members of a reopened archive
+
+        The members at the end of the archive that are written again on
+        close (TRAILER_NAMES) are carried in memory, and the archive is cut
+        before them, so that they are not duplicated by every run.
+
+        Parameters
+        ----------
+        members : Iterator[Tuple[str, Dict, Callable[[], bytes], object]]
+            Name, index entry, reader of the content and start (at which the
+            archive can be cut) of the complete members, in order
+
+        Returns
+        -------
+        object or None
+            Start of the first carried member, None if there is none
+        """
+        tail = []
+        for name, entry, read, start in members:
+            if name in TRAILER_NAMES:
+                tail.append((name, entry, read(), start))
+                continue
+            # members followed by others are kept in the archive
+            for kept_name, kept_entry, data, _ in tail:
+                if kept_name == INDEX_NAME:
+                    self.load_digests(io.BytesIO(data))
+                else:
+                    self.index[kept_name] = kept_entry
+            tail = []
+            self.index[name] = entry
+
+        for name, _, data, _ in tail:
+            if name == INDEX_NAME:
+                self.load_digests(io.BytesIO(data))
+            else:
+                self.trailer[name] = data
+        self.logger.info(
+            f"Resuming '{self.location}' with {len(self.index)} members"
+        )
+        return tail[0][3] if tail else None
+
+    def load_digests(self, source: BinaryIO):
+        """Digests of the indexed members, from the index of an archive"""
+        try:
+            members = json.load(source)["members"]
+        except (ValueError, KeyError, TypeError):
+            return
+        for name, member in members.items():
+            indexed = self.index.get(name)
+            if indexed is not None and (
+                indexed["offset"] == member.get("offset") and
+                "sha256" in member
+            ):
+                indexed["sha256"] = member["sha256"]
+
+    def write_index(self):
+        data = json.dumps({
+            "created_at": time.time(),
+            "members": self.index
+        }, ensure_ascii=False, indent=1).encode("utf-8")
+        with self.open_member(INDEX_NAME, len(data)) as f:
+            f.write(data)
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            for name, data in self.trailer.items():
+                with self.open_member(name, len(data)) as f:
+                    f.write(data)
+            self.write_index()
+            self.finish()
+            self.logger.info(f"Archive written to '{self.location}'")
+
+    def finish(self):
+        raise NotImplementedError
+
+# --------------------------------------------------------------------------- #
+
+
+class TarStorage(ArchiveStorage):
+    def __init__(self, location: str, compression: str = None):
+        """Tar archive, streamed member by member
+
+        Parameters
+        ----------
+        location : str
+            Path of the archive
+        compression : str, optional
+            "zstd" to compress the archive (requires `zstandard`).
+            The default is None.
+
+        Offsets in the index refer to the uncompressed tar stream. Every
+        member of a compressed archive is a separate zstd frame, whose
+        offset in the file is indexed as "frame", so that a member can be
+        read without decompressing the members before it.
+
+        The members of an existing archive are kept. The archive is cut
+        after its last complete member and appended to.
+        """
+        super().__init__(location)
+        if compression not in [None, "zstd"]:
+            raise ValueError(f"Unsupported compression '{compression}'")
+        self.compressor = None
+        if compression == "zstd":
+            import zstandard
+            self.compressor = zstandard.ZstdCompressor()
+
+        position = self.offset = 0
+        if os.path.isfile(location):
+            if self.compressor is None:
+                position = self.offset = self.scan_members()
+            else:
+                position, self.offset = self.scan_frames()
+        mode = "r+b" if os.path.isfile(location) else "wb"
+        self.file = open(location, mode)
+        self.file.seek(position)
+        self.file.truncate()
+        self.stream = self.file
+
+    def scan_members(self) -> int:
+        """Index the members of the (uncompressed) archive
+
+        Returns
+        -------
+        int
+            Offset at which the archive is cut
+        """
+        end = 0
+        file_size = os.path.getsize(self.location)
+
+        def members():
+            nonlocal end
+            with tarfile.open(self.location) as archive:
+                for member in archive:
+                    if member.offset_data + member.size > file_size:
+                        return
+                    yield (
+                        member.name,
+                        {"offset": member.offset_data, "size": member.size},
+                        lambda member=member: (
+                            archive.extractfile(member).read()
+                        ),
+                        member.offset,
+                    )
+                    blocks = -(-member.size // tarfile.BLOCKSIZE)
+                    end = member.offset_data + blocks * tarfile.BLOCKSIZE
+
+        try:
+            cut = self.index_members(members())
+        except tarfile.TarError as e:
+            self.logger.warning(f"Archive is incomplete ({e})")
+            cut = self.index_members(iter([]))
+        return end if cut is None else cut
+
+    def scan_frames(self) -> Tuple[int, int]:
+        """Index the members of the compressed archive, frame by frame
+
+        Frames are decompressed to find their ends, without keeping their
+        content (except that of the carried members).
+
+        Returns
+        -------
+        Tuple[int, int]
+            Position in the file and offset in the tar stream at which the
+            archive is cut
+        """
+        position = offset = 0
+
+        def members():
+            nonlocal position, offset
+            with open(self.location, "rb") as f:
+                while True:
+                    frame = self.read_frame(f)
+                    if frame is None:
+                        return
+                    member, content, compressed, length = frame
+                    yield (
+                        member.name,
+                        {
+                            "offset": offset + member.offset_data,
+                            "size": member.size,
+                            "frame": position,
+                        },
+                        lambda content=content: content,
+                        (position, offset),
+                    )
+                    position += compressed
+                    offset += length
+
+        try:
+            cut = self.index_members(members())
+        except tarfile.ReadError as e:
+            # the archive cannot be cut between members
+            previous = f"{self.location}.previous"
+            self.logger.warning(
+                f"Archive cannot be resumed ({e}), moved to '{previous}'"
+            )
+            os.replace(self.location, previous)
+            self.index.clear()
+            self.trailer.clear()
+            return 0, 0
+        return (position, offset) if cut is None else cut
+
+    @staticmethod
+    def read_frame(
+        f: BinaryIO,
+    ) -> Tuple[tarfile.TarInfo, bytes or None, int, int] or None:
+        """Read the next frame of a compressed archive
+
+        Returns
+        -------
+        Tuple[tarfile.TarInfo, bytes or None, int, int] or None
+            Member of the frame, its content (for members in TRAILER_NAMES),
+            and the compressed and uncompressed size of the frame,
+            None at the end of the archive or at an incomplete frame
+
+        Raises
+        ------
+        tarfile.ReadError
+            If the frame contains more than one member
+        """
+        import zstandard
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        buffer = bytearray()
+        member = None
+        consumed = length = 0
+        try:
+            while not decompressor.eof:
+                chunk = f.read(READ_SIZE)
+                if not chunk:
+                    return None
+                consumed += len(chunk)
+                data = decompressor.decompress(chunk)
+                length += len(data)
+                if member is None or member.name in TRAILER_NAMES:
+                    buffer += data
+                if member is None and (
+                    len(buffer) >= READ_SIZE or decompressor.eof
+                ):
+                    member = read_header(buffer)
+                    if member is None:
+                        return None
+        except zstandard.ZstdError:
+            return None
+        unused = len(decompressor.unused_data)
+        f.seek(-unused, os.SEEK_CUR)
+
+        blocks = -(-member.size // tarfile.BLOCKSIZE)
+        if length != member.offset_data + blocks * tarfile.BLOCKSIZE:
+            raise tarfile.ReadError("members are not in separate frames")
+        content = None
+        if member.name in TRAILER_NAMES:
+            content = bytes(
+                buffer[member.offset_data:member.offset_data + member.size]
+            )
+        return member, content, consumed - unused, length
+
+    def _write(self, data: bytes):
+        self.stream.write(data)
+        self.offset += len(data)
+
+    def _begin_frame(self):
+        """Compress the following writes into a new frame"""
+        if self.compressor is not None:
+            self.stream = self.compressor.stream_writer(
+                self.file, closefd=False
+            )
+
+    def _end_frame(self):
+        if self.stream is not self.file:
+            self.stream.close()
+            self.stream = self.file
+
+    @contextmanager
+    def open_member(self, name: str, size: int) -> Iterator[BinaryIO]:
+        position = self.file.tell()
+        start = self.offset
+        self._begin_frame()
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        self._write(info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape"))
+        offset = self.offset
+        writer = CountingWriter(self.stream, limit=size)
+        try:
+            yield writer
+            if writer.written != size:
+                raise IncompleteWrite(
+                    f"{writer.written}/{size} bytes of {name}"
+                )
+        except BaseException:
+            # the archive is cut before the failed member (and its frame)
+            self.logger.error(f"Member '{name}' is incomplete")
+            self.stream = self.file
+            self.file.seek(position)
+            self.file.truncate()
+            self.offset = start
+            raise
+        self.offset = offset + size
+        remainder = size % tarfile.BLOCKSIZE
+        if remainder:
+            self._write(bytes(tarfile.BLOCKSIZE - remainder))
+        self._end_frame()
+        self.index[name] = {
+            "offset": offset,
+            "size": size,
+            "sha256": writer.digest.hexdigest(),
+        }
+        if self.compressor is not None:
+            self.index[name]["frame"] = position
+
+    def finish(self):
+        self._begin_frame()
+        self._write(bytes(2 * tarfile.BLOCKSIZE))
+        remainder = self.offset % tarfile.RECORDSIZE
+        if remainder:
+            self._write(bytes(tarfile.RECORDSIZE - remainder))
+        self._end_frame()
+        self.file.close()
+
+# --------------------------------------------------------------------------- #
+
+
+class ZipStorage(ArchiveStorage):
+    def __init__(self, location: str):
+        """Zip archive, with members stored without compression
+
+        The members of an existing archive are kept, and appended to.
+        """
+        super().__init__(location)
+        mode = "w"
+        if os.path.isfile(location):
+            if zipfile.is_zipfile(location):
+                mode = "a"
+            else:
+                self.logger.warning(
+                    f"'{location}' is not a complete archive, replacing it"
+                )
+        self.archive = zipfile.ZipFile(
+            location, mode, compression=zipfile.ZIP_STORED, allowZip64=True
+        )
+        if mode == "a":
+            cut = self.index_members(
+                (
+                    info.filename,
+                    {"offset": info.header_offset, "size": info.file_size},
+                    lambda info=info: self.archive.read(info),
+                    info,
+                )
+                for info in sorted(
+                    self.archive.infolist(),
+                    key=lambda info: info.header_offset
+                )
+            )
+            if cut is not None:
+                self.discard(cut)
+
+    def discard(self, info: zipfile.ZipInfo):
+        """Cut the archive before a member"""
+        archive = self.archive
+        archive.filelist = [
+            other for other in archive.filelist
+            if other.header_offset < info.header_offset
+        ]
+        archive.NameToInfo = {
+            other.filename: other for other in archive.filelist
+        }
+        # members are written at (and the central directory after) start_dir
+        archive.start_dir = info.header_offset
+        archive.fp.seek(info.header_offset)
+        archive.fp.truncate()
+
+    @contextmanager
+    def open_member(self, name: str, size: int) -> Iterator[BinaryIO]:
+        info = zipfile.ZipInfo(name, time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_STORED
+        info.external_attr = 0o644 << 16
+        info.file_size = size
+        # a member that has changed (e.g., an html_text) is added again, and
+        # readers use the last one
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", "Duplicate name")
+            member = self.archive.open(
+                info, "w", force_zip64=size >= ZIP64_LIMIT
+            )
+        writer = CountingWriter(member, limit=size)
+        try:
+            with member:
+                yield writer
+                if writer.written != size:
+                    raise IncompleteWrite(
+                        f"{writer.written}/{size} bytes of {name}"
+                    )
+        except BaseException:
+            self.logger.error(f"Member '{name}' is incomplete")
+            self.discard(info)
+            raise
+        self.index[name] = {
+            "offset": info.header_offset,
+            "size": size,
+            "sha256": writer.digest.hexdigest(),
+        }
+
+    def finish(self):
+        self.archive.close()
+
+# --------------------------------------------------------------------------- #
+
+
+class PipeReader:
+    """Reading end of a pipe, as the body of a request of known length"""
+
+    def __init__(self, source: BinaryIO, size: int):
+        self.source = source
+        self.len = size
+        self.remaining = size
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.source.read(size) if size else b""
+        if size and not data:
+            raise IncompleteWrite(f"{self.remaining} bytes were not written")
+        self.remaining -= len(data)
+        return data
+
+    def __iter__(self):
+        while self.remaining:
+            yield self.read(1024 * 1024)
+
+    def close(self):
+        self.source.close()
+
+
+class ObjectStorage(Storage):
+    def __init__(self, location: str, session: requests.Session = None):
+        """Objects uploaded to an S3-compatible HTTP endpoint
+
+        Parameters
+        ----------
+        location : str
+            URL of the bucket (and prefix), e.g., http://localhost:9000/vyoma
+        session : requests.Session, optional
+            Session (or SessionPool) used for the uploads, whose requests
+            should have a timeout.
+            The default is None, which uses a pool of sessions with the
+            default timeouts.
+        """
+        super().__init__(location.rstrip("/"))
+        self.session = session or SessionPool(timeout=TIMEOUT)
+
+    def path(self, name: str) -> str:
+        return f"{self.location}/{quote(name)}"
+
+    def exists(self, name: str, size: int = None) -> bool:
+        try:
+            r = self.session.head(self.path(name))
+        except requests.RequestException:
+            return False
+        return r.ok and (
+            size is None or r.headers.get("Content-Length") == str(size)
+        )
+
+    @contextmanager
+    def open(self, name: str, size: int = None) -> Iterator[BinaryIO]:
+        """Open an object for writing
+
+        An object of known size is uploaded as it is written, through a
+        pipe. An object of unknown size is staged in a temporary file (in
+        memory while it is small), since the length of the upload must be
+        known, and uploaded once it is complete.
+        """
+        headers = {"Content-Type": "application/octet-stream"}
+        if size is None:
+            with tempfile.SpooledTemporaryFile(SPOOL_SIZE) as spool:
+                yield spool
+                headers["Content-Length"] = str(spool.tell())
+                spool.seek(0)
+                r = self.session.put(
+                    self.path(name), data=spool, headers=headers
+                )
+                r.raise_for_status()
+            return
+
+        read_fd, write_fd = os.pipe()
+        body = PipeReader(os.fdopen(read_fd, "rb"), size)
+        errors = []
+
+        def upload():
+            try:
+                r = self.session.put(
+                    self.path(name), data=body, headers=headers
+                )
+                r.raise_for_status()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                # a writer blocked on the pipe fails instead of waiting
+                body.close()
+
+        thread = threading.Thread(
+            target=upload, name=f"upload-{name}", daemon=True
+        )
+        thread.start()
+        try:
+            with os.fdopen(write_fd, "wb") as f:
+                writer = CountingWriter(f, limit=size)
+                yield writer
+        except BrokenPipeError:
+            thread.join()
+            if errors:
+                raise errors[0]
+            raise
+        finally:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def write(self, name: str, data: bytes):
+        r = self.session.put(self.path(name), data=io.BytesIO(data))
+        r.raise_for_status()
+
+###############################################################################
+
+
+def create_storage(
+    mode: str,
+    course_dir: str,
+    session: requests.Session = None,
+) -> Storage:
+    """Storage backend for a course
+
+    Parameters
+    ----------
+    mode : str
+        One of STORAGE_MODES, or the URL of an S3-compatible bucket
+    course_dir : str
+        Course directory, also used as the base path of archives
+    session : requests.Session, optional
+        Session (or SessionPool) used by object storage.
+        The default is None.
+    """
+    if mode.startswith(("http://", "https://")):
+        return ObjectStorage(
+            f"{mode.rstrip('/')}/{os.path.basename(course_dir)}", session
+        )
+    if mode == "dir":
+        return DirectoryStorage(course_dir)
+    if mode == "tar":
+        return TarStorage(f"{course_dir}.tar")
+    if mode == "tar.zst":
+        return TarStorage(f"{course_dir}.tar.zst", compression="zstd")
+    if mode == "zip":
+        return ZipStorage(f"{course_dir}.zip")
+    raise ValueError(f"Unknown storage '{mode}'")
+
+
+def read_index(path: str) -> Dict:
+    """Index of an archive written by TarStorage or ZipStorage"""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            return json.loads(archive.read(INDEX_NAME))
+    if path.endswith(".zst"):
+        import zstandard
+        with open(path, "rb") as f:
+            reader = zstandard.ZstdDecompressor().stream_reader(
+                f, read_across_frames=True
+            )
+            with tarfile.open(fileobj=reader, mode="r|") as archive:
+                for member in archive:
+                    if member.name == INDEX_NAME:
+                        return json.load(archive.extractfile(member))
+        return None
+    with tarfile.open(path) as archive:
+        return json.load(archive.extractfile(INDEX_NAME))
+
+
+def read_header(data: bytes) -> tarfile.TarInfo or None:
+    """First member of a tar stream, from (at least) its header blocks"""
+    try:
+        with tarfile.open(fileobj=io.BytesIO(data), mode="r|") as archive:
+            return archive.next()
+    except tarfile.TarError:
+        return None
+
+
+def read_member(path: str, name: str, index: Dict = None) -> bytes:
+    """Read a member of an archive, using its index
+
+    Parameters
+    ----------
+    path : str
+        Path of an archive written by TarStorage or ZipStorage
+    name : str
+        Name of the member
+    index : Dict, optional
+        Index of the archive.
+        The default is None, which reads the index from the archive.
+
+    Returns
+    -------
+    bytes
+        Content of the member
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            return archive.read(name)
+    member = (index or read_index(path))["members"][name]
+    with open(path, "rb") as f:
+        if "frame" not in member:
+            f.seek(member["offset"])
+            return f.read(member["size"])
+        # the frame of a member is a tar stream of that member
+        import zstandard
+        f.seek(member["frame"])
+        reader = zstandard.ZstdDecompressor().stream_reader(f)
+        with tarfile.open(fileobj=reader, mode="r|") as archive:
+            return archive.extractfile(archive.next()).read()
+
+###############################################################################
@@ -6,31 +6,71 @@ Vyoma Session
 @author: Hrishikesh Terdalkar
 """
 
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 import json
 import os
-from typing import Dict
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Tuple
+from urllib.parse import urlsplit
 
-from tqdm import tqdm
+import requests
 
-from .edmingle import EdmingleAPI
+from .catalog import CourseCatalog, CATALOG_FILE
+from .compression import (
+    COMPRESSION_SUFFIXES, DEFAULT_COMPRESSION, compress, read_compressed,
+    resolve_compression, zstd_available
+)
+from .downloader import LinkExpired, TransferStalled
+from .edmingle import EdmingleAPI, PROTOCOL
+from .expiry import URLCache
+from .linkcheck import LinkChecker
+from .pipeline import Pipeline
+from .progress import ProgressReporter, create_progress, worker_key
+from .records import MaterialRecord, MaterialResult, SectionRecord
+from .state import StateStore, STATE_FILE
+from .storage import DirectoryStorage, Storage, create_storage, LOG_NAME
 from .utils import pretty_name
-from .verbose_logger import install as install_logger
-
-###############################################################################
-
-install_logger()
 
 ###############################################################################
 
 VYOMA_HOSTNAME = "learn.sanskritfromhome.org"
 VYOMA_API_HOST = "vyoma-api.edmingle.com"
 
+HTML_DIR = "html"
+
+# number of times a stalled transfer is resumed
+STALL_RETRIES = 2
+
+# empty tag filter lists the masterbatches under every tag
+CATALOG_TAG_IDS = ""
+
+# threads that run the independent steps of the startup
+STARTUP_WORKERS = 8
+# maximum connections opened to a host ahead of the first requests
+WARM_CONNECTIONS = 4
+# file hosts of previous runs connected to on startup
+WARM_FILE_HOSTS = 2
+
 ###############################################################################
 
 
 class Vyoma(EdmingleAPI):
-    def __init__(self, username: str, password: str, download_dir: str = None):
+    def __init__(
+        self,
+        username: str,
+        password: str,
+        download_dir: str = None,
+        hostname: str = VYOMA_HOSTNAME,
+        api_host: str = VYOMA_API_HOST,
+        protocol: str = PROTOCOL,
+        html_compression: str = DEFAULT_COMPRESSION,
+        progress: str = "bar",
+        storage: str = "dir",
+        startup_workers: int = STARTUP_WORKERS,
+        **kwargs,
+    ):
         """
         Vyoma Session
 
@@ -43,28 +83,187 @@ class Vyoma(EdmingleAPI):
         download_dir : str, optional
             Location in which the course content will be downloaded.
             The default is None.
+        hostname : str, optional
+            Hostname of the Vyoma website.
+            The default is VYOMA_HOSTNAME.
+        api_host : str, optional
+            Hostname (and port) of the Edmingle API server.
+            The default is VYOMA_API_HOST.
+        protocol : str, optional
+            Protocol used to talk to the API server.
+            The default is PROTOCOL.
+        html_compression : str, optional
+            Compression of the saved html_text materials,
+            one of "none", "gzip" or "zstd".
+            The default is DEFAULT_COMPRESSION.
+        progress : str, optional
+            Progress display while downloading, one of "bar", "json" or
+            "none".
+            The default is "bar".
+        storage : str, optional
+            Storage of the course materials, one of "dir", "tar",
+            "tar.zst", "zip" or the URL of an S3-compatible bucket.
+            The default is "dir".
+        startup_workers : int, optional
+            Number of threads that run the independent startup steps
+            concurrently (see `start`). Use 1 to run them one after the
+            other.
+            The default is STARTUP_WORKERS.
+
+        Additional keyword arguments are passed to EdmingleAPI.
         """
 
         super().__init__(
             username=username,
             password=password,
-            hostname=VYOMA_HOSTNAME,
-            api_host=VYOMA_API_HOST,
+            hostname=hostname,
+            api_host=api_host,
+            protocol=protocol,
+            **kwargs,
         )
-        self.login()
+        self.html_compression = resolve_compression(html_compression)
+        self.progress_mode = progress
+        self.storage_mode = storage
+        if storage == "tar.zst" and not zstd_available():
+            self.logger.warning(
+                "zstandard is not installed, using an uncompressed tar."
+            )
+            self.storage_mode = "tar"
 
-        # download directory
-        self.download_dir = download_dir
+        # resolved file URLs, which may be signed and expire
+        self.urls = URLCache()
+        # origins of the file hosts already recorded in the state
+        self.file_hosts = set()
 
+        self.catalog_refresh = None
+        self.startup_timings = {}
+        self.start(download_dir, workers=startup_workers)
+
+    def start(self, download_dir: str = None, workers: int = STARTUP_WORKERS):
+        """Sign-in and load the local state, overlapping independent steps
+
+        * The sign-in (login and usermeta) and the warm-up of connections to
+          the API host run concurrently.
+        * The local state is loaded during the sign-in if the download
+          directory is known, and after it otherwise (the default directory
+          depends on the username).
+        * Connections to the file hosts of previous runs are warmed up, and
+          a stale course catalog is refreshed, in the background.
+
+        The duration of every step is recorded in `startup_timings`.
+
+        Parameters
+        ----------
+        download_dir : str, optional
+            Location in which the course content will be downloaded.
+            The default is None.
+        workers : int, optional
+            Number of threads that run the steps. With a single thread, the
+            steps run one after the other, without warm-ups.
+            The default is STARTUP_WORKERS.
+        """
+        parallel = workers > 1
+        executor = ThreadPoolExecutor(
+            max_workers=max(workers, 1), thread_name_prefix="startup"
+        )
+
+        def submit(name: str, func, *args) -> Future:
+            def timed():
+                start = time.perf_counter()
+                try:
+                    return func(*args)
+                finally:
+                    self.startup_timings[name] = time.perf_counter() - start
+            return executor.submit(timed)
+
+        try:
+            signed_in = submit("login", self.login)
+            local = None
+            if download_dir:
+                local = submit(
+                    "local_state", self.load_local_state, download_dir
+                )
+            if parallel:
+                # curriculum and metadata requests
+                warm_connections = min(self.max_workers + 1, WARM_CONNECTIONS)
+                for _ in range(warm_connections):
+                    executor.submit(self.warm_up, self.api_endpoint)
+            signed_in.result()
+            if local is None:
+                local = submit("local_state", self.load_local_state, None)
+            local.result()
+
+            if parallel:
+                # transfers
+                warm_connections = min(self.max_workers, WARM_CONNECTIONS)
+                # hosts of previous runs, without creating a state
+                hosts = []
+                if os.path.isfile(self.state_path):
+                    hosts = self.state.recent_hosts("files", WARM_FILE_HOSTS)
+                for origin in hosts:
+                    for _ in range(warm_connections):
+                        executor.submit(self.warm_up, origin)
+                if self.logged_in and self.catalog.stale:
+                    self.catalog_refresh = submit(
+                        "catalog", self.refresh_catalog
+                    )
+        finally:
+            executor.shutdown(wait=False)
+
+    def load_local_state(self, download_dir: str = None):
+        """Locate the download directory and load its course catalog
+
+        The directory and its state store are only created when they are
+        first used (see `state`), e.g., not while planning a download.
+        """
+        self.download_dir = download_dir
         if not download_dir:
             home_dir = os.path.expanduser("~")
-            vyoma_dir = os.path.join(home_dir, "vyoma", self.user["username"])
-            self.download_dir = vyoma_dir
-        if not os.path.isdir(self.download_dir):
-            os.makedirs(self.download_dir)
+            username = self.user.get("username", self.username)
+            self.download_dir = os.path.join(home_dir, "vyoma", username)
+
+        # download state
+        self.state_path = os.path.join(self.download_dir, STATE_FILE)
+        self.state_lock = threading.Lock()
+        self._state = None
+        self._link_checker = None
+        self.catalog = CourseCatalog(
+            os.path.join(self.download_dir, CATALOG_FILE)
+        )
+
+    def create_download_dir(self):
+        """Create the download directory, caching the catalog in it"""
+        if os.path.isdir(self.download_dir):
+            return
+        os.makedirs(self.download_dir, exist_ok=True)
+        # not saved while the directory did not exist
+        if self.catalog.courses:
+            self.catalog.save()
+
+    @property
+    def state(self) -> StateStore:
+        """Download state, created in the download directory on first use"""
+        with self.state_lock:
+            if self._state is None:
+                self.create_download_dir()
+                self._state = StateStore(self.state_path)
+            return self._state
+
+    @property
+    def link_checker(self) -> LinkChecker:
+        """Link checker, which caches its results in the download state"""
+        state = self.state
+        with self.state_lock:
+            if self._link_checker is None:
+                self._link_checker = LinkChecker(self.session, state)
+            return self._link_checker
 
-    def find_course(self, search_pattern: str) -> str:
-        response = self.get_courses(search_pattern=search_pattern)
+    def fetch_courses(
+        self, search_pattern: str = "", tag_ids: str = "9"
+    ) -> List[Dict]:
+        response = self.get_courses(
+            search_pattern=search_pattern, tag_ids=tag_ids
+        )
         courses = []
         for batch in response.get("batches", []):
             if batch.get("master_batch_id"):
@@ -75,6 +274,95 @@ class Vyoma(EdmingleAPI):
                 })
         return courses
 
+    def refresh_catalog(self) -> bool:
+        """Fetch all the courses and update the local catalog
+
+        Returns
+        -------
+        bool
+            Indicates whether the catalog was refreshed
+        """
+        try:
+            courses = self.fetch_courses(tag_ids=CATALOG_TAG_IDS)
+        except (requests.RequestException, ValueError) as e:
+            self.logger.warning(f"Could not refresh the course catalog: {e}")
+            return False
+        if courses:
+            self.catalog.update(courses)
+        return bool(courses)
+
+    def load_catalog(self, refresh: bool = False) -> bool:
+        """Wait for the catalog, refreshing it if requested or stale
+
+        Parameters
+        ----------
+        refresh : bool, optional
+            If true, the catalog is refreshed even if it is recent.
+            The default is False.
+
+        Returns
+        -------
+        bool
+            Indicates whether the catalog was refreshed
+        """
+        pending, self.catalog_refresh = self.catalog_refresh, None
+        if pending is not None:
+            # refreshed in the background since the startup
+            return pending.result()
+        if refresh or self.catalog.stale:
+            return self.refresh_catalog()
+        return False
+
+    def find_course(
+        self, search_pattern: str, refresh: bool = False
+    ) -> List[Dict]:
+        """Find courses matching a pattern
+
+        Courses are searched in the local catalog, which is refreshed from
+        the server if requested or stale. The server is searched only if the
+        catalog has no match.
+
+        Parameters
+        ----------
+        search_pattern : str
+            Pattern to match against the course name or tutor
+        refresh : bool, optional
+            If true, the catalog is refreshed before searching.
+            The default is False.
+
+        Returns
+        -------
+        List[Dict]
+            Matching courses, best matches first
+        """
+        self.load_catalog(refresh=refresh)
+        courses = self.catalog.search(search_pattern)
+        if courses:
+            return courses
+
+        try:
+            return self.fetch_courses(search_pattern=search_pattern)
+        except (requests.RequestException, ValueError) as e:
+            self.logger.warning(f"Could not search the server: {e}")
+            return []
+
+    def get_course_details(self, course_id: str) -> Dict:
+        """Fetch details of a course along with its local path"""
+        c_response = self.get_course_classes(course_id)
+        course = c_response["courses"][0]
+        class_name = course["class_name"]
+        class_name_pretty = pretty_name(class_name)
+        return {
+            "course_id": course_id,
+            "class_id": course["class_id"],
+            "class_name": class_name,
+            "class_name_pretty": class_name_pretty,
+            "tutor_name": course["tutor_name"],
+            "num_exercises": course["stats"]["course_num_exercises"],
+            "num_materials": course["stats"]["course_num_materials"],
+            "local_path": os.path.join(self.download_dir, class_name_pretty)
+        }
+
     def download_section(self, class_id: str, section_id: str) -> Dict:
         raise NotImplementedError
 
@@ -97,33 +385,87 @@ class Vyoma(EdmingleAPI):
         Dict
             Complete download log
         """
-        c_response = self.get_course_classes(course_id)
-        course = c_response["courses"][0]
-        class_id = course["class_id"]
-        class_name = course["class_name"]
-        class_name_pretty = pretty_name(class_name)
-        tutor_name = course["tutor_name"]
-        print(f"Course: {class_name}")
-        print(f"Teacher: {tutor_name}")
-        course_dir = os.path.join(self.download_dir, class_name_pretty)
-        if not os.path.isdir(course_dir):
-            os.makedirs(course_dir)
+        course_log = self.get_course_details(course_id)
+        print(f"Course: {course_log['class_name']}")
+        print(f"Teacher: {course_log['tutor_name']}")
+        storage = self.get_storage(course_log)
+        course_log["local_path"] = storage.location
+        self.state.update_course(course_log)
 
-        cr_response = self.get_class_resources(class_id)
-        course_sections = cr_response["sections"]
+        # a progress reporter shared by several accounts is closed by its owner
+        if self.shared is not None and self.shared.progress is not None:
+            progress = self.shared.progress
+        else:
+            progress = create_progress(self.progress_mode, self.max_workers)
+        progress.add_metrics(
+            self.metrics_name("concurrency"), self.concurrency_metrics
+        )
+        sections = []
+        results = []
+        try:
+            for item in self.iter_pipeline(
+                course_id, course_log=course_log, progress=progress,
+                storage=storage
+            ):
+                if isinstance(item, SectionRecord):
+                    sections.append(item)
+                    self.state.update_section(
+                        course_id, item.log_entry(), item.position
+                    )
+                    print(f"Downloading from '{item.name}' ...")
+                else:
+                    results.append(item)
 
-        # logs
-        course_log = {
-            "course_id": course_id,
-            "class_id": class_id,
-            "class_name": class_name,
-            "class_name_pretty": class_name_pretty,
-            "tutor_name": tutor_name,
-            "num_exercises": course["stats"]["course_num_exercises"],
-            "num_materials": course["stats"]["course_num_materials"],
-            "local_path": course_dir
-        }
-        section_log = []
+            # results complete out of order, the log follows the curriculum
+            sections.sort(key=lambda section: section.position)
+            section_log = [section.log_entry() for section in sections]
+            section_positions = {
+                section.section_id: section.position for section in sections
+            }
+            results.sort(key=lambda result: (
+                section_positions[result.record.section_id],
+                result.record.position
+            ))
+            material_log = self.material_log(
+                (item.status, item.entry) for item in results
+            )
+            if progress is not getattr(self.shared, "progress", None):
+                progress.close()
+
+            download_log = {
+                "course": course_log,
+                "section": section_log,
+                "material": material_log
+            }
+            storage.write(
+                LOG_NAME,
+                json.dumps(
+                    download_log, indent=2, ensure_ascii=False
+                ).encode("utf-8")
+            )
+        finally:
+            storage.close()
+
+        material_count = {}
+        for k, v in material_log.items():
+            if isinstance(v, dict):
+                material_count[k] = {}
+                for k1, v1 in v.items():
+                    material_count[k][k1] = len(v1)
+            if isinstance(v, list):
+                material_count[k] = len(v)
+
+        print("material:", json.dumps(material_count, indent=2))
+        return download_log
+
+    def metrics_name(self, name: str) -> str:
+        """Name of metrics in a progress reporter shared by several accounts"""
+        if self.shared is None:
+            return name
+        return f"{name}:{self.username}"
+
+    def material_log(self, results: Iterable[Tuple[str, Dict]]) -> Dict:
+        """Arrange (status, entry) pairs of materials as in the download log"""
         material_log = {
             "file": defaultdict(list),
             "external_url": defaultdict(list),
@@ -131,113 +473,877 @@ class Vyoma(EdmingleAPI):
             "failed": [],
             "unknown": []
         }
-        print(f"Found {len(course_sections)} sections.")
+        for status, entry in results:
+            if status == "failed":
+                material_log["failed"].append(entry)
+            elif status == "unknown":
+                material_log["unknown"].append(entry)
+            elif entry["source"] == "html_text":
+                material_log["html_text"].append(entry)
+            else:
+                material_log[entry["source"]][entry["type"]].append(entry)
+        return material_log
+
+    def write_state_log(self, course_id: str) -> Dict or None:
+        """Write the download log of a course from the state store
+
+        Used when the materials of a course are fetched outside of
+        `download_course` (e.g., by queue workers). Materials that were
+        never fetched are logged as failed.
+
+        Returns
+        -------
+        Dict or None
+            Download log, None if the course is not known
+        """
+        course_log = self.state.get_course(course_id)
+        if course_log is None:
+            return None
+        course_log.pop("updated_at")
+        section_log = [
+            {
+                "id": section["section_id"],
+                "name": section["name"],
+                "num_materials": section["num_materials"]
+            }
+            for section in self.state.get_sections(course_id)
+        ]
+        results = []
+        for row in self.state.get_materials(course_id):
+            entry = {
+                "section_id": row.pop("section_id"),
+                "id": row.pop("material_id"),
+                "name": row.pop("name"),
+                "type": row.pop("type"),
+                "source": row.pop("source")
+            }
+            status = row.pop("status")
+            for key in ["course_id", "updated_at"]:
+                row.pop(key)
+            entry.update(
+                (key, value) for key, value in row.items()
+                if value is not None
+            )
+            if status == "pending":
+                status = "failed"
+                entry.setdefault("error", "Material was not fetched")
+            results.append((status, entry))
+
+        download_log = {
+            "course": course_log,
+            "section": section_log,
+            "material": self.material_log(results)
+        }
+        DirectoryStorage(course_log["local_path"]).write(
+            "log.json",
+            json.dumps(download_log, indent=2, ensure_ascii=False).encode(
+                "utf-8"
+            )
+        )
+        return download_log
+
+    def iter_materials(
+        self,
+        course_id: str,
+        resolve: bool = True,
+        course_log: Dict = None,
+    ) -> Iterator[SectionRecord or MaterialRecord]:
+        """Walk the curriculum of a course lazily
 
-        for section_details in course_sections:
+        Every section is yielded as a SectionRecord, followed by its
+        materials as MaterialRecord. Sections and materials are fetched
+        only when the generator reaches them.
+
+        A material that appears again (with the same ID, or the same file
+        URL) is yielded with `primary` set to its first record, and is not
+        fetched again.
+
+        Parameters
+        ----------
+        course_id : str
+            Course ID from Vyoma Edmingle Platform
+        resolve : bool, optional
+            If true, the details of every material (URL, file name, text)
+            are fetched before it is yielded.
+            The default is True.
+        course_log : Dict, optional
+            Course details, if they have already been fetched.
+            The default is None.
+
+        Yields
+        ------
+        SectionRecord or MaterialRecord
+            Records in curriculum order
+        """
+        if course_log is None:
+            course_log = self.get_course_details(course_id)
+        class_id = course_log["class_id"]
+        course_dir = course_log["local_path"]
+
+        # first record of every material ID and file URL
+        seen = {}
+        cr_response = self.get_class_resources(class_id)
+        for position, section_details in enumerate(cr_response["sections"]):
             section_id = section_details[0]
             sr_response = self.get_section_resources(class_id, section_id)
-
             section = sr_response["section"]
-            section_name = section["name"]
             section_resources = sr_response["resources"]
-            section_log.append({
-                "id": section_id,
-                "name": section_name,
-                "num_materials": section["num_materials"]
-            })
-            print(f"Downloading from '{section_name}' ...")
-
-            for section_resource in tqdm(section_resources):
-                material_id = section_resource[1]
-                material_name = section_resource[3]
-                material_type = section_resource[4]
-                material_source = section_resource[-3]
-
-                m_response = self.get_material(class_id, material_id)
-                success_message = "Teaching material retrieved successfully"
-                if m_response["message"] != success_message:
-                    material_log["failed"].append({
-                        "section_id": section_id,
-                        "id": material_id,
-                        "name": material_name,
-                        "type": material_type,
-                        "source": material_source,
-                        "response": m_response
-                    })
-                    continue
+            yield SectionRecord(
+                course_id=course_id,
+                class_id=class_id,
+                section_id=section_id,
+                position=position,
+                name=section["name"],
+                num_materials=section["num_materials"],
+                num_resources=len(section_resources),
+            )
+
+            for idx, section_resource in enumerate(section_resources):
+                record = MaterialRecord(
+                    course_id=course_id,
+                    class_id=class_id,
+                    section_id=section_id,
+                    material_id=section_resource[1],
+                    position=idx,
+                    name=section_resource[3],
+                    type=section_resource[4],
+                    source=section_resource[-3],
+                    course_dir=course_dir,
+                )
+                primary = seen.setdefault(("id", record.material_id), record)
+                if primary is not record:
+                    # the first record may itself be a duplicate (by URL)
+                    record.primary = primary.primary or primary
+                    if resolve:
+                        record.resolve_from(primary)
+                elif resolve:
+                    self.resolve_material(record)
+                    if record.source == "file" and record.url:
+                        primary = seen.setdefault(("url", record.url), record)
+                        if primary is not record:
+                            record.primary = primary
+                yield record
+
+    def resolve_material(self, record: MaterialRecord):
+        """Fetch the details of a material into its record
+
+        A material whose details cannot be fetched is marked with an error,
+        without affecting the other materials.
+        """
+        try:
+            m_response = self.get_material(
+                record.class_id, record.material_id
+            )
+        except (requests.RequestException, ValueError) as e:
+            self.logger.warning(
+                f"Could not fetch the details of '{record.name}': {e}"
+            )
+            record.error = {"message": f"{type(e).__name__}: {e}"}
+            return
+        success_message = "Teaching material retrieved successfully"
+        if m_response.get("message") != success_message:
+            record.error = m_response
+            return
+
+        record.error = None
+        material = m_response["material"]
+        record.material = material
+        if record.source == "file":
+            record.url = material["url"]
+            self.urls.put(record.material_id, record.url)
+            record.filename = material["file_name"]
+            record.local_path = os.path.join(
+                record.course_dir, record.filename
+            )
+        elif record.source == "external_url":
+            record.url = material["external_url"]
+        elif record.source == "html_text":
+            record.html_text = material["html_text"]
+
+    def download_materials(
+        self,
+        records: Iterable,
+        max_workers: int = 1,
+        progress: ProgressReporter = None,
+        storage: Storage = None,
+    ) -> Iterator[SectionRecord or MaterialResult]:
+        """Download a stream of material records
+
+        Records are consumed lazily, with at most `2 * max_workers` of them
+        in flight. Section records are passed through, so the output
+        follows the order of the input. Records of a material that has
+        already been consumed (with `primary` set) are not downloaded again,
+        and share the result of the first record.
+
+        Parameters
+        ----------
+        records : Iterable
+            MaterialRecord (and optionally SectionRecord) objects,
+            e.g., from `iter_materials`
+        max_workers : int, optional
+            Maximum number of materials downloaded in parallel. The number
+            of concurrent transfers adapts to the server, up to the
+            `max_workers` of the session.
+            The default is 1.
+        progress : ProgressReporter, optional
+            Progress reporter.
+            The default is None.
+        storage : Storage, optional
+            Storage backend of the materials.
+            The default is None, which stores files in the course directory.
 
-                material = m_response["material"]
-                if material_source == "file":
-                    material_url = material["url"]
-                    material_filename = material["file_name"]
-                    material_path = os.path.join(course_dir, material_filename)
-                    self.download_material(material_url, material_path)
-                    material_log[material_source][material_type].append({
-                        "section_id": section_id,
-                        "id": material_id,
-                        "name": material_name,
-                        "type": material_type,
-                        "filename": material_filename,
-                        "local_path": material_path
-                    })
-                elif material_source == "external_url":
-                    material_url = material["external_url"]
-                    material_log[material_source][material_type].append({
-                        "section_id": section_id,
-                        "id": material_id,
-                        "name": material_name,
-                        "type": material_type,
-                        "external_url": material_url
-                    })
-                elif material_source == "html_text":
-                    material_log[material_source].append({
-                        "section_id": section_id,
-                        "id": material_id,
-                        "name": material_name,
-                        "type": material_type,
-                        "html": material["html_text"]
-                    })
+        Yields
+        ------
+        SectionRecord or MaterialResult
+            Section records and the result of every material
+        """
+        if progress is None:
+            progress = ProgressReporter()
+
+        def fetch(record: MaterialRecord) -> MaterialResult:
+            progress.start(record.name)
+            result = self.fetch_material(record, progress, storage)
+            progress.finish(result.status != "failed")
+            return result
+
+        def duplicate(record: MaterialRecord, result: MaterialResult):
+            progress.finish(result.status != "failed")
+            return self._duplicate_result(record, result)
+
+        # result (or future) of every record that may be referenced again
+        results = {}
+
+        if max_workers <= 1:
+            for record in records:
+                if isinstance(record, SectionRecord):
+                    progress.add_files(record.num_resources)
+                    yield record
+                elif id(record.primary) in results:
+                    # later duplicates may refer to this record
+                    results[id(record)] = results[id(record.primary)]
+                    yield duplicate(record, results[id(record)])
                 else:
-                    material_log["unknown"].append({
-                        "section_id": section_id,
-                        "id": material_id,
-                        "name": material_name,
-                        "type": material_type,
-                        "source": material_source,
-                        "material": material
-                    })
+                    results[id(record)] = fetch(record)
+                    yield results[id(record)]
+            return
 
-        download_log = {
+        def result_of(item: SectionRecord or Future or tuple):
+            if isinstance(item, tuple):
+                record, future = item
+                return duplicate(record, future.result())
+            return item.result() if isinstance(item, Future) else item
+
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for record in records:
+                if isinstance(record, SectionRecord):
+                    progress.add_files(record.num_resources)
+                    pending.append(record)
+                elif id(record.primary) in results:
+                    results[id(record)] = results[id(record.primary)]
+                    pending.append((record, results[id(record)]))
+                else:
+                    results[id(record)] = executor.submit(fetch, record)
+                    pending.append(results[id(record)])
+                while len(pending) > 2 * max_workers:
+                    yield result_of(pending.popleft())
+            while pending:
+                yield result_of(pending.popleft())
+
+    def iter_pipeline(
+        self,
+        course_id: str,
+        course_log: Dict = None,
+        progress: ProgressReporter = None,
+        storage: Storage = None,
+        metadata_workers: int = None,
+        transfer_workers: int = None,
+        queue_size: int = None,
+    ) -> Iterator[SectionRecord or MaterialResult]:
+        """Download a course with overlapping stages
+
+        The curriculum is walked by one thread, material details are
+        fetched by `metadata_workers` threads and materials are downloaded
+        by `transfer_workers` threads. Stages are connected by queues of
+        `queue_size` items, so that the number of records in flight is
+        bounded. Results are yielded to the caller (the last stage) as they
+        complete, and not in curriculum order.
+
+        Parameters
+        ----------
+        course_id : str
+            Course ID from Vyoma Edmingle Platform
+        course_log : Dict, optional
+            Course details, if they have already been fetched.
+            The default is None.
+        progress : ProgressReporter, optional
+            Progress reporter.
+            The default is None.
+        storage : Storage, optional
+            Storage backend of the materials.
+            The default is None, which stores files in the course directory.
+        metadata_workers : int, optional
+            Number of threads that fetch material details.
+            The default is None, which uses `max_workers` of the session.
+        transfer_workers : int, optional
+            Number of threads that download materials, which is 1 for a
+            storage that writes one object at a time (an archive).
+            The default is None, which uses `max_workers` of the session.
+        queue_size : int, optional
+            Capacity of the queues between the stages.
+            The default is None, which uses twice the number of workers.
+
+        Yields
+        ------
+        SectionRecord or MaterialResult
+            Section records and the result of every material
+        """
+        metadata_workers = metadata_workers or self.max_workers
+        transfer_workers = transfer_workers or self.max_workers
+        if storage is not None and not storage.concurrent:
+            # transfers would wait for the storage with their responses open
+            transfer_workers = 1
+        queue_size = queue_size or 2 * max(metadata_workers, transfer_workers)
+        if progress is None:
+            progress = ProgressReporter()
+
+        # first record of every file URL
+        urls = {}
+        lock = threading.Lock()
+
+        def curriculum():
+            for record in self.iter_materials(
+                course_id, resolve=False, course_log=course_log
+            ):
+                if isinstance(record, SectionRecord):
+                    progress.add_files(record.num_resources)
+                yield record
+
+        def resolve(item):
+            if isinstance(item, MaterialRecord) and item.primary is None:
+                self.resolve_material(item)
+                if item.source == "file" and item.url:
+                    with lock:
+                        primary = urls.setdefault(item.url, item)
+                    if primary is not item:
+                        item.primary = primary
+            return item
+
+        def transfer(item):
+            if not isinstance(item, MaterialRecord) or item.primary:
+                return item
+            progress.start(item.name)
+            result = self.fetch_material(item, progress, storage)
+            progress.finish(result.status != "failed")
+            return result
+
+        def duplicate(record: MaterialRecord, result: MaterialResult):
+            record.resolve_from(result.record)
+            progress.finish(result.status != "failed")
+            return self._duplicate_result(record, result)
+
+        pipeline = Pipeline(curriculum(), queue_size=queue_size)
+        pipeline.add_stage("metadata", resolve, metadata_workers)
+        pipeline.add_stage("transfer", transfer, transfer_workers)
+        progress.add_metrics(self.metrics_name("pipeline"), pipeline.metrics)
+
+        # duplicates wait for the result of their primary record, which may
+        # itself be a duplicate (e.g., an ID duplicate of a URL duplicate)
+        results = {}
+        waiting = defaultdict(list)
+        for item in pipeline:
+            if isinstance(item, MaterialResult):
+                settled = [(item.record, item)]
+                yield item
+            elif isinstance(item, MaterialRecord):
+                result = results.get(id(item.primary))
+                if result is None:
+                    waiting[id(item.primary)].append(item)
+                    continue
+                settled = [(item, result)]
+                yield duplicate(item, result)
+            else:
+                yield item
+                continue
+            while settled:
+                record, result = settled.pop()
+                results[id(record)] = result
+                for other in waiting.pop(id(record), []):
+                    yield duplicate(other, result)
+                    settled.append((other, result))
+
+        # records whose primary never completed are fetched on their own
+        for records in waiting.values():
+            for record in records:
+                self.logger.warning(
+                    f"No result for the primary of '{record.name}', "
+                    "fetching it separately"
+                )
+                record.primary = None
+                yield transfer(record)
+
+    def _duplicate_result(
+        self,
+        record: MaterialRecord,
+        result: MaterialResult,
+    ) -> MaterialResult:
+        """Result of a record that refers to an already fetched material"""
+        entry = dict(result.entry)
+        entry.update(record.log_entry())
+        entry["duplicate_of"] = {
+            "section_id": result.record.section_id,
+            "id": result.record.material_id,
+        }
+        if record.material_id != result.record.material_id:
+            self.state.update_material(record.course_id, entry, result.status)
+        return MaterialResult(record, result.status, entry)
+
+    def refresh_url(self, record: MaterialRecord, force: bool = False) -> bool:
+        """Make sure that the URL of a file material is usable
+
+        The URL is resolved again if it expires within the margin of the
+        URL cache, or if `force` is true (e.g., after it was rejected).
+
+        Parameters
+        ----------
+        record : MaterialRecord
+            Resolved file material record
+        force : bool, optional
+            If true, the URL is resolved again irrespective of its expiry.
+            The default is False.
+
+        Returns
+        -------
+        bool
+            True if the record has a usable URL, False if it could not be
+            resolved (the reason is in `record.error`)
+        """
+        key = record.material_id
+        if not force:
+            if record.url and key not in self.urls:
+                self.urls.put(key, record.url)
+            url = self.urls.get(key)
+            if url is not None:
+                record.url = url
+                return True
+            self.logger.info(
+                f"URL of '{record.filename}' has expired, resolving it again"
+            )
+        self.urls.invalidate(key)
+        self.resolve_material(record)
+        return record.resolved and bool(record.url)
+
+    def fetch_material(
+        self,
+        record: MaterialRecord,
+        progress: ProgressReporter = None,
+        storage: Storage = None,
+    ) -> MaterialResult:
+        """Download (or save) a single material and record its state
+
+        Parameters
+        ----------
+        record : MaterialRecord
+            Resolved material record
+        progress : ProgressReporter, optional
+            Progress reporter, for the bytes of file materials.
+            The default is None.
+        storage : Storage, optional
+            Storage backend of the material.
+            The default is None, which stores files in the course directory.
+
+        Returns
+        -------
+        MaterialResult
+            Status and download log entry of the material
+        """
+        if progress is None:
+            progress = ProgressReporter()
+        if storage is None:
+            storage = DirectoryStorage(record.course_dir)
+        course_id = record.course_id
+        material_entry = record.log_entry()
+
+        if record.material is None and record.resolved:
+            self.resolve_material(record)
+        if not record.resolved:
+            material_entry["response"] = record.error
+            self.state.update_material(course_id, material_entry, "failed")
+            return MaterialResult(record, "failed", material_entry)
+
+        if record.source == "file":
+            material_path = storage.path(record.filename)
+            material_entry.update({
+                "filename": record.filename,
+                "local_path": material_path
+            })
+            if self.is_downloaded(course_id, record.material_id, storage):
+                self.logger.info(
+                    f"File '{record.filename}' is already downloaded!"
+                )
+                stored = self.state.get_material(course_id, record.material_id)
+                material_entry["size"] = stored["size"]
+                progress.set_size(
+                    material_entry["size"], material_entry["size"]
+                )
+                return MaterialResult(record, "complete", material_entry)
+
+            attempt = {"started_at": time.time()}
+            result = None
+            stalls = 0
+            refreshed = False
+            usable = self.refresh_url(record)
+            while usable:
+                try:
+                    result = self._transfer(record, storage, progress)
+                    break
+                except TransferStalled as e:
+                    attempt["error"] = str(e)
+                    if stalls == STALL_RETRIES:
+                        break
+                    stalls += 1
+                    self.logger.warning(
+                        f"{e}: resuming '{record.filename}' "
+                        f"({stalls}/{STALL_RETRIES})"
+                    )
+                except LinkExpired as e:
+                    attempt["error"] = str(e)
+                    if refreshed:
+                        break
+                    # the URL is resolved again once, keeping the progress
+                    refreshed = True
+                    self.logger.warning(
+                        f"{e}: resolving the URL of '{record.filename}' again"
+                    )
+                    usable = self.refresh_url(record, force=True)
+                except (requests.RequestException, OSError) as e:
+                    attempt["error"] = str(e)
+                    break
+            if not usable:
+                # e.g., the details could not be fetched again after the
+                # URL was rejected
+                reason = (record.error or {}).get("message")
+                attempt["error"] = "URL could not be resolved" + (
+                    f": {reason}" if reason else ""
+                )
+            attempt["finished_at"] = time.time()
+
+            if result is not None:
+                self.record_file_host(record.url)
+                material_entry["size"] = result
+                attempt["bytes"] = material_entry["size"]
+                status = "complete"
+            else:
+                attempt.setdefault("error", "Download failed")
+                material_entry["error"] = attempt["error"]
+                status = "failed"
+            self.state.update_material(
+                course_id, material_entry, status, attempt
+            )
+            return MaterialResult(record, status, material_entry)
+
+        if record.source == "external_url":
+            material_entry["external_url"] = record.url
+            status = "complete"
+        elif record.source == "html_text":
+            material_entry.update(
+                self.save_html(storage, record.material_id, record.html_text)
+            )
+            status = "complete"
+        else:
+            material_entry["material"] = record.material
+            status = "unknown"
+        self.state.update_material(course_id, material_entry, status)
+        return MaterialResult(record, status, material_entry)
+
+    def record_file_host(self, url: str):
+        """Remember the host of a file, to connect to it on startup"""
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        if origin not in self.file_hosts:
+            self.file_hosts.add(origin)
+            self.state.update_host(origin, "files")
+
+    def _transfer(
+        self,
+        record: MaterialRecord,
+        storage: Storage,
+        progress: ProgressReporter,
+    ) -> int or None:
+        """Download a file material, returning its size"""
+        material_path = storage.path(record.filename)
+        # segments report their bytes from other threads
+        worker = worker_key()
+
+        def advance(num_bytes: int):
+            progress.advance(num_bytes, worker=worker)
+
+        def set_size(size: int or None, present: int = 0):
+            progress.set_size(size, present, worker=worker)
+
+        if storage.resumable:
+            result = self.download_material(
+                record.url, material_path,
+                callback=advance,
+                on_size=set_size
+            )
+            if result and os.path.isfile(material_path):
+                result = os.path.getsize(material_path)
+            return result
+        return self.stream_material(
+            record.url,
+            lambda size: storage.open(record.filename, size),
+            callback=advance,
+            on_size=set_size
+        )
+
+    def plan_course(
+        self,
+        course_id: str,
+        max_workers: int = 8,
+        probe_size: int = 1024 * 1024,
+    ) -> Dict:
+        """Estimate the size and duration of a course download
+
+        Nothing is written to the disk. The complete curriculum is resolved,
+        material metadata is fetched and the sizes of files are obtained
+        using parallel HEAD requests. Throughput is measured by reading the
+        first `probe_size` bytes of the largest pending file. Materials
+        that appear in several sections are counted once.
+
+        Parameters
+        ----------
+        course_id : str
+            Course ID from Vyoma Edmingle Platform
+        max_workers : int, optional
+            Number of parallel requests.
+            The default is 8.
+        probe_size : int, optional
+            Number of bytes to read while measuring the throughput.
+            The default is 1 MiB.
+
+        Returns
+        -------
+        Dict
+            Download plan containing total, present and pending bytes,
+            per-type breakdown, measured throughput and ETA
+        """
+        course_log = self.get_course_details(course_id)
+        records = [
+            record
+            for record in self.iter_materials(
+                course_id, resolve=False, course_log=course_log
+            )
+            if isinstance(record, MaterialRecord)
+        ]
+        resources = [record for record in records if record.primary is None]
+
+        def fetch(record: MaterialRecord):
+            entry = record.log_entry()
+            entry.update({"size": None, "present": 0})
+            self.resolve_material(record)
+            if not record.resolved:
+                entry["source"] = "failed"
+                return entry
+            if record.source == "file":
+                entry["url"] = record.url
+                entry["local_path"] = record.local_path
+                entry["size"] = self.get_material_size(entry["url"])["size"]
+                if os.path.isfile(entry["local_path"]):
+                    entry["present"] = os.path.getsize(entry["local_path"])
+                    if entry["size"] is not None:
+                        entry["present"] = min(entry["present"], entry["size"])
+            return entry
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            materials = list(executor.map(fetch, resources))
+
+        by_type = defaultdict(lambda: {
+            "count": 0, "bytes": 0, "present_bytes": 0, "unknown_size": 0
+        })
+        for entry in materials:
+            stats = by_type[f"{entry['source']}/{entry['type']}"]
+            stats["count"] += 1
+            stats["present_bytes"] += entry["present"]
+            if entry["size"] is None:
+                stats["unknown_size"] += entry["source"] == "file"
+            else:
+                stats["bytes"] += entry["size"]
+
+        files = [entry for entry in materials if entry["source"] == "file"]
+        total_bytes = sum(entry["size"] or 0 for entry in files)
+        present_bytes = sum(entry["present"] for entry in files)
+        pending = [
+            entry for entry in files
+            if entry["size"] is None or entry["present"] < entry["size"]
+        ]
+
+        throughput = None
+        if pending:
+            largest = max(pending, key=lambda entry: entry["size"] or 0)
+            size = largest["size"] or probe_size
+            throughput = self.measure_throughput(
+                largest["url"], min(probe_size, size)
+            )
+        remaining_bytes = total_bytes - present_bytes
+        eta = remaining_bytes / throughput if throughput else None
+
+        return {
             "course": course_log,
-            "section": section_log,
-            "material": material_log
+            "num_materials": len(materials),
+            "num_duplicates": len(records) - len(resources),
+            "num_files": len(files),
+            "num_pending": len(pending),
+            "total_bytes": total_bytes,
+            "present_bytes": present_bytes,
+            "remaining_bytes": remaining_bytes,
+            "by_type": dict(by_type),
+            "throughput": throughput,
+            "eta": eta,
+            "materials": materials,
         }
-        with open(os.path.join(course_dir, "log.json"), "w") as f:
-            json.dump(download_log, f, indent=2, ensure_ascii=False)
 
-        material_count = {}
-        for k, v in material_log.items():
-            if isinstance(v, dict):
-                material_count[k] = {}
-                for k1, v1 in v.items():
-                    material_count[k][k1] = len(v1)
-            if isinstance(v, list):
-                material_count[k] = len(v)
+    def check_links(self, download_log: Dict, refresh: bool = False) -> Dict:
+        """Check the external URL materials of a downloaded course
 
-        print("material:", json.dumps(material_count, indent=2))
-        return download_log
+        The result of every check is added to the corresponding log entry
+        (as "link") and the download log is saved again.
+
+        Parameters
+        ----------
+        download_log : Dict
+            Download log returned by `download_course`
+        refresh : bool, optional
+            If true, cached results are ignored.
+            The default is False.
+
+        Returns
+        -------
+        Dict
+            Mapping of every external URL to the result of its check
+        """
+        external_log = download_log["material"]["external_url"]
+        entries = [
+            entry
+            for type_entries in external_log.values()
+            for entry in type_entries
+        ]
+        results = self.link_checker.check_all(
+            [entry["external_url"] for entry in entries], refresh=refresh
+        )
+        for entry in entries:
+            link = results[entry["external_url"]]
+            entry["link"] = {
+                k: link[k]
+                for k in ["ok", "status", "final_url", "title", "error"]
+            }
+
+        course_dir = download_log["course"]["local_path"]
+        if os.path.isdir(course_dir):
+            # archives are not rewritten
+            with open(os.path.join(course_dir, "log.json"), "w") as f:
+                json.dump(download_log, f, indent=2, ensure_ascii=False)
+        return results
+
+    def save_html(self, storage: Storage, material_id: str, html: str) -> Dict:
+        """Save the body of an html_text material
+
+        Returns
+        -------
+        Dict
+            "filename" (relative to the storage), "local_path" and "size"
+            of the saved (and possibly compressed) file
+        """
+        filename = "/".join([
+            HTML_DIR,
+            f"{material_id}.html"
+            f"{COMPRESSION_SUFFIXES[self.html_compression]}"
+        ])
+        data = compress((html or "").encode("utf-8"), self.html_compression)
+        storage.write(filename, data)
+        return {
+            "filename": filename,
+            "local_path": storage.path(filename),
+            "size": len(data)
+        }
+
+    @staticmethod
+    def load_html(course_dir: str, material_entry: Dict) -> str:
+        """Read the body of an html_text material from its log entry"""
+        if "html" in material_entry:
+            # logs written by older versions embed the body
+            return material_entry["html"]
+        path = os.path.join(course_dir, material_entry["filename"])
+        return read_compressed(path).decode("utf-8")
+
+    def get_storage(self, course_log: Dict) -> Storage:
+        """Storage backend of a course, as configured"""
+        self.create_download_dir()
+        return create_storage(
+            self.storage_mode, course_log["local_path"], self.session
+        )
+
+    def is_downloaded(
+        self,
+        course_id: str,
+        material_id: str,
+        storage: Storage = None,
+    ) -> bool:
+        """Check if a file material has been downloaded completely"""
+        stored = self.state.get_material(course_id, material_id)
+        if not (
+            stored and
+            stored["status"] == "complete" and
+            stored["size"] is not None
+        ):
+            return False
+        if storage is not None and not storage.resumable:
+            return storage.exists(stored["filename"], stored["size"])
+        return bool(
+            stored["local_path"] and
+            os.path.isfile(stored["local_path"]) and
+            os.path.getsize(stored["local_path"]) == stored["size"]
+        )
+
+    def get_material_count(self, course_id: str) -> Dict or None:
+        """Count materials of a course from the state store"""
+        rows = self.state.material_counts(course_id)
+        if not rows:
+            return None
+
+        material_count = {
+            "file": defaultdict(int),
+            "external_url": defaultdict(int),
+            "html_text": 0,
+            "failed": 0,
+            "unknown": 0
+        }
+        for row in rows:
+            if row["status"] == "failed":
+                material_count["failed"] += row["count"]
+            elif row["source"] in ["file", "external_url"]:
+                material_count[row["source"]][row["type"]] += row["count"]
+            elif row["source"] == "html_text":
+                material_count["html_text"] += row["count"]
+            else:
+                material_count["unknown"] += row["count"]
+        return material_count
 
     def show_course_status(self, course_id: str):
-        c_response = self.get_course_classes(course_id)
-        course = c_response["courses"][0]
-        class_id = course["class_id"]
-        class_name = course["class_name"]
-        class_name_pretty = pretty_name(class_name)
-        tutor_name = course["tutor_name"]
-        print(f"Course: {class_name}")
-        print(f"Teacher: {tutor_name}")
+        course_log = self.get_course_details(course_id)
+        print(f"Course: {course_log['class_name']}")
+        print(f"Teacher: {course_log['tutor_name']}")
+
+        course_dir = course_log["local_path"]
+        material_count = self.get_material_count(course_id)
+        if material_count is not None:
+            stored = self.state.get_course(course_id)
+            if stored is not None:
+                course_dir = stored["local_path"]
+            print(f"Local Path: {course_dir}")
+            print("material:", json.dumps(material_count, indent=2))
+            return
 
-        course_dir = os.path.join(self.download_dir, class_name_pretty)
         if not os.path.isdir(course_dir):
             print("Course has not been downloaded yet.")
             return
@@ -261,4 +1367,11 @@ class Vyoma(EdmingleAPI):
 
         print("material:", json.dumps(material_count, indent=2))
 
+    # ----------------------------------------------------------------------- #
+
+    def close(self):
+        super().close()
+        if self._state is not None:
+            self._state.close()
+
 ###############################################################################
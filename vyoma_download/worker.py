@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Queue Worker
+
+Syncs courses from a shared `WorkQueue`, so that a mirror of many courses
+can be spread across several worker processes. A course job walks the
+curriculum and enqueues a job for every section, and a section job
+enqueues a job for every material. Any worker may pick up any job,
+materials first, so the transfers of a large course are shared by all the
+workers. The worker that finishes the last job of a course writes its
+download log.
+
+Materials are stored in the course directory (the "dir" storage), since
+an archive cannot be written by several processes.
+
+@author: Hrishikesh Terdalkar
+"""
+
+import logging
+import os
+import socket
+import threading
+from typing import Dict, List
+
+from .records import MaterialRecord
+from .vyoma import Vyoma
+from .workqueue import (
+    Heartbeat, Job, WorkQueue, LEASE_DURATION, QUEUE_FILE, RETRY_DELAY
+)
+
+###############################################################################
+
+# interval at which an idle worker polls the queue (in seconds)
+POLL_INTERVAL = 1.0
+
+# materials are leased before sections, and sections before courses
+PRIORITIES = {"course": 0, "section": 1, "material": 2}
+
+LOGGER = logging.getLogger(__name__)
+
+###############################################################################
+
+
+class JobFailed(Exception):
+    """A job could not be completed"""
+
+# --------------------------------------------------------------------------- #
+
+
+class QueueWorker:
+    def __init__(
+        self,
+        vyoma: Vyoma,
+        queue: WorkQueue = None,
+        threads: int = 1,
+        lease_duration: float = LEASE_DURATION,
+        retry_delay: float = RETRY_DELAY,
+        poll_interval: float = POLL_INTERVAL,
+        name: str = None,
+    ):
+        """Worker that runs the sync jobs of a queue
+
+        Parameters
+        ----------
+        vyoma : Vyoma
+            Signed-in session, whose download directory is shared by all
+            the workers
+        queue : WorkQueue, optional
+            Queue of jobs.
+            The default is None, which opens QUEUE_FILE in the download
+            directory of the session.
+        threads : int, optional
+            Number of jobs run concurrently by the worker.
+            The default is 1.
+        lease_duration : float, optional
+            Duration of a lease, after which the job of a dead worker is
+            handed to another worker.
+            The default is LEASE_DURATION.
+        retry_delay : float, optional
+            Delay before the first retry of a failed job.
+            The default is RETRY_DELAY.
+        poll_interval : float, optional
+            Interval at which the queue is polled while no job is available.
+            The default is POLL_INTERVAL.
+        name : str, optional
+            Name of the worker.
+            The default is None, which uses the host name and process ID.
+        """
+        self.vyoma = vyoma
+        self.queue = queue or WorkQueue(
+            os.path.join(vyoma.download_dir, QUEUE_FILE)
+        )
+        self.threads = max(threads, 1)
+        self.lease_duration = lease_duration
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.stats = {"done": 0, "failed": 0, "lost": 0}
+        self.handlers = {
+            "course": self.run_course,
+            "section": self.run_section,
+            "material": self.run_material,
+        }
+
+    # ----------------------------------------------------------------------- #
+
+    def add_course(self, course_id: str) -> bool:
+        """Enqueue the sync of a course, returning False if it is running
+
+        The jobs of an earlier sync of the course are replaced, so that its
+        curriculum is walked again and new materials are fetched.
+        """
+        course_id = str(course_id)
+        return self.queue.put_batch(
+            "course", f"course:{course_id}", {"course_id": course_id},
+            batch=course_id, priority=PRIORITIES["course"]
+        )
+
+    def run_course(self, payload: Dict):
+        """Record a course and enqueue its sections"""
+        vyoma = self.vyoma
+        course_id = payload["course_id"]
+        course_log = vyoma.get_course_details(course_id)
+        os.makedirs(course_log["local_path"], exist_ok=True)
+        vyoma.state.update_course(course_log)
+
+        cr_response = vyoma.get_class_resources(course_log["class_id"])
+        self.queue.put_many([
+            ("section", f"section:{course_id}:{section_details[0]}", {
+                "course_id": course_id,
+                "class_id": course_log["class_id"],
+                "section_id": section_details[0],
+                "position": position,
+                "course_dir": course_log["local_path"],
+            })
+            for position, section_details in enumerate(
+                cr_response["sections"]
+            )
+        ], priority=PRIORITIES["section"], batch=course_id)
+
+    def run_section(self, payload: Dict):
+        """Record a section and enqueue its materials"""
+        course_id = payload["course_id"]
+        sr_response = self.vyoma.get_section_resources(
+            payload["class_id"], payload["section_id"]
+        )
+        section = sr_response["section"]
+        self.vyoma.state.update_section(course_id, {
+            "id": payload["section_id"],
+            "name": section["name"],
+            "num_materials": section["num_materials"],
+        }, payload["position"])
+
+        records = [
+            MaterialRecord(
+                course_id=course_id,
+                class_id=payload["class_id"],
+                section_id=payload["section_id"],
+                material_id=resource[1],
+                position=idx,
+                name=resource[3],
+                type=resource[4],
+                source=resource[-3],
+                course_dir=payload["course_dir"],
+            )
+            for idx, resource in enumerate(sr_response["resources"])
+        ]
+        # a material that appears in several sections is fetched once,
+        # and its state is copied to the other sections
+        self.vyoma.state.add_materials(
+            course_id, [record.log_entry() for record in records]
+        )
+        self.queue.put_many([
+            (
+                "material", f"material:{course_id}:{record.material_id}",
+                material_payload(record)
+            )
+            for record in records
+        ], priority=PRIORITIES["material"], batch=course_id)
+
+    def run_material(self, payload: Dict):
+        """Download (or save) a material"""
+        result = self.vyoma.fetch_material(MaterialRecord(**payload))
+        self.vyoma.state.copy_material(
+            payload["course_id"], payload["section_id"],
+            payload["material_id"]
+        )
+        if result.status == "failed":
+            entry = result.entry
+            raise JobFailed(entry.get("error") or entry.get("response"))
+
+    # ----------------------------------------------------------------------- #
+
+    def run_job(self, job: Job) -> bool:
+        """Run a leased job, returning True if it was completed"""
+        with Heartbeat(self.queue, job, self.lease_duration) as heartbeat:
+            try:
+                self.handlers[job.kind](job.payload)
+                error = None
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+
+        if heartbeat.lost.is_set():
+            LOGGER.warning(f"Lease of '{job.key}' was lost.")
+            outcome = "lost"
+        elif error is None:
+            outcome = "done" if self.queue.complete(job) else "lost"
+        else:
+            LOGGER.warning(
+                f"'{job.key}' failed (attempt {job.attempts}/"
+                f"{job.max_attempts}): {error}"
+            )
+            self.queue.fail(job, error, self.retry_delay)
+            outcome = "failed"
+        with self.lock:
+            self.stats[outcome] += 1
+        if job.batch is not None and not self.queue.active(job.batch):
+            self.finish_course(job.batch)
+        return outcome == "done"
+
+    def finish_course(self, course_id: str):
+        """Write the download log of a course whose jobs have finished"""
+        try:
+            self.vyoma.write_state_log(course_id)
+        except OSError as e:
+            # the last jobs of a course may finish on two workers at once
+            LOGGER.warning(f"Could not write the log of '{course_id}': {e}")
+        else:
+            LOGGER.info(f"Course '{course_id}' is synced.")
+
+    def work(self, stop_when_idle: bool = True):
+        """Run jobs until the queue is drained (or the worker is stopped)"""
+        while not self.stopped.is_set():
+            job = self.queue.lease(self.name, self.lease_duration)
+            if job is None:
+                # jobs leased by other workers may still add jobs, or fail
+                if stop_when_idle and not self.queue.active():
+                    return
+                self.stopped.wait(self.poll_interval)
+                continue
+            LOGGER.debug(f"Running '{job.key}' (attempt {job.attempts})")
+            self.run_job(job)
+
+    def run(self, stop_when_idle: bool = True) -> Dict[str, int]:
+        """Run jobs on the threads of the worker
+
+        Parameters
+        ----------
+        stop_when_idle : bool, optional
+            If true, the worker stops once no job is pending or leased.
+            Otherwise, it waits for new jobs until it is stopped.
+            The default is True.
+
+        Returns
+        -------
+        Dict[str, int]
+            Number of jobs done, failed and lost by the worker
+        """
+        threads: List[threading.Thread] = [
+            threading.Thread(
+                target=self.work, args=(stop_when_idle,),
+                name=f"worker-{idx}", daemon=True
+            )
+            for idx in range(self.threads)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=self.poll_interval)
+        except KeyboardInterrupt:
+            # running jobs are finished, their leases are not abandoned
+            LOGGER.info("Stopping after the running jobs ...")
+            self.stop()
+            for thread in threads:
+                thread.join()
+        return dict(self.stats)
+
+    def stop(self):
+        self.stopped.set()
+
+    def close(self):
+        self.queue.close()
+
+###############################################################################
+
+
+def material_payload(record: MaterialRecord) -> Dict:
+    """Fields of a material record that identify it in a job"""
+    fields = [
+        "course_id", "class_id", "section_id", "material_id", "position",
+        "name", "type", "source", "course_dir",
+    ]
+    return {field: getattr(record, field) for field in fields}
+
+###############################################################################
@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Durable Work Queue
+
+Jobs (courses, sections and materials to sync) are kept in a SQLite
+database under the download root, shared by the worker processes of a
+host. (The database uses write-ahead logging, which needs shared memory,
+so it must not be on a network filesystem.) A worker leases a job for a
+limited time and extends the lease with heartbeats while it runs. If a
+worker dies, its lease expires and the job is handed to another worker. A
+job that fails is retried with exponential backoff, up to a maximum number
+of attempts.
+
+Jobs are identified by a key, so enqueueing the same job twice (e.g., when
+a job that expands into child jobs is run again) has no effect. Jobs may
+belong to a batch (e.g., the jobs of a course), which can be run again
+from scratch once all of its jobs have finished.
+
+@author: Hrishikesh Terdalkar
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Tuple
+
+from .state import BUSY_TIMEOUT
+
+###############################################################################
+
+QUEUE_FILE = ".vyoma-queue.sqlite3"
+
+# a lease is extended by heartbeats every third of its duration
+LEASE_DURATION = 120.0
+MAX_ATTEMPTS = 3
+# delay before the first retry of a failed job, doubled for every attempt
+RETRY_DELAY = 5.0
+JOB_STATUSES = ["pending", "leased", "done", "failed"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    batch TEXT,
+    priority INTEGER NOT NULL DEFAULT 0,
+    payload TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker TEXT,
+    available_at REAL NOT NULL,
+    lease_expires REAL,
+    error TEXT,
+    created_at REAL,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_available
+    ON jobs (status, priority, job_id);
+CREATE INDEX IF NOT EXISTS jobs_batch
+    ON jobs (batch, status);
+"""
+
+###############################################################################
+
+
+@dataclass
+class Job:
+    job_id: int
+    key: str
+    kind: str
+    payload: Dict
+    attempts: int
+    max_attempts: int
+    worker: str
+    batch: str = None
+
+# --------------------------------------------------------------------------- #
+
+
+class WorkQueue:
+    def __init__(self, path: str, timeout: float = BUSY_TIMEOUT):
+        """SQLite-backed queue of jobs shared by worker processes
+
+        Parameters
+        ----------
+        path : str
+            Path of the SQLite database
+        timeout : float, optional
+            Time to wait for a lock held by another process, in seconds.
+            The default is BUSY_TIMEOUT.
+        """
+        self.path = path
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(
+            path, timeout=timeout, check_same_thread=False,
+            isolation_level=None
+        )
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            else:
+                self.connection.execute("COMMIT")
+
+    def query(self, sql: str, parameters=()) -> List[Dict]:
+        with self.lock:
+            rows = self.connection.execute(sql, parameters).fetchall()
+        return [dict(row) for row in rows]
+
+    # ----------------------------------------------------------------------- #
+
+    def put(
+        self,
+        kind: str,
+        key: str,
+        payload: Dict,
+        priority: int = 0,
+        max_attempts: int = MAX_ATTEMPTS,
+        batch: str = None,
+    ) -> bool:
+        """Add a job, unless a job with the same key exists
+
+        Parameters
+        ----------
+        kind : str
+            Kind of the job (e.g., "course")
+        key : str
+            Unique key of the job
+        payload : Dict
+            JSON-serializable parameters of the job
+        priority : int, optional
+            Jobs with a higher priority are leased first.
+            The default is 0.
+        max_attempts : int, optional
+            Number of attempts after which the job is marked as failed.
+            The default is MAX_ATTEMPTS.
+        batch : str, optional
+            Batch of the job.
+            The default is None.
+
+        Returns
+        -------
+        bool
+            True if the job was added
+        """
+        return self.put_many(
+            [(kind, key, payload)], priority, max_attempts, batch
+        ) == 1
+
+    def put_many(
+        self,
+        jobs: Iterable[Tuple[str, str, Dict]],
+        priority: int = 0,
+        max_attempts: int = MAX_ATTEMPTS,
+        batch: str = None,
+    ) -> int:
+        """Add several (kind, key, payload) jobs in one transaction
+
+        Returns
+        -------
+        int
+            Number of jobs added
+        """
+        with self.transaction() as db:
+            return self._insert(db, jobs, priority, max_attempts, batch)
+
+    def put_batch(
+        self,
+        kind: str,
+        key: str,
+        payload: Dict,
+        batch: str,
+        priority: int = 0,
+        max_attempts: int = MAX_ATTEMPTS,
+    ) -> bool:
+        """Add the first job of a batch, running the batch again
+
+        The finished (done or failed) jobs of the batch are removed, so that
+        the jobs it expands into are run again, unless a job of the batch is
+        still pending or leased.
+
+        Returns
+        -------
+        bool
+            True if the job was added, False if the batch is running
+        """
+        with self.transaction() as db:
+            running = db.execute(
+                "SELECT 1 FROM jobs WHERE batch = ? AND "
+                "status IN ('pending', 'leased') LIMIT 1",
+                (batch,)
+            ).fetchone()
+            if running is not None:
+                return False
+            db.execute("DELETE FROM jobs WHERE batch = ?", (batch,))
+            return self._insert(
+                db, [(kind, key, payload)], priority, max_attempts, batch
+            ) == 1
+
+    def _insert(
+        self,
+        db: sqlite3.Connection,
+        jobs: Iterable[Tuple[str, str, Dict]],
+        priority: int,
+        max_attempts: int,
+        batch: str,
+    ) -> int:
+        now = time.time()
+        added = 0
+        for kind, key, payload in jobs:
+            cursor = db.execute(
+                "INSERT OR IGNORE INTO jobs (key, kind, batch, priority, "
+                "payload, max_attempts, available_at, created_at, "
+                "updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key, kind, batch, priority,
+                    json.dumps(payload, ensure_ascii=False),
+                    max_attempts, now, now, now
+                )
+            )
+            added += cursor.rowcount
+        return added
+
+    def lease(
+        self,
+        worker: str,
+        duration: float = LEASE_DURATION,
+    ) -> Job or None:
+        """Lease the next available job
+
+        Pending jobs whose retry delay has passed are available, and so are
+        leased jobs whose lease has expired (their worker is presumed dead).
+        Expired jobs without attempts left are marked as failed.
+
+        Parameters
+        ----------
+        worker : str
+            Identifier of the worker
+        duration : float, optional
+            Duration of the lease, in seconds.
+            The default is LEASE_DURATION.
+
+        Returns
+        -------
+        Job or None
+            Leased job, None if no job is available
+        """
+        now = time.time()
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE jobs SET status = 'failed', updated_at = ?, "
+                "error = 'lease expired after the last attempt' "
+                "WHERE status = 'leased' AND lease_expires < ? "
+                "AND attempts >= max_attempts",
+                (now, now)
+            )
+            row = db.execute(
+                "SELECT * FROM jobs WHERE "
+                "(status = 'pending' AND available_at <= ?) OR "
+                "(status = 'leased' AND lease_expires < ?) "
+                "ORDER BY priority DESC, job_id LIMIT 1",
+                (now, now)
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE jobs SET status = 'leased', worker = ?, "
+                "lease_expires = ?, attempts = attempts + 1, updated_at = ? "
+                "WHERE job_id = ?",
+                (worker, now + duration, now, row["job_id"])
+            )
+        return Job(
+            job_id=row["job_id"],
+            key=row["key"],
+            kind=row["kind"],
+            payload=json.loads(row["payload"] or "{}"),
+            attempts=row["attempts"] + 1,
+            max_attempts=row["max_attempts"],
+            worker=worker,
+            batch=row["batch"],
+        )
+
+    def _update_leased(self, job: Job, assignments: str, parameters) -> bool:
+        """Update a job, if it is still leased by the worker"""
+        with self.transaction() as db:
+            cursor = db.execute(
+                f"UPDATE jobs SET {assignments}, updated_at = ? "
+                "WHERE job_id = ? AND worker = ? AND status = 'leased'",
+                (*parameters, time.time(), job.job_id, job.worker)
+            )
+        return cursor.rowcount == 1
+
+    def heartbeat(self, job: Job, duration: float = LEASE_DURATION) -> bool:
+        """Extend the lease of a job, returning False if it has been lost"""
+        return self._update_leased(
+            job, "lease_expires = ?", (time.time() + duration,)
+        )
+
+    def complete(self, job: Job) -> bool:
+        return self._update_leased(
+            job, "status = 'done', lease_expires = NULL, error = NULL", ()
+        )
+
+    def fail(
+        self,
+        job: Job,
+        error: str,
+        retry_delay: float = RETRY_DELAY,
+    ) -> bool:
+        """Record a failed attempt, scheduling a retry if attempts are left
+
+        Parameters
+        ----------
+        job : Job
+            Leased job
+        error : str
+            Description of the failure
+        retry_delay : float, optional
+            Delay before the first retry, doubled for every attempt.
+            The default is RETRY_DELAY.
+
+        Returns
+        -------
+        bool
+            False if the job is no longer leased by the worker
+        """
+        if job.attempts >= job.max_attempts:
+            return self._update_leased(
+                job, "status = 'failed', lease_expires = NULL, error = ?",
+                (error,)
+            )
+        delay = retry_delay * 2 ** (job.attempts - 1)
+        return self._update_leased(
+            job,
+            "status = 'pending', lease_expires = NULL, error = ?, "
+            "available_at = ?",
+            (error, time.time() + delay)
+        )
+
+    def release(self, job: Job) -> bool:
+        """Return a job to the queue without counting the attempt"""
+        return self._update_leased(
+            job,
+            "status = 'pending', lease_expires = NULL, "
+            "attempts = attempts - 1",
+            ()
+        )
+
+    def retry_failed(self) -> int:
+        """Make the failed jobs available again, returning their number"""
+        with self.transaction() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET status = 'pending', attempts = 0, "
+                "available_at = ?, updated_at = ? WHERE status = 'failed'",
+                (time.time(), time.time())
+            )
+        return cursor.rowcount
+
+    # ----------------------------------------------------------------------- #
+
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs by status"""
+        counts = dict.fromkeys(JOB_STATUSES, 0)
+        for row in self.query(
+            "SELECT status, COUNT(*) AS count FROM jobs GROUP BY status"
+        ):
+            counts[row["status"]] = row["count"]
+        return counts
+
+    def active(self, batch: str = None) -> int:
+        """Number of jobs (of a batch, if given) that are pending or leased"""
+        sql = (
+            "SELECT COUNT(*) AS count FROM jobs WHERE "
+            "status IN ('pending', 'leased')"
+        )
+        parameters = ()
+        if batch is not None:
+            sql += " AND batch = ?"
+            parameters = (batch,)
+        return self.query(sql, parameters)[0]["count"]
+
+    def failed_jobs(self) -> List[Dict]:
+        return self.query(
+            "SELECT key, kind, attempts, error FROM jobs "
+            "WHERE status = 'failed' ORDER BY job_id"
+        )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+###############################################################################
+
+
+class Heartbeat:
+    def __init__(
+        self,
+        queue: WorkQueue,
+        job: Job,
+        duration: float = LEASE_DURATION,
+    ):
+        """Keep the lease of a job alive while it runs
+
+        Usage
+        -----
+        with Heartbeat(queue, job) as heartbeat:
+            run(job)
+        if not heartbeat.lost.is_set():
+            queue.complete(job)
+
+        Parameters
+        ----------
+        queue : WorkQueue
+            Queue of the job
+        job : Job
+            Leased job
+        duration : float, optional
+            Duration by which the lease is extended, every third of which
+            a heartbeat is sent.
+            The default is LEASE_DURATION.
+        """
+        self.queue = queue
+        self.job = job
+        self.duration = duration
+        self.stopped = threading.Event()
+        self.lost = threading.Event()
+        self.thread = threading.Thread(
+            target=self._beat, name=f"heartbeat-{job.job_id}", daemon=True
+        )
+
+    def _beat(self):
+        while not self.stopped.wait(self.duration / 3):
+            try:
+                alive = self.queue.heartbeat(self.job, self.duration)
+            except sqlite3.Error:
+                # the lease is extended at the next heartbeat
+                continue
+            if not alive:
+                self.lost.set()
+                return
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+###############################################################################